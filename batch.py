@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def budget_limit(cap, remaining, calls_per_job, floor):
+    """How many jobs may run at once without eating into the rate-limit floor.
+
+    `remaining` is the account's last reported RateLimit-Remaining (None if
+    no request has reported one yet). Never below 1: a batch always makes
+    progress, the client's throttle then paces it.
+    """
+    if remaining is None:
+        return max(1, cap)
+    spare = remaining - floor
+    return max(1, min(cap, spare // max(1, calls_per_job)))
+
+
+async def retry(call, transient, attempts=3, delay=1.0):
+    """`await call()` until it returns something other than None.
+
+    A None is tried again only while `transient()` says the failure is worth
+    it, waiting `delay`, then twice as long, between tries. Returns
+    (result, tries).
+    """
+    for attempt in range(1, attempts + 1):
+        result = await call()
+        if result is not None or attempt == attempts or not transient():
+            return result, attempt
+        await asyncio.sleep(delay * 2 ** (attempt - 1))
+
+
+async def run_bounded(items, worker, limit, on_change=None):
+    """Run `worker(item, note)` for every item, at most `limit` at a time.
+
+    The worker returns (ok, detail) and may call `note(detail)` to report
+    how it is getting on; an exception counts as a failure with the error as
+    its detail. `on_change(item, state, detail)` is called as each item
+    starts ("running"), reports, and ends ("ok" / "failed"); it must not
+    block.
+
+    Returns [(item, ok, detail)] in the order of `items`.
+    """
+    gate = asyncio.Semaphore(max(1, limit))
+
+    def emit(item, state, detail=""):
+        if on_change:
+            on_change(item, state, detail)
+
+    async def one(item):
+        async with gate:
+            emit(item, "running")
+            try:
+                ok, detail = await worker(item, lambda d: emit(item, "running", d))
+            except Exception as e:
+                logger.error(f"Batch job {item!r} failed: {e}")
+                ok, detail = False, str(e)
+            emit(item, "ok" if ok else "failed", detail)
+            return item, ok, detail
+
+    return await asyncio.gather(*(one(item) for item in items))
+
+
+def demo():
+    import time
+    running = peak = 0
+    seen = []
+
+    async def worker(n, note):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        note(f"half way {n}")
+        await asyncio.sleep(0.02)
+        running -= 1
+        if n == 3:
+            raise RuntimeError("boom")
+        return n % 2 == 0, f"done {n}"
+
+    start = time.perf_counter()
+    results = asyncio.run(run_bounded(range(10), worker, 4, lambda *e: seen.append(e)))
+    took = time.perf_counter() - start
+    assert peak == 4 and 0.06 <= took < 0.15, (peak, took)     # 3 rounds of 4, 4, 2
+    assert [r[0] for r in results] == list(range(10))
+    assert results[2] == (2, True, "done 2") and results[3] == (3, False, "boom")
+    assert (5, "running", "half way 5") in seen and (5, "failed", "done 5") in seen
+
+    answers = iter([None, None, {"ok": 1}])
+    flaky = lambda: asyncio.sleep(0, next(answers))
+    assert asyncio.run(retry(flaky, lambda: True, delay=0)) == ({"ok": 1}, 3)
+    assert asyncio.run(retry(lambda: asyncio.sleep(0), lambda: False, delay=0)) == (None, 1)
+    assert asyncio.run(retry(lambda: asyncio.sleep(0, {}), lambda: True, delay=0)) == ({}, 1)
+
+    assert budget_limit(5, None, 10, 200) == 5
+    assert budget_limit(5, 3000, 10, 200) == 5
+    assert budget_limit(5, 230, 10, 200) == 3
+    assert budget_limit(5, 150, 10, 200) == 1
+    print('batch demo OK')
+
+
+if __name__ == '__main__':
+    demo()
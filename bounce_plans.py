@@ -0,0 +1,165 @@
+import logging
+from phase_timings import phase_timings
+from utils import type_family, type_price
+
+logger = logging.getLogger(__name__)
+
+DURATION_STEP = 5.0                 # seconds; closer than this counts as equally fast
+HOURS_PER_MONTH = 730               # to prorate a plan that only quotes a monthly price
+
+
+def can_bounce_through(current, t):
+    """Whether a traffic reset may pass `current` through plan `t`.
+
+    The target has to be at least as big as the current plan in every
+    dimension, disk included: the change runs with upgrade_disk=False so the
+    disk is never grown, and a type whose disk is smaller than the server
+    already has is not a valid target. It has to be a different size, of
+    the same architecture, and not deprecated.
+    """
+    cores, memory, disk = (current.get(k, 0) or 0 for k in ('cores', 'memory', 'disk'))
+    t_cores, t_memory, t_disk = (t.get(k, 0) or 0 for k in ('cores', 'memory', 'disk'))
+    return (
+        t.get('name') != current.get('name')
+        and t.get('architecture') == current.get('architecture')
+        and not t.get('deprecation')
+        and t_cores >= cores and t_memory >= memory and t_disk >= disk
+        and (t_cores, t_memory) != (cores, memory)
+    )
+
+
+def hourly_price(t, location):
+    """Net hourly price of plan `t` at a location."""
+    entry = next((p for p in t.get('prices', []) if p.get('location') == location), None)
+    try:
+        return float(((entry or {}).get('price_hourly') or {}).get('net'))
+    except (TypeError, ValueError):
+        return type_price(t, location) / HOURS_PER_MONTH
+
+
+class BounceTable:
+    """The plans a traffic reset can bounce each server type through.
+
+    Built once from the /server_types payload: for every (architecture,
+    location, current type) the valid targets (see can_bounce_through).
+    Each list is ranked, best first, by
+
+      1. same family as the current plan — the server stays close to what
+         it was for the minutes it spends there;
+      2. how long the change there and back has taken (phase_timings),
+         in steps of DURATION_STEP;
+      3. what those minutes on the plan cost, prorated from its hourly
+         price.
+
+    `pick` is a dict lookup. A ranking is redone, for its key only, the
+    first time it is read after phase_timings has learnt something new; a
+    new type catalogue builds a new table (see `refresh`).
+    """
+
+    def __init__(self, server_types, timings=phase_timings):
+        self.server_types = server_types or []
+        self.timings = timings
+        self._by_name = {t.get('name'): t for t in self.server_types if t.get('name')}
+        self._ranked = {}            # (arch, location, type) -> (timings version, [target type])
+        locations = {p.get('location') for t in self.server_types for p in t.get('prices', [])}
+        for current in self.server_types:
+            for location in locations:
+                self._rank(current, location)
+
+    @classmethod
+    def refresh(cls, table, server_types, timings=phase_timings):
+        """`table` if it was built from this catalogue, else a new one."""
+        if table is not None and table.timings is timings:
+            if table.server_types is server_types:
+                return table
+            if table.server_types == (server_types or []):
+                table.server_types = server_types or []
+                return table
+        logger.info("Rebuilding bounce plan table")
+        return cls(server_types, timings)
+
+    def _rank(self, current, location):
+        key = (current.get('architecture'), location, current.get('name'))
+        targets = [t for t in self.server_types if can_bounce_through(current, t)]
+        family = type_family(current.get('name', ''))
+        back = self.timings.estimate('change_type', current.get('name'), location)
+        on_plan_extra = (self.timings.estimate('power_on', None, location)
+                         + self.timings.estimate('power_off', None, location))
+
+        def rank(t):
+            seconds = self.timings.estimate('change_type', t['name'], location) + back
+            cost = hourly_price(t, location) * (seconds + on_plan_extra) / 3600
+            return (type_family(t['name']) != family, round(seconds / DURATION_STEP), cost)
+
+        self._ranked[key] = (self.timings.version, sorted(targets, key=rank))
+        return self._ranked[key][1]
+
+    def targets(self, current, location):
+        """Every valid bounce plan for `current` at `location`, best first."""
+        current = self._by_name.get(current.get('name'), current)
+        hit = self._ranked.get((current.get('architecture'), location, current.get('name')))
+        if hit is None or hit[0] != self.timings.version:
+            return self._rank(current, location)
+        return hit[1]
+
+    def pick(self, current, location):
+        """The best plan to bounce `current` through at `location`, or None."""
+        ranked = self.targets(current, location)
+        return ranked[0] if ranked else None
+
+
+def demo():
+    import os
+    import tempfile
+    from phase_timings import PhaseTimings
+
+    def t(name, cores, mem, disk, hourly, arch='x86', dep=None):
+        return {'name': name, 'cores': cores, 'memory': mem, 'disk': disk, 'architecture': arch,
+                'deprecation': dep, 'prices': [
+                    {'location': loc, 'price_hourly': {'net': str(hourly)}, 'price_monthly': {'net': '1'}}
+                    for loc in ('fsn1', 'hel1')]}
+
+    types = [
+        t('cx22', 2, 4, 40, 0.006), t('cx32', 4, 8, 80, 0.011), t('cx42', 8, 16, 160, 0.026),
+        t('cpx21', 3, 4, 80, 0.013), t('cax11', 2, 4, 40, 0.005, arch='arm'),
+        t('cax21', 4, 8, 80, 0.009, arch='arm'), t('cx99', 16, 32, 320, 0.001, dep={'announced': 'x'}),
+    ]
+    by = {x['name']: x for x in types}
+    timings = PhaseTimings(os.path.join(tempfile.mkdtemp(), 't.json'))
+    table = BounceTable(types, timings)
+
+    # nothing measured: same family, then cheapest
+    assert [x['name'] for x in table.targets(by['cx22'], 'fsn1')] == ['cx32', 'cx42', 'cpx21']
+    assert table.pick(by['cax11'], 'fsn1')['name'] == 'cax21'
+    assert table.pick(by['cx42'], 'fsn1') is None                   # nothing bigger that is live
+    assert table.pick({'name': 'gone1', 'cores': 1, 'memory': 2, 'disk': 20,
+                       'architecture': 'x86'}, 'nbg1')['name'] == 'cx22'   # unknown type, unknown place
+
+    # cx32 turns out slow to switch to in fsn1: cx42 is faster there, and dearer only by cents
+    for name, seconds in (('cx22', 40), ('cx42', 40), ('cx42', 45), ('cx32', 140), ('cx32', 150), ('cx32', 160)):
+        timings.record('change_type', name, 'fsn1', seconds)
+    assert table.pick(by['cx22'], 'fsn1')['name'] == 'cx42'
+    assert table.pick(by['cx22'], 'hel1')['name'] == 'cx42'         # nothing from hel1 yet: fsn1's apply
+    for seconds in (30, 35):
+        timings.record('change_type', 'cx32', 'hel1', seconds)
+    assert table.pick(by['cx22'], 'hel1')['name'] == 'cx32'
+
+    # the same catalogue keeps the table; a changed one builds a new one
+    assert BounceTable.refresh(table, types, timings) is table
+    assert BounceTable.refresh(table, [dict(x) for x in types], timings) is table
+    assert BounceTable.refresh(table, types[:3], timings) is not table
+
+    # a pick is a lookup, not a scan of the catalogue
+    import time
+    big = types + [t(f'cx{i}', 2 + i, 4 + i, 40 + i, 0.01 + i / 1000) for i in range(100, 400)]
+    table = BounceTable(big, timings)
+    start = time.perf_counter()
+    for _ in range(10000):
+        table.pick(by['cx22'], 'fsn1')
+    took = time.perf_counter() - start
+    assert took < 0.5, took
+    print(f'bounce_plans demo OK ({took / 10000 * 1e6:.1f} µs per pick over {len(big)} types)')
+
+
+if __name__ == '__main__':
+    demo()
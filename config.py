@@ -18,6 +18,27 @@ class Config:
     
     DATA_FILE = 'server_data.csv'
 
+    # Seconds between edits of a progress message (reset, resize, IP jobs)
+    PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 3))
+
+    # Most servers one bulk action works on at the same time
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 5))
+
+    # Traffic resets run at the same time per account, and seconds between
+    # the shared status checks that tell them a step has finished
+    RESET_CONCURRENCY = int(os.getenv('RESET_CONCURRENCY', 3))
+    RESET_POLL_INTERVAL = float(os.getenv('RESET_POLL_INTERVAL', 5))
+
+    # Long jobs (resets, plan changes, rebuilds, IP swaps, volume changes,
+    # bulk actions) running at the same time; the rest wait their turn
+    JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 4))
+
+    # What an hour of a server being down is worth to you (€), weighed
+    # against the overage when deciding between a reset and paying
+    RESET_DOWNTIME_COST = float(os.getenv('RESET_DOWNTIME_COST', 0))
+    # Reset servers by themselves when the reset-or-pay advice says it is time
+    AUTO_RESET = os.getenv('AUTO_RESET', 'false').lower() == 'true'
+
     # Multi-account: HETZNER_API_TOKEN may hold several tokens separated by
     # comma/newline, each optionally "Name=token". One plain token still works.
     @staticmethod
@@ -0,0 +1,246 @@
+"""Cost report arithmetic, with no API calls, files or Telegram in it.
+
+`compute` takes a snapshot of everything the report is made from and
+returns every figure it shows, so the Telegram screen, the JSON export and
+the benchmark all work from one result.
+
+Snapshot:
+  {
+    "accounts": [{"name", "servers", "index", "images", "floating_ips",
+                  "primary_ips", "volumes", "overage": {server id: €}}],
+    "overrides": {"<server id>": € per month},     # PriceStore.all()
+    "tracker": OverageTracker.summary(),
+  }
+
+`index` is the account's PricingIndex. Each account's servers are laid out
+as columns — one list per field — and summed column by column, which keeps
+a fleet of thousands to a handful of passes over flat lists.
+"""
+
+import calendar
+import time
+from datetime import datetime
+from utils import location_name, traffic_limit_tb, type_price
+
+
+def _server_columns(acct, overrides):
+    servers = acct.get("servers") or []
+    index = acct.get("index")
+    ids = [s["id"] for s in servers]
+    listed = [
+        type_price(s.get("server_type", {}), location_name(s), index) for s in servers
+    ]
+    custom = [str(i) in overrides for i in ids]
+    price = [overrides[str(i)] if c else p for i, c, p in zip(ids, custom, listed)]
+    backup = [bool(s.get("backup_window")) for s in servers]
+    backup_pct = index.backup_pct if index is not None else 20.0
+    backup_cost = [p * backup_pct / 100 if b else 0.0 for p, b in zip(price, backup)]
+    owed = acct.get("overage") or {}
+    overage = [owed.get(i, 0) for i in ids]
+    return {
+        "id": ids,
+        "name": [s.get("name", "Unnamed") for s in servers],
+        "type": [s.get("server_type", {}).get("name", "?") for s in servers],
+        "price": price,
+        "custom": custom,
+        "traffic": [s.get("outgoing_traffic", 0) for s in servers],
+        "limit_tb": [traffic_limit_tb(s) for s in servers],
+        "backup": backup,
+        "backup_cost": backup_cost,
+        "overage": overage,
+    }
+
+
+def _account(acct, overrides):
+    index = acct.get("index")
+    cols = _server_columns(acct, overrides)
+    images = acct.get("images") or []
+    fips = acct.get("floating_ips") or []
+    pips = acct.get("primary_ips") or []
+    volumes = acct.get("volumes") or []
+
+    unassigned = [p for p in pips if not p.get("assignee_id")]
+    snap_size = sum(i.get("image_size") or 0 for i in images)
+    vol_size = sum(v.get("size") or 0 for v in volumes)
+    image_per_gb = index.image_per_gb if index is not None else 0.0
+    volume_per_gb = index.volume_per_gb if index is not None else 0.0
+    resources = {
+        "snapshots": {"count": len(images), "size": snap_size, "cost": snap_size * image_per_gb},
+        "volumes": {"count": len(volumes), "size": vol_size, "cost": vol_size * volume_per_gb},
+        "backups": {"count": sum(cols["backup"]), "cost": sum(cols["backup_cost"])},
+        "floating_ips": {
+            "count": len(fips),
+            "cost": sum(index.floating_ip_price(f) for f in fips) if index is not None else 0.0,
+        },
+        "primary_ips": {
+            "assigned": len(pips) - len(unassigned),
+            "unassigned": len(unassigned),
+            "cost": sum(index.primary_ip_price(p) for p in unassigned) if index is not None else 0.0,
+        },
+    }
+    server_cost = sum(cols["price"])
+    overage = sum(cols["overage"])
+    # every rate is this account's own, so an account that is not charged
+    # VAT does not inherit another account's rate
+    subtotal = (
+        server_cost + overage + resources["backups"]["cost"]
+        + resources["snapshots"]["cost"] + resources["volumes"]["cost"]
+        + resources["floating_ips"]["cost"] + resources["primary_ips"]["cost"]
+    )
+    vat_rate = index.vat_rate if index is not None else 0.0
+    return cols, {
+        "name": acct.get("name", ""),
+        "servers": len(cols["id"]),
+        "server_cost": server_cost,
+        "overage": overage,
+        "resources": resources,
+        "subtotal": subtotal,
+        "vat_rate": vat_rate,
+        "vat": subtotal * vat_rate / 100,
+    }
+
+
+def compute(snapshot, now=None):
+    """Every figure of the cost report, as plain data (JSON-serialisable)."""
+    now = now or datetime.now()
+    overrides = snapshot.get("overrides") or {}
+    tracker = snapshot.get("tracker") or {}
+
+    servers, accounts = [], []
+    for acct in snapshot.get("accounts") or []:
+        cols, summary = _account(acct, overrides)
+        accounts.append(summary)
+        servers.extend(
+            {"account": summary["name"], **dict(zip(cols, row))}
+            for row in zip(*cols.values())
+        )
+
+    resources = {}
+    for key in ("snapshots", "volumes", "backups", "floating_ips", "primary_ips"):
+        merged = {}
+        for a in accounts:
+            for field, value in a["resources"][key].items():
+                merged[field] = merged.get(field, 0) + value
+        resources[key] = merged or {"count": 0, "cost": 0.0}
+
+    month_overage = tracker.get("month_overage", 0)
+    server_cost = sum(a["server_cost"] for a in accounts)
+    subtotal = server_cost + month_overage + sum(r.get("cost", 0) for r in resources.values())
+    vat = sum(a["vat"] for a in accounts)
+    # one label only when every account is charged the same; mixed accounts
+    # get the amount without a rate, because no single rate describes it
+    charged = {a["vat_rate"] for a in accounts if a["vat_rate"]}
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+    return {
+        "generated_at": now.isoformat(),
+        "any_servers": bool(servers),
+        "servers": servers,
+        "accounts": accounts,
+        "resources": resources,
+        "totals": {
+            "server_cost": server_cost,
+            "overage": month_overage,
+            "subtotal": subtotal,
+            "vat": vat,
+            "vat_label": f"VAT {next(iter(charged)):.0f}%" if len(charged) == 1 else "VAT",
+            "total": subtotal + vat,
+        },
+        "overage": {
+            "month": month_overage,
+            "projected": month_overage / now.day * days_in_month,
+            "month_avoided": tracker.get("month_avoided", 0),
+            "total_paid": tracker.get("total_overage", 0),
+            "total_avoided": tracker.get("total_avoided", 0),
+            "breakdown": tracker.get("breakdown", []),
+        },
+        "any_custom_price": bool(overrides),
+    }
+
+
+def _fake_snapshot(n_servers, n_accounts=1):
+    from pricing_index import PricingIndex
+    types = [{'name': f'cx{i}3', 'prices': [
+        {'location': loc, 'price_monthly': {'net': f'{3 + i}.49'},
+         'price_per_tb_traffic': {'net': '1.00'}} for loc in ('fsn1', 'nbg1', 'hel1')]}
+        for i in range(2, 6)]
+    pricing = {'vat_rate': '19', 'image': {'price_per_gb_month': {'net': '0.011'}},
+               'volume': {'price_per_gb_month': {'net': '0.044'}},
+               'server_backup': {'percentage': '20'}}
+    index = PricingIndex(pricing, types)
+    accounts = []
+    for a in range(n_accounts):
+        servers = [{
+            'id': a * 1_000_000 + i + 1, 'name': f'srv-{i}',
+            'server_type': types[i % len(types)],
+            'location': {'name': ('fsn1', 'nbg1', 'hel1')[i % 3]},
+            'outgoing_traffic': (i % 30) * 1024 ** 4, 'included_traffic': 20 * 1024 ** 4,
+            'backup_window': '22-02' if i % 4 == 0 else None,
+        } for i in range(n_servers // n_accounts)]
+        accounts.append({
+            'name': f'Account {a + 1}', 'servers': servers, 'index': index,
+            'images': [{'image_size': 2.5}] * 10, 'floating_ips': [], 'volumes': [{'size': 10}],
+            'primary_ips': [{'assignee_id': s['id']} for s in servers],
+            'overage': {s['id']: max(0, (s['outgoing_traffic'] / 1024 ** 4) - 20) for s in servers},
+        })
+    return {'accounts': accounts, 'overrides': {'3': 1.0},
+            'tracker': {'month_overage': 0, 'breakdown': []}}
+
+
+def bench(sizes=(100, 1_000, 10_000), rounds=5):
+    for n in sizes:
+        snap = _fake_snapshot(n, n_accounts=2)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            compute(snap)
+        ms = (time.perf_counter() - start) / rounds * 1000
+        print(f"compute: {n:>6} servers  {ms:8.2f} ms  ({ms * 1000 / n:.1f} µs/server)")
+
+
+def demo():
+    from pricing_index import PricingIndex
+    hel = PricingIndex(
+        {'vat_rate': '19', 'image': {'price_per_gb_month': {'net': '0.01'}},
+         'volume': {'price_per_gb_month': {'net': '0.05'}},
+         'primary_ips': [{'type': 'ipv4', 'prices': [{'location': 'hel1', 'price_monthly': {'net': '0.50'}}]}]},
+        [{'name': 'cx23', 'prices': [{'location': 'hel1', 'price_monthly': {'net': '4.00'}}]}],
+    )
+    plain = PricingIndex({}, [{'name': 'cx23', 'prices': [{'location': 'hel1', 'price_monthly': {'net': '4.00'}}]}])
+    srv = lambda i, **kw: {'id': i, 'name': f's{i}', 'server_type': {'name': 'cx23'},
+                           'location': {'name': 'hel1'}, 'outgoing_traffic': 0, **kw}
+    snap = {
+        'accounts': [
+            {'name': 'A', 'index': hel, 'overage': {2: 3.0},
+             'servers': [srv(1, backup_window='x'), srv(2)],
+             'images': [{'image_size': 100}], 'volumes': [{'size': 20}], 'floating_ips': [],
+             'primary_ips': [{'assignee_id': 1}, {'type': 'ipv4', 'location': {'name': 'hel1'}}]},
+            {'name': 'B', 'index': plain, 'servers': [srv(3)]},
+        ],
+        'overrides': {'3': 2.5},
+        'tracker': {'month_overage': 3.0, 'month_avoided': 1.0, 'total_overage': 9.0,
+                    'total_avoided': 1.0, 'breakdown': [('1999-01', 9.0)]},
+    }
+    r = compute(snap, now=datetime(2026, 8, 10))
+    a, b = r['accounts']
+    # A: servers 8 + backup 0.8 + overage 3 + snapshots 1 + volume 1 + free IP 0.5
+    assert round(a['subtotal'], 2) == 14.30 and round(a['vat'], 4) == round(14.30 * 0.19, 4)
+    # B is billed by hand at 2.50 and has no VAT of its own
+    assert b['server_cost'] == 2.5 and b['vat'] == 0
+    assert [s['custom'] for s in r['servers']] == [False, False, True]
+    assert r['servers'][0]['backup'] and r['servers'][1]['overage'] == 3.0
+    assert r['resources']['primary_ips'] == {'assigned': 1, 'unassigned': 1, 'cost': 0.5}
+    assert round(r['totals']['subtotal'], 2) == 16.80
+    assert r['totals']['vat_label'] == 'VAT 19%'
+    assert round(r['totals']['total'], 2) == round(16.80 + 14.30 * 0.19, 2)
+    assert r['overage']['projected'] == 3.0 / 10 * 31
+    import json
+    json.dumps(r)                                   # the export needs nothing else
+    assert not compute({'accounts': []})['any_servers']
+    big = compute(_fake_snapshot(1000, 2))
+    assert len(big['servers']) == 1000 and big['any_custom_price']
+    print('cost_engine demo OK')
+
+
+if __name__ == '__main__':
+    import sys
+    bench() if 'bench' in sys.argv[1:] else demo()
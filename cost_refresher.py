@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from cost_engine import compute
+from hetzner_api import all_apis
+from overage_tracker import overage_tracker
+from price_store import price_store
+from utils import overage_cost
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 300              # seconds before a collected account is stale
+CHANGE_DELAY = 10                   # quiet seconds after a write before collecting again
+
+
+class CostRefresher:
+    """Each account's cost report data, collected before anyone asks for it.
+
+    Collecting an account is six list calls plus a tracker update per server,
+    which is what made the cost report slow to open. It now happens on a
+    schedule and whenever the account changes: HetznerAPI bumps its
+    `generation` on every successful write and, once `watch` has hooked it,
+    tells the refresher, which collects the account again `CHANGE_DELAY`
+    seconds after the last write (a flow making several writes is collected
+    once it settles). A snapshot taken at an older generation is stale; a
+    plain read returns it and refreshes behind it, a read with `wait` (the
+    JSON export) waits for the fresh one, and an account never collected is
+    always waited for.
+
+    A snapshot is a plain dict:
+      {"servers", "index", "images", "floating_ips", "primary_ips",
+       "volumes", "overage": {server id: € this month}, "at", "generation"}
+    """
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = interval
+        self._snapshots = {}
+        self._running = {}
+        self._pending = {}              # account -> timer collecting it after a write
+
+    def watch(self):
+        """Collect each account again shortly after every write to it."""
+        for idx, _name, api in all_apis():
+            api.on_write.append(lambda api, idx=idx: self.changed(idx, api))
+
+    def changed(self, idx, api, delay=CHANGE_DELAY):
+        """An account was written to: collect it once the writes settle."""
+        timer = self._pending.pop(idx, None)
+        if timer:
+            timer.cancel()
+        self._pending[idx] = asyncio.get_running_loop().call_later(delay, self._settled, idx, api, delay)
+
+    def _settled(self, idx, api, delay):
+        self._pending.pop(idx, None)
+        task = self._running.get(idx)
+        if task is not None and not task.done():
+            # it started before the write and would come back stale
+            self.changed(idx, api, delay)
+            return
+        self.refresh(idx, api)
+
+    async def _collect(self, idx, api):
+        generation = api.generation
+        try:
+            servers, index, images, floating_ips, primary_ips, volumes = await asyncio.gather(
+                api.list_servers(), api.get_pricing_index(), api.list_images(),
+                api.list_floating_ips(), api.list_primary_ips(), api.list_volumes(),
+            )
+        except Exception as e:
+            logger.error(f"Cost refresh failed for account {idx}: {e}")
+            return self._snapshots.get(idx)
+        overage = {}
+        for s in servers:
+            overage_tracker.update_live_overage(s["id"], overage_cost(s, index))
+            overage[s["id"]] = overage_tracker.get_server_month_overage(s["id"])
+        snapshot = {
+            "servers": servers, "index": index, "images": images,
+            "floating_ips": floating_ips, "primary_ips": primary_ips, "volumes": volumes,
+            "overage": overage, "at": time.time(), "generation": generation,
+        }
+        self._snapshots[idx] = snapshot
+        return snapshot
+
+    def refresh(self, idx, api):
+        """Start collecting one account, or join the collection already running."""
+        task = self._running.get(idx)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._collect(idx, api))
+            self._running[idx] = task
+        return task
+
+    async def refresh_all(self):
+        """Collect every account now; what the scheduler runs."""
+        await asyncio.gather(*(self.refresh(idx, api) for idx, _name, api in all_apis()))
+
+    def is_stale(self, snapshot, api):
+        return (
+            snapshot is None
+            or snapshot["generation"] != api.generation
+            or time.time() - snapshot["at"] > self.interval
+        )
+
+    async def snapshots(self, force=False, wait=False):
+        """[(account name, snapshot or None)] plus whether a refresh is under way.
+
+        With `force`, every account is collected again and waited for; with
+        `wait`, only the stale ones are. Otherwise only accounts never
+        collected are waited for, and stale ones are refreshed behind the
+        returned data.
+        """
+        waiting, refreshing = [], False
+        for idx, _name, api in all_apis():
+            snapshot = self._snapshots.get(idx)
+            if force or snapshot is None or (wait and self.is_stale(snapshot, api)):
+                waiting.append(self.refresh(idx, api))
+            elif self.is_stale(snapshot, api):
+                self.refresh(idx, api)
+                refreshing = True
+        if waiting:
+            # shielded: a reader that gives up (a newer press) must not stop a
+            # collection other readers and the cache are waiting on
+            await asyncio.shield(asyncio.gather(*waiting))
+        return [(name, self._snapshots.get(idx)) for idx, name, _api in all_apis()], refreshing
+
+    async def report(self, force=False, wait=False):
+        """(cost_engine result, time of the oldest data in it, refresh under way).
+
+        The arithmetic runs on every call — it is cheap next to collecting —
+        so a price edited a second ago is already in the result.
+        """
+        accounts, refreshing = await self.snapshots(force=force, wait=wait)
+        collected = [{"name": name, **snap} for name, snap in accounts if snap]
+        result = compute({
+            "accounts": collected,
+            "overrides": price_store.all(),
+            "tracker": overage_tracker.summary(),
+        })
+        oldest = min((a["at"] for a in collected), default=time.time())
+        return result, oldest, refreshing
+
+    def invalidate(self, idx=None):
+        """Drop collected data so the next read waits for a fresh collection."""
+        if idx is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(idx, None)
+
+
+cost_refresher = CostRefresher()
@@ -1,41 +1,136 @@
 import asyncio
-import calendar
+import json
 import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 from config import Config
-from hetzner_api import hetzner_api, set_account, account_count, account_name, all_apis
+from hetzner_api import (
+    hetzner_api, set_account, current_account, account_count, account_name, all_apis,
+    last_failure_transient, last_failure_refused, last_failure_not_found, RATE_LIMIT_SOFT_FLOOR,
+)
 from utils import (
     format_traffic, get_traffic_emoji, get_location_info,
     get_location, location_name, traffic_limit_tb,
     traffic_price_per_tb, overage_cost, type_family, type_price,
 )
-from server_manager import reset_server_traffic, swap_primary_ip, detach_primary_ip
+from server_manager import (
+    reset_server_traffic, swap_primary_ip, swap_primary_ips, detach_primary_ip, CALLS_PER_SWAP,
+)
 from overage_tracker import overage_tracker
 from price_store import price_store
+from cost_refresher import cost_refresher
 from shell_handler import console_entry, active_sessions
+from router import Router, flag
+from inflight import inflight
+from progress import ProgressChannel, ProgressBus, log_lines
+from render import render_cache, server_version
+from server_index import server_indexes
+from batch import run_bounded, budget_limit, retry
+from reset_orchestrator import ResetOrchestrator, CALLS_PER_RESET, timing_report, reset_estimate
+from phase_timings import phase_timings, timed_wait, eta
+from reset_advisor import advise_fleet
+from jobs import job_manager
+from server_locks import server_locks
 
 logger = logging.getLogger(__name__)
 
 
 async def _edit(query, text, **kwargs):
-    """edit_message_text that tolerates an unchanged message.
+    """edit_message_text that leaves an unchanged message alone.
 
     Telegram rejects an edit whose text and markup are identical to what is
     already on screen, which is exactly what a Refresh button produces when
-    nothing moved.
+    nothing moved. The render cache knows what each message shows, so such
+    an edit is not sent at all; Telegram's rejection is still tolerated for
+    a message the cache does not know.
     """
+    digest = render_cache.digest(text, kwargs)
+    if render_cache.unchanged(query.message, digest):
+        await _answer_unchanged(query)
+        return
     try:
-        await query.edit_message_text(text, **kwargs)
+        sent = await query.edit_message_text(text, **kwargs)
     except BadRequest as e:
         if "not modified" not in str(e).lower():
             raise
+        await _answer_unchanged(query)
+        return
+    render_cache.remember(query.message, digest, sent)
+
+
+async def _answer_unchanged(query):
+    try:
+        await query.answer("Already up to date")
+    except Exception:
+        pass
+
+
+def _progress(query):
+    """A ProgressChannel that edits `query`'s message as Markdown."""
+    return ProgressChannel(
+        lambda text, **kw: _edit(query, text, parse_mode="Markdown", **kw),
+        interval=Config.PROGRESS_INTERVAL,
+    )
+
+
+def _flow_bus(channel, job, head):
+    """A ProgressBus for a server_manager flow, shown under `head` on the
+    message, as the job's progress and in the log."""
+    bus = ProgressBus()
+    bus.subscribe(lambda lines, _new: channel.push(f"{head}\n\n" + "\n".join(f"{e} {m}" for e, m in lines)))
+    bus.subscribe(lambda lines, _new: job.note(" ".join(lines[-1])))
+    bus.subscribe(log_lines(f"Job #{job.id}"))
+    return bus
+
+
+def _here(*server_ids):
+    """(account, server id) keys of servers on the account in use."""
+    return [(current_account(), sid) for sid in server_ids]
+
+
+@asynccontextmanager
+async def _server_lock(query, server_id, operation):
+    """Hold the server's lock (server_locks.py) on the account in use.
+
+    If another flow has it, the message says what is being waited for.
+    """
+    def waiting(holder):
+        asyncio.ensure_future(_edit(query, f"⏳ Waiting for the {holder} on this server to finish..."))
+
+    async with server_locks.hold(server_id, operation, waiting=waiting):
+        yield
+
+
+def _jobs_button():
+    return InlineKeyboardButton("⚙️ Jobs", callback_data="jobs")
+
+
+async def _start_job(query, kind, title, servers, work):
+    """Run `work(job)` as a background job holding `servers` ((account, id)).
+
+    The press returns at once and the job goes on editing the message. If
+    another job holds one of the servers, the message says so instead and
+    nothing runs. Returns the job, or None.
+    """
+    async def run(job):
         try:
-            await query.answer("Already up to date")
-        except Exception:
-            pass
+            return await work(job)
+        except asyncio.CancelledError:
+            await _edit(query, f"🛑 Cancelled: {title}", reply_markup=InlineKeyboardMarkup([[_jobs_button()]]))
+            raise
+
+    job, busy = job_manager.submit(kind, title, servers, run)
+    if job is None:
+        await _edit(query,
+            f"⏳ Busy with another job: {busy.title} (#{busy.id}, {busy.state}).\n\n"
+            "Try again once it has finished, or cancel it from Jobs.",
+            reply_markup=InlineKeyboardMarkup([[_jobs_button()]]),
+        )
+    return job
 
 
 def _net(price_dict):
@@ -46,51 +141,24 @@ def _net(price_dict):
         return 0.0
 
 
-def _vat_rate(pricing):
-    try:
-        return float(pricing.get("vat_rate") or 0)
-    except (TypeError, ValueError):
-        return 0.0
-
-
-def _api_price(server):
+def _api_price(server, index=None):
     """List price for the location this server actually runs in."""
-    return _type_price(server.get("server_type", {}), location_name(server))
+    return _type_price(server.get("server_type", {}), location_name(server), index)
 
 
-def _server_price(server):
-    """Monthly price of a server as billed, in EUR.
+def _billed_prices(servers, index=None):
+    """{server id: (monthly price as billed in EUR, set by hand)}.
 
     A manual override wins over the API: the API always reports today's list
     price, while an old server keeps the price it was ordered at.
     """
-    return price_store.apply(server.get("id"), _api_price(server))
+    return price_store.apply_many(servers, lambda s: _api_price(s, index))
 
 
 def _image_price_per_gb(pricing):
     return _net(pricing.get("image", {}).get("price_per_gb_month", {}))
 
 
-def _floating_ip_price(pricing, fip):
-    loc = fip.get("home_location", {}).get("name")
-    for entry in pricing.get("floating_ips", []):
-        if entry.get("type") == fip.get("type"):
-            for p in entry.get("prices", []):
-                if p.get("location") == loc:
-                    return _net(p.get("price_monthly", {}))
-    return _net(pricing.get("floating_ip", {}).get("price_monthly", {}))
-
-
-def _primary_ip_price(pricing, pip):
-    loc = location_name(pip)
-    for entry in pricing.get("primary_ips", []):
-        if entry.get("type") == pip.get("type"):
-            for p in entry.get("prices", []):
-                if p.get("location") == loc:
-                    return _net(p.get("price_monthly", {}))
-    return 0.0
-
-
 def _main_menu_keyboard():
     return [
         [
@@ -101,7 +169,11 @@ def _main_menu_keyboard():
             InlineKeyboardButton("🌐 Floating IPs", callback_data="fips"),
             InlineKeyboardButton("📍 Primary IPs", callback_data="pips"),
         ],
-        [InlineKeyboardButton("💸 Cost Report", callback_data="overage_cost")],
+        [
+            InlineKeyboardButton("💸 Cost Report", callback_data="overage_cost"),
+            InlineKeyboardButton("🚨 At Risk", callback_data="atrisk_time"),
+        ],
+        [InlineKeyboardButton("⚙️ Jobs", callback_data="jobs")],
     ]
 
 
@@ -129,163 +201,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # every server-scoped action runs against the account the admin picked
     set_account(context.user_data.get("acct", 0))
-
-    if data.startswith("acct_"):
-        context.user_data["acct"] = int(data.split("_")[1])
-        set_account(context.user_data["acct"])
-        await show_server_list(query, context)
-    elif data == "list_servers":
-        if account_count() > 1:
-            await show_account_picker(query, context)
-        else:
-            await show_server_list(query, context)
-    elif data.startswith("page_"):
-        await show_server_list(query, context, int(data.split("_")[1]))
-    elif data.startswith("server_"):
-        await show_server_detail(query, context, int(data.split("_")[1]))
-    elif data.startswith("refresh_"):
-        await show_server_detail(query, context, int(data.split("_")[1]), refresh=True)
-    elif data.startswith("poweron_"):
-        await power_action(query, context, int(data.split("_")[1]), "on")
-    elif data.startswith("poweroff_"):
-        await power_action(query, context, int(data.split("_")[1]), "off")
-    elif data.startswith("reset_"):
-        await reset_traffic(query, context, int(data.split("_")[1]))
-    elif data.startswith("resetpw_confirm_"):
-        await reset_password_confirm(query, context, int(data.split("_")[2]))
-    elif data.startswith("resetpw_"):
-        await reset_password(query, context, int(data.split("_")[1]))
-    elif data == "overage_cost":
-        await show_overage_cost(query, context)
-    # same buttons as the price conversation, for a message left over from
-    # before a restart — the conversation state is gone but the panel is not
-    elif data.startswith("priceclear_"):
-        sid = int(data.split("_")[1])
-        price_store.clear(sid)
-        await show_server_detail(query, context, sid)
-    elif data.startswith("pricecancel_"):
-        await show_server_detail(query, context, int(data.split("_")[1]))
-    elif data == "snapshots":
-        await show_snapshots(query, context)
-    elif data == "snap_new":
-        await snapshot_pick_server(query, context)
-    elif data.startswith("snapcreate_"):
-        await create_snapshot(query, context, int(data.split("_")[1]))
-    elif data.startswith("snapdel_confirm_"):
-        await delete_snapshot(query, context, int(data.split("_")[2]))
-    elif data.startswith("snapdel_"):
-        await delete_snapshot_confirm(query, context, int(data.split("_")[1]))
-    elif data.startswith("snap_"):
-        await show_snapshot_detail(query, context, int(data.split("_")[1]))
-    elif data.startswith("srvsnap_"):
-        await show_server_snapshots(query, context, int(data.split("_")[1]))
-    elif data == "fips":
-        await show_ip_list(query, context, "fip")
-    elif data == "fip_new":
-        await ip_new_type(query, context, "fip")
-    elif data.startswith("fipnewt_"):
-        await ip_new_place(query, context, "fip", data.split("_")[1])
-    elif data.startswith("fipnewl_"):
-        _, ip_type, place = data.split("_")
-        await ip_new_count(query, context, "fip", ip_type, place)
-    elif data.startswith("fipnewc_"):
-        _, ip_type, place, count = data.split("_")
-        await ip_create(query, context, "fip", ip_type, place, int(count))
-    elif data.startswith("fiptog_"):
-        await ip_toggle(query, context, "fip", int(data.split("_")[1]))
-    elif data == "fipdelsel_yes":
-        await ip_delete_selected(query, context, "fip")
-    elif data == "fipdelsel":
-        await ip_delete_confirm(query, context, "fip")
-    elif data == "fipclear":
-        context.user_data["fip_sel"] = set()
-        await show_ip_list(query, context, "fip")
-    elif data == "pips":
-        await show_ip_list(query, context, "pip")
-    elif data == "pip_new":
-        await ip_new_type(query, context, "pip")
-    elif data.startswith("pipnewt_"):
-        await ip_new_place(query, context, "pip", data.split("_")[1])
-    elif data.startswith("pipnewl_"):
-        _, ip_type, place = data.split("_")
-        await ip_new_count(query, context, "pip", ip_type, place)
-    elif data.startswith("pipnewc_"):
-        _, ip_type, place, count = data.split("_")
-        await ip_create(query, context, "pip", ip_type, place, int(count))
-    elif data.startswith("pipatgo_"):
-        _, pid, sid = data.split("_")
-        await pip_attach_go(query, context, int(pid), int(sid))
-    elif data.startswith("pipatts_"):
-        _, pid, sid = data.split("_")
-        await pip_attach_confirm(query, context, int(pid), int(sid))
-    elif data.startswith("pipatt_"):
-        await pip_attach_pick(query, context, int(data.split("_")[1]))
-    elif data.startswith("pipdetgo_"):
-        await pip_detach_go(query, context, int(data.split("_")[1]))
-    elif data.startswith("pipdet_"):
-        await pip_detach_confirm(query, context, int(data.split("_")[1]))
-    elif data.startswith("piptog_"):
-        await ip_toggle(query, context, "pip", int(data.split("_")[1]))
-    elif data == "pipdelsel_yes":
-        await ip_delete_selected(query, context, "pip")
-    elif data == "pipdelsel":
-        await ip_delete_confirm(query, context, "pip")
-    elif data == "pipclear":
-        context.user_data["pip_sel"] = set()
-        await show_ip_list(query, context, "pip")
-    elif data.startswith("rebuildgo_"):
-        _, sid, image = data.split("_", 2)
-        await rebuild_go(query, context, int(sid), image)
-    elif data.startswith("rebuildimg_"):
-        _, sid, image = data.split("_", 2)
-        await rebuild_confirm(query, context, int(sid), image)
-    elif data.startswith("rebuild_"):
-        await rebuild_pick_image(query, context, int(data.split("_")[1]))
-    elif data.startswith("resizego_"):
-        _, sid, stype, disk = data.split("_")
-        await resize_go(query, context, int(sid), stype, disk == "1")
-    elif data.startswith("resizet_"):
-        _, sid, stype = data.split("_")
-        await resize_confirm(query, context, int(sid), stype)
-    elif data.startswith("resizef_"):
-        _, sid, family = data.split("_")
-        await resize_pick_type(query, context, int(sid), family)
-    elif data.startswith("resize_"):
-        await resize_pick_family(query, context, int(data.split("_")[1]))
-    elif data.startswith("volmenu_"):
-        await show_volumes(query, context, int(data.split("_")[1]))
-    elif data.startswith("volnewc_"):
-        _, sid, size = data.split("_")
-        await volume_create(query, context, int(sid), int(size))
-    elif data.startswith("volnew_"):
-        await volume_pick_size(query, context, int(data.split("_")[1]))
-    elif data.startswith("voldetach_"):
-        _, vid, sid = data.split("_")
-        await volume_detach(query, context, int(vid), int(sid))
-    elif data.startswith("volattach_"):
-        _, vid, sid = data.split("_")
-        await volume_attach(query, context, int(vid), int(sid))
-    elif data.startswith("voldelgo_"):
-        _, vid, sid = data.split("_")
-        await volume_delete(query, context, int(vid), int(sid))
-    elif data.startswith("voldel_"):
-        _, vid, sid = data.split("_")
-        await volume_delete_confirm(query, context, int(vid), int(sid))
-    elif data.startswith("srvfip_"):
-        await show_server_fips(query, context, int(data.split("_")[1]))
-    elif data.startswith("fipas_"):
-        _, fid, sid = data.split("_")
-        await server_fip_assign(query, context, int(fid), int(sid))
-    elif data.startswith("fipun_"):
-        _, fid, sid = data.split("_")
-        await server_fip_unassign(query, context, int(fid), int(sid))
-    elif data.startswith("backupgo_"):
-        _, sid, mode = data.split("_")
-        await backup_toggle_go(query, context, int(sid), mode)
-    elif data.startswith("backup_"):
-        await backup_toggle_confirm(query, context, int(data.split("_")[1]))
-    elif data == "start_menu":
-        await show_start_menu(query)
+    route = router.read_only_key(data)
+    if route and query.message:
+        key = (query.message.chat_id, query.message.message_id)
+        await inflight.run(
+            key, update.update_id, route, lambda: router.dispatch(data, query, context),
+        )
+    elif not await router.dispatch(data, query, context):
+        logger.info(f"No route for callback data {data!r}")
 
 
 async def _start_console(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -305,9 +228,26 @@ async def _start_console(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await console_entry(query, context, server_id, ip, name)
 
 
+async def select_account(query, context, idx):
+    context.user_data["acct"] = idx
+    set_account(idx)
+    # filters and the selection belong to the account they were made on
+    context.user_data["list_view"] = _default_list_view(_list_view(context)["sort"])
+    context.user_data["srv_sel"] = set()
+    await show_server_list(query, context, rebuild=True)
+
+
+async def open_server_list(query, context):
+    if account_count() > 1:
+        await show_account_picker(query, context)
+    else:
+        await show_server_list(query, context, rebuild=True)
+
+
 async def show_account_picker(query, context):
-    keyboard = [[InlineKeyboardButton(f"🔑 {account_name(i)}", callback_data=f"acct_{i}")]
-                for i in range(account_count())]
+    keyboard = [[InlineKeyboardButton("🌍 All Accounts", callback_data="fleet")]]
+    keyboard += [[InlineKeyboardButton(f"🔑 {account_name(i)}", callback_data=f"acct_{i}")]
+                 for i in range(account_count())]
     keyboard.append([InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")])
     await _edit(query, 
         "🔑 *Choose a Hetzner account*",
@@ -316,54 +256,817 @@ async def show_account_picker(query, context):
     )
 
 
-async def show_server_list(query, context, page=0):
-    servers = await hetzner_api.list_servers()
-    if not servers:
-        await _edit(query, "⚠️ No servers found or API error occurred.")
-        return
+SORT_LABELS = {"traffic": "📊 Traffic %", "name": "🔤 Name", "location": "📍 Location"}
 
-    items_per_page = 10
-    total_pages = (len(servers) - 1) // items_per_page + 1
-    page_servers = servers[page * items_per_page:(page + 1) * items_per_page]
 
-    keyboard = []
-    for s in page_servers:
-        tb = s.get("outgoing_traffic", 0) / (1024 ** 4)
-        limit_tb = traffic_limit_tb(s)
-        emoji = get_traffic_emoji(tb, limit_tb)
-        loc_name, flag = get_location_info(get_location(s))
-        keyboard.append([InlineKeyboardButton(
-            f"{emoji} {s.get('name','Unnamed')} | {flag} {loc_name} | {format_traffic(s.get('outgoing_traffic',0), limit_tb)}",
-            callback_data=f"server_{s['id']}",
-        )])
+def _default_list_view(sort="traffic"):
+    return {
+        "sort": sort, "status": None, "location": None, "search": None, "page": 0,
+        "select": False,
+    }
+
+
+def _list_view(context):
+    """The admin's sort, filters and page on the server list."""
+    return context.user_data.setdefault("list_view", _default_list_view())
+
+
+def _cycle(options, current):
+    """The option after `current`, wrapping round; None is "all"."""
+    options = [None, *options]
+    i = options.index(current) if current in options else 0
+    return options[(i + 1) % len(options)]
+
+
+async def _server_list_screen(context, page=None, rebuild=False):
+    """Text and keyboard of the server list, or None if the account has no servers."""
+    acct = context.user_data.get("acct", 0)
+    index = await server_indexes.load(acct, hetzner_api, rebuild=rebuild)
+    if not index.servers:
+        return None
+    view = _list_view(context)
+    if page is not None:
+        view["page"] = page
+    page_servers, view["page"], total_pages, matches = index.page(
+        view["page"], sort=view["sort"], status=view["status"],
+        location=view["location"], search=view["search"],
+    )
+
+    ids = {s["id"] for s in index.servers}
+    sel = {i for i in context.user_data.get("srv_sel", set()) if i in ids}
+    context.user_data["srv_sel"] = sel
+    if view.get("select"):
+        keyboard = [
+            [render_cache.fragment(
+                ("selrow", server_version(s), s["id"] in sel),
+                lambda s=s: _server_row(s, selected=s["id"] in sel),
+            )]
+            for s in page_servers
+        ]
+    else:
+        keyboard = [
+            [render_cache.fragment(("row", server_version(s)), lambda s=s: _server_row(s))]
+            for s in page_servers
+        ]
 
     nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"page_{page-1}"))
-    if page < total_pages - 1:
-        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"page_{page+1}"))
+    if view["page"] > 0:
+        nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"page_{view['page'] - 1}"))
+    if view["page"] < total_pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"page_{view['page'] + 1}"))
     if nav:
         keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton(f"↕️ {SORT_LABELS[view['sort']]}", callback_data="lsort"),
+        InlineKeyboardButton(f"⚡ {(view['status'] or 'any status').title()}", callback_data="lstatus"),
+        InlineKeyboardButton(f"📍 {view['location'] or 'All'}", callback_data="lloc"),
+    ])
+    search_row = [InlineKeyboardButton("🔍 Search", callback_data="lsearch")]
+    if view["status"] or view["location"] or view["search"]:
+        search_row.append(InlineKeyboardButton("✖️ Clear Filters", callback_data="lclear"))
+    search_row.append(InlineKeyboardButton("🔄 Refresh", callback_data="lrefresh"))
+    keyboard.append(search_row)
+    if view.get("select"):
+        keyboard.append([
+            InlineKeyboardButton(f"☑️ All {matches}", callback_data="lselall"),
+            InlineKeyboardButton("⬜ None", callback_data="lselnone"),
+            InlineKeyboardButton("✔️ Done", callback_data="lselmode"),
+        ])
+        if sel:
+            keyboard.append([InlineKeyboardButton(
+                f"⚡ Bulk Actions ({len(sel)} selected)", callback_data="bulk",
+            )])
+    else:
+        keyboard.append([InlineKeyboardButton("☑️ Select Servers", callback_data="lselmode")])
     if account_count() > 1:
         keyboard.append([InlineKeyboardButton("🔑 Switch Account", callback_data="list_servers")])
     keyboard.append([InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")])
 
     header = "📋 *SERVER LIST*"
     if account_count() > 1:
-        header += f"\n🔑 Account: `{account_name(context.user_data.get('acct', 0))}`"
-    await _edit(query, 
-        header + "\n",
+        header += f"\n🔑 Account: `{account_name(acct)}`"
+    shown = f"{matches} of {len(index.servers)}" if matches != len(index.servers) else f"{matches}"
+    header += f"\n🖥 {shown} servers · page {view['page'] + 1}/{total_pages}"
+    if view["search"]:
+        header += f"\n🔍 Name contains `{view['search']}`"
+    if view.get("select"):
+        header += f"\n☑️ Tap servers to select them · {len(sel)} selected"
+    if not matches:
+        header += "\n\nNo server matches these filters."
+    return header + "\n", InlineKeyboardMarkup(keyboard)
+
+
+async def show_server_list(query, context, page=None, rebuild=False):
+    """The server list; page turns and view changes are served from the index."""
+    screen = await _server_list_screen(context, page, rebuild)
+    if screen is None:
+        await _edit(query, "⚠️ No servers found or API error occurred.")
+        return
+    text, markup = screen
+    await _edit(query, text, reply_markup=markup, parse_mode="Markdown")
+
+
+async def _change_list_view(query, context, **changes):
+    view = _list_view(context)
+    view.update(changes, page=0)
+    await show_server_list(query, context)
+
+
+async def list_sort(query, context):
+    sorts = list(SORT_LABELS)
+    current = _list_view(context)["sort"]
+    await _change_list_view(query, context, sort=sorts[(sorts.index(current) + 1) % len(sorts)])
+
+
+async def list_status(query, context):
+    index = server_indexes.get(context.user_data.get("acct", 0))
+    statuses = index.statuses if index else ["running", "off"]
+    await _change_list_view(query, context, status=_cycle(statuses, _list_view(context)["status"]))
+
+
+async def list_location(query, context):
+    index = server_indexes.get(context.user_data.get("acct", 0))
+    locations = index.locations if index else []
+    await _change_list_view(query, context, location=_cycle(locations, _list_view(context)["location"]))
+
+
+async def list_clear(query, context):
+    await _change_list_view(query, context, status=None, location=None, search=None)
+
+
+async def list_select_mode(query, context):
+    view = _list_view(context)
+    view["select"] = not view.get("select")
+    await show_server_list(query, context)
+
+
+async def list_select_toggle(query, context, server_id):
+    context.user_data.setdefault("srv_sel", set()).symmetric_difference_update({server_id})
+    await show_server_list(query, context)
+
+
+async def list_select_all(query, context):
+    """Select every server the current filters match, on every page."""
+    index = server_indexes.get(context.user_data.get("acct", 0))
+    if index:
+        view = _list_view(context)
+        matching = index.view(
+            sort=view["sort"], status=view["status"],
+            location=view["location"], search=view["search"],
+        )
+        context.user_data.setdefault("srv_sel", set()).update(s["id"] for s in matching)
+    await show_server_list(query, context)
+
+
+async def list_select_none(query, context):
+    context.user_data["srv_sel"] = set()
+    await show_server_list(query, context)
+
+
+async def _bulk_power(server_id, note, action):
+    result = await (hetzner_api.power_on(server_id) if action == "on" else hetzner_api.power_off(server_id))
+    if not result:
+        return False, "request failed"
+    note("waiting for the new state")
+    target = "running" if action == "on" else "off"
+    if await hetzner_api.wait_for_action(result, server_id=server_id, status=target):
+        return True, target
+    return False, f"did not reach {target}"
+
+
+async def _bulk_snapshot(server_id, note):
+    server = await hetzner_api.get_server(server_id)
+    name = (server or {}).get("name", "Server")
+    result = await hetzner_api.create_snapshot(
+        server_id, f"{name} {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+    )
+    return bool(result), "snapshot started" if result else "request failed"
+
+
+async def _bulk_backup(server_id, note, mode):
+    result = await (hetzner_api.enable_backup(server_id) if mode == "on" else hetzner_api.disable_backup(server_id))
+    return bool(result), f"backups {mode}" if result else "request failed"
+
+
+# action -> (button label, API calls one server costs roughly, worker(sid, note));
+# resets have no worker: the ResetOrchestrator runs them (see _run_resets);
+# nor do new IPs: swap_primary_ips runs them (see bulk_run)
+BULK_ACTIONS = {
+    "on": ("🟢 Power ON", 12, lambda sid, note: _bulk_power(sid, note, "on")),
+    "off": ("🔴 Power OFF", 12, lambda sid, note: _bulk_power(sid, note, "off")),
+    "snap": ("📸 Snapshot", 2, _bulk_snapshot),
+    "bkon": ("💾 Backups ON", 1, lambda sid, note: _bulk_backup(sid, note, "on")),
+    "bkoff": ("💾 Backups OFF", 1, lambda sid, note: _bulk_backup(sid, note, "off")),
+    "reset": ("♻️ Reset Traffic", CALLS_PER_RESET, None),
+    "newip": ("📍 New IPv4", CALLS_PER_SWAP, None),
+}
+
+
+def _selected_servers(context):
+    index = server_indexes.get(context.user_data.get("acct", 0))
+    sel = context.user_data.get("srv_sel", set())
+    return [s for s in (index.servers if index else []) if s["id"] in sel]
+
+
+async def bulk_menu(query, context):
+    servers = _selected_servers(context)
+    if not servers:
+        await show_server_list(query, context)
+        return
+    names = ", ".join(f"`{s.get('name', '?')}`" for s in servers[:15])
+    if len(servers) > 15:
+        names += f" and {len(servers) - 15} more"
+    labels = [(key, label) for key, (label, _calls, _worker) in BULK_ACTIONS.items()]
+    keyboard = [
+        [InlineKeyboardButton(label, callback_data=f"bulkask_{key}") for key, label in labels[i:i + 2]]
+        for i in range(0, len(labels), 2)
+    ]
+    keyboard.append([InlineKeyboardButton("⬅️ Back to List", callback_data="page_0")])
+    await _edit(query,
+        f"⚡ *Bulk Actions* — {len(servers)} servers\n\n{names}\n\nChoose what to do to all of them:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+
+
+async def bulk_confirm(query, context, action):
+    servers = _selected_servers(context)
+    if action not in BULK_ACTIONS or not servers:
+        await show_server_list(query, context)
+        return
+    label, calls, _worker = BULK_ACTIONS[action]
+    note = ""
+    if action == "reset":
+        note = "\nEach server is powered off, upgraded and downgraded again: minutes of downtime each.\n"
+    elif action == "off":
+        note = "\nEvery selected server will be shut down.\n"
+    elif action == "newip":
+        note = (
+            "\nEach server gets a new primary IPv4 in its location. They are all powered off, "
+            "the IPs swapped and the ones that were running started again. "
+            "The old IPs stay on the account, unassigned.\n"
+        )
+    keyboard = [[
+        InlineKeyboardButton(f"✅ {label} × {len(servers)}", callback_data=f"bulkgo_{action}"),
+        InlineKeyboardButton("❌ Cancel", callback_data="bulk"),
+    ]]
+    await _edit(query,
+        f"⚠️ *{label}* on {len(servers)} servers?\n{note}\n"
+        f"Up to {_bulk_limit(calls, action)} {'change IPs' if action == 'newip' else 'run'} at a time.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+
+
+def _bulk_limit(calls_per_job, action=None):
+    cap = Config.RESET_CONCURRENCY if action == "reset" else Config.BATCH_CONCURRENCY
+    return budget_limit(cap, hetzner_api.rate_remaining, calls_per_job, RATE_LIMIT_SOFT_FLOOR)
+
+
+_BULK_ICON = {"queued": "⏸", "running": "⏳", "ok": "✅", "failed": "❌"}
+
+
+def _bulk_text(label, names, states, done=False):
+    counts = {}
+    for state, _detail in states.values():
+        counts[state] = counts.get(state, 0) + 1
+    head = (
+        f"⚡ *{label}* — {counts.get('ok', 0) + counts.get('failed', 0)}/{len(states)} done"
+        f" · ✅ {counts.get('ok', 0)} · ❌ {counts.get('failed', 0)}"
+        + ("" if done else f" · ⏳ {counts.get('running', 0)}")
+    )
+    # running and failed first: that is what the admin is watching for
+    order = {"running": 0, "failed": 1, "queued": 2, "ok": 3}
+    rows = sorted(states.items(), key=lambda kv: (order[kv[1][0]], names[kv[0]]))
+    lines = [
+        f"{_BULK_ICON[state]} `{names[sid]}`" + (f" — {detail.replace('`', '')}" if detail else "")
+        for sid, (state, detail) in rows[:40]
+    ]
+    if len(rows) > 40:
+        lines.append(f"… and {len(rows) - 40} more")
+    return head + "\n\n" + "\n".join(lines)
+
+
+async def bulk_run(query, context, action):
+    servers = _selected_servers(context)
+    if action not in BULK_ACTIONS or not servers:
+        await show_server_list(query, context)
+        return
+    label, calls, worker = BULK_ACTIONS[action]
+    names = {s["id"]: s.get("name", str(s["id"])) for s in servers}
+
+    async def locked(sid, note):
+        waiting = lambda holder: note(f"waiting for {holder} to finish")
+        async with server_locks.hold(sid, label.split(" ", 1)[1].lower(), waiting=waiting):
+            return await worker(sid, note)
+
+    def keyboard(failed):
+        # what failed stays selected, ready for another try
+        context.user_data["srv_sel"] = failed
+        rows = []
+        if failed:
+            rows.append([InlineKeyboardButton(f"⚡ Retry the {len(failed)} failed", callback_data="bulk")])
+        rows.append([InlineKeyboardButton("📋 Back to List", callback_data="lrefresh")])
+        return rows
+
+    acct = context.user_data.get("acct", 0)
+    if action == "reset":
+        await _run_resets(query, [(acct, sid) for sid in names], names, keyboard)
+        return
+
+    async def work(job):
+        states = {s["id"]: ("queued", "") for s in servers}
+        progress = _progress(query)
+
+        def changed(sid, state, detail):
+            states[sid] = (state, detail)
+            progress.push(_bulk_text(label, names, states))
+            job.note(_bulk_text(label, names, states).split("\n", 1)[0])
+
+        try:
+            if action == "newip":
+                results = await swap_primary_ips(dict.fromkeys(names), on_change=changed)
+            else:
+                results = await run_bounded(list(names), locked, _bulk_limit(calls), changed)
+        except BaseException:
+            await progress.close()
+            raise
+        failed = {sid for sid, ok, _detail in results if not ok}
+        text = _bulk_text(label, names, states, done=True)
+        rows = keyboard(failed)
+        if action == "newip" and len(failed) < len(results):
+            text += "\n\nThe old IPs are still on the account: delete them from 📍 Primary IPs if they are not needed."
+            rows.insert(-1, [InlineKeyboardButton("📍 Primary IPs", callback_data="pips")])
+        await progress.close(text, reply_markup=InlineKeyboardMarkup(rows))
+        return not failed
+
+    await _start_job(query, f"bulk_{action}", f"{label} × {len(names)}", [(acct, sid) for sid in names], work)
+
+
+async def _run_resets(query, targets, names, keyboard):
+    """Reset the traffic of `targets` ([(account, server id)]) side by side.
+
+    Progress is one message in the bulk layout; the final state adds how long
+    each phase took. `keyboard(failed ids)` gives the closing buttons.
+    """
+    label = BULK_ACTIONS["reset"][0]
+
+    async def work(job):
+        states = {sid: ("queued", "") for _acct, sid in targets}
+        progress = _progress(query)
+
+        def changed(sid, state, detail):
+            states[sid] = (state, detail)
+            progress.push(_bulk_text(label, names, states))
+            job.note(_bulk_text(label, names, states).split("\n", 1)[0])
+
+        orchestrator = ResetOrchestrator({idx: api for idx, _name, api in all_apis()})
+        try:
+            results, took = await orchestrator.run(targets, changed)
+        except BaseException:
+            await progress.close()
+            raise
+        failed = {r["server_id"] for r in results if not r["ok"]}
+        owed = sum(r["owed"] or 0 for r in results)
+        text = _bulk_text(label, names, states, done=True)
+        text += "\n\n⏱ *Phase timings*\n" + "\n".join(timing_report(results, took))
+        if owed:
+            text += f"\n💰 €{owed:.2f} overage cleared from this month's bill"
+        await progress.close(text, reply_markup=InlineKeyboardMarkup(keyboard(failed)))
+        server_indexes.fleet = None     # counters moved: the next look fetches again
+        return not failed
+
+    return await _start_job(query, "reset", f"{label} × {len(targets)}", targets, work)
+
+
+WAIT_SEARCH = 101
+
+
+async def search_ask(update, context):
+    """Entry point of the search conversation: ask for part of a name or IP.
+
+    "lsearch" searches the account's list, "fsearch" every account.
+    """
+    query = update.callback_query
+    if query.from_user.id != Config.ADMIN_ID:
+        await query.answer("⛔ Unauthorized", show_alert=True)
+        return ConversationHandler.END
+    await query.answer()
+    fleet = query.data == "fsearch"
+    context.user_data["search_fleet"] = fleet
+    keyboard = [[InlineKeyboardButton("⬅️ Cancel", callback_data=f"{query.data}cancel")]]
+    await _edit(query,
+        f"🔍 *Search {'all accounts' if fleet else 'servers'}*\n\n"
+        "Send part of a server name or IP address (any case).",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+    return WAIT_SEARCH
+
+
+async def search_recv(update, context):
+    set_account(context.user_data.get("acct", 0))
+    fleet = context.user_data.pop("search_fleet", False)
+    view = _fleet_view(context) if fleet else _list_view(context)
+    needle = (update.message.text or "").replace("`", "").strip()[:40]
+    view.update(search=needle or None, page=0)
+    screen = await (_fleet_screen(context) if fleet else _server_list_screen(context))
+    if screen is None:
+        await update.message.reply_text("⚠️ No servers found or API error occurred.")
+    else:
+        text, markup = screen
+        await update.message.reply_text(text, reply_markup=markup, parse_mode="Markdown")
+    return ConversationHandler.END
+
+
+async def search_cancel(update, context):
+    query = update.callback_query
+    await query.answer()
+    set_account(context.user_data.get("acct", 0))
+    if context.user_data.pop("search_fleet", False):
+        await show_fleet(query, context)
+    else:
+        await show_server_list(query, context)
+    return ConversationHandler.END
+
+
+def _fleet_view(context):
+    return context.user_data.setdefault(
+        "fleet_view", {"sort": "traffic", "search": None, "page": 0},
+    )
+
+
+def _fleet_row(acct, s):
+    tb = s.get("outgoing_traffic", 0) / (1024 ** 4)
+    limit_tb = traffic_limit_tb(s)
+    _loc_name, flag = get_location_info(get_location(s))
+    return InlineKeyboardButton(
+        f"{get_traffic_emoji(tb, limit_tb)} [{account_name(acct)}] {s.get('name', 'Unnamed')} "
+        f"| {flag} | {format_traffic(s.get('outgoing_traffic', 0), limit_tb)}",
+        callback_data=f"fsrv_{acct}_{s['id']}",
+    )
+
+
+async def _fleet_screen(context, page=None, rebuild=False):
+    """Every account's servers in one list, or None if there are none at all."""
+    fleet = await server_indexes.load_fleet(all_apis(), rebuild=rebuild)
+    if not fleet.servers:
+        return None
+    view = _fleet_view(context)
+    if page is not None:
+        view["page"] = page
+    page_servers, view["page"], total_pages, matches = fleet.page(
+        view["page"], sort=view["sort"], search=view["search"],
+    )
+
+    keyboard = []
+    for s in page_servers:
+        acct = fleet.account_of[s["id"]]
+        keyboard.append([render_cache.fragment(
+            ("frow", acct, server_version(s)), lambda acct=acct, s=s: _fleet_row(acct, s),
+        )])
+    nav = []
+    if view["page"] > 0:
+        nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"fpage_{view['page'] - 1}"))
+    if view["page"] < total_pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"fpage_{view['page'] + 1}"))
+    if nav:
+        keyboard.append(nav)
+    row = [
+        InlineKeyboardButton(f"↕️ {SORT_LABELS[view['sort']]}", callback_data="fsort"),
+        InlineKeyboardButton("🔍 Search", callback_data="fsearch"),
+    ]
+    if view["search"]:
+        row.append(InlineKeyboardButton("✖️ Clear", callback_data="fclear"))
+    row.append(InlineKeyboardButton("🔄 Refresh", callback_data="frefresh"))
+    keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("🔑 Accounts", callback_data="list_servers")])
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")])
+
+    total = len(fleet.servers)
+    header = (
+        "🌍 *ALL ACCOUNTS*\n"
+        f"🖥 {f'{matches} of {total}' if matches != total else total} servers "
+        f"in {account_count()} accounts · page {view['page'] + 1}/{total_pages}"
+    )
+    if view["search"]:
+        header += f"\n🔍 Name or IP contains `{view['search']}`"
+    if not matches:
+        header += "\n\nNo server matches this search."
+    return header + "\n", InlineKeyboardMarkup(keyboard)
+
+
+async def show_fleet(query, context, page=None, rebuild=False):
+    """Servers of every account at once, fetched side by side."""
+    screen = await _fleet_screen(context, page, rebuild)
+    if screen is None:
+        await _edit(query, "⚠️ No servers found or API error occurred.")
+        return
+    text, markup = screen
+    await _edit(query, text, reply_markup=markup, parse_mode="Markdown")
+
+
+async def fleet_sort(query, context):
+    view = _fleet_view(context)
+    view.update(sort="name" if view["sort"] == "traffic" else "traffic", page=0)
+    await show_fleet(query, context)
+
+
+async def fleet_clear(query, context):
+    _fleet_view(context).update(search=None, page=0)
+    await show_fleet(query, context)
+
+
+AT_RISK_TOP = 10
+
+
+def _eta(hours):
+    if hours <= 0:
+        return "over the limit"
+    if hours < 48:
+        return f"limit in ~{max(hours, 1):.0f} h"
+    return f"limit in ~{hours / 24:.1f} d"
+
+
+async def show_at_risk(query, context, by="time"):
+    """The servers closest to overage across all accounts, from the fleet index.
+
+    Served from the cached fleet (fetched again once it is older than the
+    cost report's refresh interval), so refreshing only re-ranks.
+    """
+    fleet = server_indexes.fleet
+    rebuild = fleet is None or time.time() - fleet.built_at > cost_refresher.interval
+    fleet = await server_indexes.load_fleet(all_apis(), rebuild=rebuild)
+    apis = {idx: api for idx, _name, api in all_apis()}
+
+    def owed(s):
+        return overage_cost(s, apis[fleet.account_of[s["id"]]].pricing_index)
+
+    top = fleet.at_risk(AT_RISK_TOP, by=by, overage=owed)
+    multi = account_count() > 1
+    lines, keyboard = [], []
+    for s, value in top:
+        acct = fleet.account_of[s["id"]]
+        limit_tb = traffic_limit_tb(s)
+        used = format_traffic(s.get("outgoing_traffic", 0), limit_tb)
+        tag = f"[{account_name(acct)}] " if multi else ""
+        figure = f"€{value:.2f} over" if by == "overage" else _eta(value)
+        lines.append(f"• {tag}`{s.get('name', 'Unnamed')}` — {used} · {figure}")
+        keyboard.append([InlineKeyboardButton(
+            f"{get_traffic_emoji(s.get('outgoing_traffic', 0) / 1024 ** 4, limit_tb)} "
+            f"{tag}{s.get('name', 'Unnamed')} · {figure}",
+            callback_data=f"fsrv_{acct}_{s['id']}",
+        )])
+
+    over = fleet.over_limit()
+    if over:
+        keyboard.append([InlineKeyboardButton(
+            f"♻️ Reset all {len(over)} over the limit", callback_data="atreset",
+        )])
+    title = "🚨 *AT RISK* — " + ("most overage owed" if by == "overage" else "soonest to hit the limit")
+    if not lines:
+        body = "No server is past its allowance. 🎉" if by == "overage" else "No traffic recorded yet."
+    else:
+        body = "\n".join(lines)
+    age = max(0, int(time.time() - fleet.built_at))
+    other = "time" if by == "overage" else "overage"
+    keyboard.append([
+        InlineKeyboardButton(
+            "⏳ By Time to Limit" if other == "time" else "💶 By Overage €",
+            callback_data=f"atrisk_{other}",
+        ),
+        InlineKeyboardButton("🔄 Refresh", callback_data=f"atrisk_{by}"),
+    ])
+    keyboard.append([InlineKeyboardButton("🧮 Reset or Pay?", callback_data="advice")])
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")])
+    await _edit(query,
+        f"{title}\n\n{body}\n\n"
+        f"_Pace since the start of the month · {len(fleet.servers)} servers, "
+        f"data {age // 60} min old_",
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode="Markdown",
     )
 
 
+async def at_risk_reset_confirm(query, context):
+    """Offer to reset every server past its allowance, on every account."""
+    fleet = await server_indexes.load_fleet(all_apis())
+    over = fleet.over_limit()
+    if not over:
+        await show_at_risk(query, context)
+        return
+    await _confirm_fleet_resets(query, context, fleet, over, "past their allowance", "atrisk_time")
+
+
+async def _confirm_fleet_resets(query, context, fleet, over, why, cancel):
+    # what is confirmed is what runs, even if the fleet is fetched again meanwhile
+    context.user_data["reset_targets"] = [(fleet.account_of[s["id"]], s["id"], s.get("name", "?")) for s in over]
+    multi = account_count() > 1
+    names = ", ".join(
+        (f"[{account_name(fleet.account_of[s['id']])}] " if multi else "") + f"`{s.get('name', '?')}`"
+        for s in over[:15]
+    )
+    if len(over) > 15:
+        names += f" and {len(over) - 15} more"
+    keyboard = [[
+        InlineKeyboardButton(f"✅ Reset {len(over)} servers", callback_data="atresetgo"),
+        InlineKeyboardButton("❌ Cancel", callback_data=cancel),
+    ]]
+    await _edit(query,
+        f"⚠️ *Reset traffic* on {len(over)} servers {why}?\n\n{names}\n\n"
+        "Each server is powered off, upgraded and downgraded again: minutes of downtime each.\n"
+        f"Up to {Config.RESET_CONCURRENCY} per account run at a time.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+
+
+async def at_risk_reset_run(query, context):
+    confirmed = context.user_data.pop("reset_targets", None)
+    if not confirmed:
+        await show_at_risk(query, context)
+        return
+    names = {sid: name for _acct, sid, name in confirmed}
+
+    def keyboard(failed):
+        return [[InlineKeyboardButton("🚨 Back to At Risk", callback_data="atrisk_time")]]
+
+    await _run_resets(query, [(acct, sid) for acct, sid, _name in confirmed], names, keyboard)
+
+
+_JOB_ICONS = {"queued": "⏸", "running": "⏳", "done": "✅", "failed": "❌", "cancelled": "🛑"}
+
+
+def _plain(text):
+    """Job text with the Markdown marks dropped, to sit inside a Markdown screen."""
+    return text.translate(str.maketrans("", "", "*_`["))
+
+
+def _job_line(job, now):
+    line = f"{_JOB_ICONS[job.state]} #{job.id} {_plain(job.title)} · {eta(job.age(now))}"
+    if job.progress and job.active:
+        line += f"\n      {_plain(job.progress)}"
+    return line
+
+
+async def show_jobs(query, context):
+    now = time.time()
+    active = job_manager.active()
+    recent = job_manager.recent()[:5]
+    text = "⚙️ *Jobs*\n\n"
+    if active:
+        text += "\n".join(_job_line(job, now) for job in active)
+    else:
+        text += "Nothing running."
+    if recent:
+        text += "\n\n*Finished*\n" + "\n".join(_job_line(job, now) for job in recent)
+    if server_locks.summary():
+        text += f"\n\n_{server_locks.summary()}_"
+    keyboard = [
+        [InlineKeyboardButton(f"🛑 Cancel #{job.id}", callback_data=f"jobcancel_{job.id}")]
+        for job in active
+    ]
+    keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data="jobs")])
+    keyboard.append([InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")])
+    await _edit(query, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+
+
+async def job_cancel_confirm(query, context, job_id):
+    job = job_manager.jobs.get(job_id)
+    if job is None or not job.active:
+        await show_jobs(query, context)
+        return
+    text = f"🛑 *Cancel job #{job.id}?*\n\n{_plain(job.title)}\n\n"
+    if job.state == "running":
+        text += (
+            "It stops where it is, without undoing anything. A traffic reset first puts its servers "
+            "back in order: rolled back, or taken back to their own plan if they had left it."
+        )
+    else:
+        text += "It has not started yet."
+    keyboard = [[
+        InlineKeyboardButton("✅ Cancel it", callback_data=f"jobcancelgo_{job.id}"),
+        InlineKeyboardButton("⬅️ Keep it", callback_data="jobs"),
+    ]]
+    await _edit(query, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+
+
+async def job_cancel(query, context, job_id):
+    job = job_manager.jobs.get(job_id)
+    if job_manager.cancel(job_id):
+        # a traffic reset can take a while to put its servers back in order
+        await asyncio.wait({job.task}, timeout=2)
+    await show_jobs(query, context)
+
+
+def _when(ts):
+    return datetime.fromtimestamp(ts).strftime("%b %d %H:%M")
+
+
+async def _fleet_advice():
+    fleet = server_indexes.fleet
+    rebuild = fleet is None or time.time() - fleet.built_at > cost_refresher.interval
+    fleet = await server_indexes.load_fleet(all_apis(), rebuild=rebuild)
+    return fleet, await advise_fleet(fleet, {idx: api for idx, _name, api in all_apis()})
+
+
+async def show_reset_advice(query, context):
+    """Reset or pay, for every server overage is coming for, across accounts.
+
+    Weighs the overage expected by the end of the month at each server's
+    pace against what its reset costs (see reset_advisor), and says when a
+    reset is best done.
+    """
+    fleet, advice = await _fleet_advice()
+    pending = [a for a in advice if a["action"] != "ok"]
+    multi = account_count() > 1
+    lines = []
+    for a in pending[:AT_RISK_TOP]:
+        s = a["server"]
+        tag = f"[{account_name(a['acct'])}] " if multi else ""
+        name = f"{tag}`{s.get('name', 'Unnamed')}`"
+        if a["action"] == "pay":
+            why = f"a reset costs €{a['cost']:.2f}" if a["bounce"] else "no larger plan to reset through"
+            lines.append(f"💶 {name} — pay €{a['pay']:.2f}, {why}")
+            continue
+        when = "reset now" if a["action"] == "reset" else f"reset {_when(a['best_at'])}"
+        lines.append(
+            f"{'♻️' if a['action'] == 'reset' else '⏰'} {name} — {when} · saves €{a['saving']:.2f}\n"
+            f"    €{a['pay']:.2f} overage vs €{a['cost']:.2f} to reset via {a['bounce']}; "
+            f"pays off from {a['break_even_tb']:.2f} TB over"
+            + (" (passed)" if a["break_even_at"] <= time.time() else f" ({_when(a['break_even_at'])})")
+        )
+    if len(pending) > AT_RISK_TOP:
+        lines.append(f"… and {len(pending) - AT_RISK_TOP} more")
+    due = [a for a in advice if a["action"] == "reset"]
+    keyboard = []
+    if due:
+        keyboard.append([InlineKeyboardButton(f"♻️ Reset the {len(due)} due now", callback_data="advreset")])
+    keyboard.append([
+        InlineKeyboardButton("🔄 Refresh", callback_data="advice"),
+        InlineKeyboardButton("🚨 Back to At Risk", callback_data="atrisk_time"),
+    ])
+    auto = "on — due resets run by themselves every hour" if Config.AUTO_RESET else "off (AUTO_RESET)"
+    await _edit(query,
+        "🧮 *RESET OR PAY*\n\n"
+        + ("\n".join(lines) or "No overage expected this month. 🎉")
+        + f"\n\n_At this month's pace until it ends · {len(fleet.servers)} servers · auto reset {auto}_",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+
+
+async def advice_reset_confirm(query, context):
+    fleet, advice = await _fleet_advice()
+    due = [a["server"] for a in advice if a["action"] == "reset"]
+    if not due:
+        await show_reset_advice(query, context)
+        return
+    await _confirm_fleet_resets(query, context, fleet, due, "due for a reset", "advice")
+
+
+async def open_fleet_server(query, context, acct, server_id):
+    """A server picked from the fleet: switch to its account, then open it."""
+    context.user_data["acct"] = acct
+    set_account(acct)
+    await show_server_detail(query, context, server_id)
+
+
+def _server_row(s, selected=None):
+    """A server's button on the list; `selected` is set in selection mode."""
+    tb = s.get("outgoing_traffic", 0) / (1024 ** 4)
+    limit_tb = traffic_limit_tb(s)
+    emoji = get_traffic_emoji(tb, limit_tb)
+    loc_name, flag = get_location_info(get_location(s))
+    label = f"{emoji} {s.get('name','Unnamed')} | {flag} {loc_name} | {format_traffic(s.get('outgoing_traffic',0), limit_tb)}"
+    if selected is None:
+        return InlineKeyboardButton(label, callback_data=f"server_{s['id']}")
+    return InlineKeyboardButton(
+        f"{'✅' if selected else '⬜'} {label}", callback_data=f"lsel_{s['id']}",
+    )
+
+
 async def show_server_detail(query, context, server_id, refresh=False):
     server = await hetzner_api.get_server(server_id, fresh=refresh)
     if not server:
         await _edit(query, "⚠️ Server not found or API error.")
         return
 
+    index = hetzner_api.pricing_index
+    overage_tracker.update_live_overage(server_id, overage_cost(server, index))
+    overage_eur = overage_tracker.get_server_month_overage(server_id)
+    price, custom_price = _billed_prices([server], index)[server["id"]]
+    per_tb = traffic_price_per_tb(server, index)
+
+    text, markup = render_cache.fragment(
+        ("panel", server_version(server), round(overage_eur, 2), price, custom_price, per_tb),
+        lambda: _server_panel(server, overage_eur, price, custom_price, per_tb),
+    )
+    await _edit(query, text, reply_markup=markup, parse_mode="Markdown")
+
+
+def _server_panel(server, overage_eur, price, custom_price, per_tb):
+    server_id = server["id"]
     name   = server.get("name", "Unnamed")
     status = server.get("status", "unknown")
     stype  = server.get("server_type", {}).get("name", "Unknown")
@@ -373,15 +1076,11 @@ async def show_server_detail(query, context, server_id, refresh=False):
     limit_tb      = traffic_limit_tb(server)
     traffic_pct   = (traffic_tb / limit_tb) * 100
     emoji         = get_traffic_emoji(traffic_tb, limit_tb)
-    overage_tracker.update_live_overage(server_id, overage_cost(server))
-    overage_eur   = overage_tracker.get_server_month_overage(server_id)
     ip     = server.get("public_net", {}).get("ipv4", {}).get("ip", "N/A")
     cores  = server.get("server_type", {}).get("cores", "N/A")
     memory = server.get("server_type", {}).get("memory", "N/A")
     disk   = server.get("server_type", {}).get("disk", "N/A")
 
-    price = _server_price(server)
-    custom_price = price_store.get(server_id) is not None
     monthly_price = f"`€{price:.2f}/month`" if price else "`N/A`"
     if custom_price:
         monthly_price += " ✏️"
@@ -399,7 +1098,7 @@ async def show_server_detail(query, context, server_id, refresh=False):
         f"💾 Backups: `{'ON' if backups_on else 'OFF'}`\n\n"
         f"💰 *Pricing* (excl. VAT)\n"
         f"📦 Server Cost: {monthly_price}\n"
-        f"📊 Overage This Month: `€{overage_eur:.2f}` (€{traffic_price_per_tb(server):.2f}/TB)\n\n"
+        f"📊 Overage This Month: `€{overage_eur:.2f}` (€{per_tb:.2f}/TB)\n\n"
         f"{emoji} *Traffic Usage*\n"
         f"📊 {format_traffic(traffic_bytes, limit_tb)} ({traffic_pct:.1f}%)\n"
     )
@@ -443,41 +1142,50 @@ async def show_server_detail(query, context, server_id, refresh=False):
         ],
     ]
 
-    await _edit(query, 
-        text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown",
-    )
+    return text, InlineKeyboardMarkup(keyboard)
 
 
 async def power_action(query, context, server_id, action):
-    await _edit(query, f"⚙️ {'Starting' if action == 'on' else 'Stopping'} server...")
-    result = await (hetzner_api.power_on(server_id) if action == "on" else hetzner_api.power_off(server_id))
-    if result:
-        await hetzner_api.wait_for_status(server_id, "running" if action == "on" else "off")
-        await show_server_detail(query, context, server_id, refresh=True)
-    else:
-        await _edit(query, "❌ Power action failed. Please try again.")
+    async with _server_lock(query, server_id, "power change"):
+        await _edit(query, f"⚙️ {'Starting' if action == 'on' else 'Stopping'} server...")
+        result = await (hetzner_api.power_on(server_id) if action == "on" else hetzner_api.power_off(server_id))
+        if result:
+            await hetzner_api.wait_for_action(
+                result, server_id=server_id, status="running" if action == "on" else "off",
+            )
+            await show_server_detail(query, context, server_id, refresh=True)
+        else:
+            await _edit(query, "❌ Power action failed. Please try again.")
 
 
 async def reset_traffic(query, context, server_id):
-    await _edit(query, "🔄 Starting traffic reset process...\n\nThis may take several minutes.")
+    server = await hetzner_api.get_server(server_id)
+    took = f"about {eta(reset_estimate(server))}" if server else "several minutes"
 
-    async def update_progress(logs):
-        log_text = "\n".join(f"{e} {m}" for e, m in logs)
+    async def work(job):
+        await _edit(query, f"🔄 Starting traffic reset process...\n\nThis should take {took}.")
+        progress = _progress(query)
+        bus = _flow_bus(progress, job, "*Traffic Reset Process*")
         try:
-            await _edit(query, f"*Traffic Reset Process*\n\n{log_text}", parse_mode="Markdown")
-        except Exception:
-            pass
+            success, logs = await reset_server_traffic(server_id, bus)
+        except BaseException:
+            await bus.close()
+            await progress.close()
+            raise
+        await bus.close()
+        log_text = "\n".join(f"{e} {m}" for e, m in logs)
+        final = f"*Traffic Reset Process*\n\n{log_text}\n\n"
+        final += "✅ *Process completed successfully!*" if success else "❌ *Process failed. Check logs above.*"
 
-    success, logs = await reset_server_traffic(server_id, update_progress)
-    log_text = "\n".join(f"{e} {m}" for e, m in logs)
-    final = f"*Traffic Reset Process*\n\n{log_text}\n\n"
-    final += "✅ *Process completed successfully!*" if success else "❌ *Process failed. Check logs above.*"
+        keyboard = [
+            [InlineKeyboardButton("🔄 Refresh Status", callback_data=f"refresh_{server_id}")],
+            [InlineKeyboardButton("⬅️ Back to List", callback_data="list_servers")],
+        ]
+        await progress.close(final, reply_markup=InlineKeyboardMarkup(keyboard))
+        return success
 
-    keyboard = [
-        [InlineKeyboardButton("🔄 Refresh Status", callback_data=f"refresh_{server_id}")],
-        [InlineKeyboardButton("⬅️ Back to List", callback_data="list_servers")],
-    ]
-    await _edit(query, final, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    name = (server or {}).get("name", server_id)
+    await _start_job(query, "reset", f"♻️ Reset traffic of {name}", _here(server_id), work)
 
 
 async def reset_password(query, context, server_id):
@@ -501,203 +1209,157 @@ async def reset_password(query, context, server_id):
 
 
 async def reset_password_confirm(query, context, server_id):
-    await _edit(query, "🔑 Resetting root password...", parse_mode="Markdown")
-    result = await hetzner_api.reset_password(server_id)
-    keyboard = [[InlineKeyboardButton("⬅️ Back to Server", callback_data=f"server_{server_id}")]]
-    if result and result.get("root_password"):
-        pw = result["root_password"]
-        await _edit(query, 
-            f"✅ *Password Reset Successful*\n\n"
-            f"🔑 New root password:\n`{pw}`\n\n"
-            f"⚠️ Save this password now — it won't be shown again.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="Markdown",
-        )
-    else:
-        await _edit(query, 
-            "❌ *Password reset failed.*\n\n"
-            "Make sure qemu-guest-agent is installed and the server is running.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="Markdown",
-        )
+    async with _server_lock(query, server_id, "password reset"):
+        await _edit(query, "🔑 Resetting root password...", parse_mode="Markdown")
+        result = await hetzner_api.reset_password(server_id)
+        keyboard = [[InlineKeyboardButton("⬅️ Back to Server", callback_data=f"server_{server_id}")]]
+        if result and result.get("root_password"):
+            pw = result["root_password"]
+            await _edit(query, 
+                f"✅ *Password Reset Successful*\n\n"
+                f"🔑 New root password:\n`{pw}`\n\n"
+                f"⚠️ Save this password now — it won't be shown again.",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="Markdown",
+            )
+        else:
+            await _edit(query, 
+                "❌ *Password reset failed.*\n\n"
+                "Make sure qemu-guest-agent is installed and the server is running.",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="Markdown",
+            )
 
 
-async def show_overage_cost(query, context):
-    multi = account_count() > 1
-    total_server_cost = backup_cost = 0
-    backup_count = 0
-    snap_size = floating_cost = 0
-    assigned_pip_count = 0
-    vol_size = 0
-    snap_count = fip_count = vol_count = 0
+def _cost_report_text(r, multi):
+    """Markdown for one cost_engine result."""
     server_details = []
-    pricing = {}
-    any_servers = False
-
-    snapshot_cost = extra_primary_cost = volume_cost = 0
-    unassigned_pip_count = 0
-    vat_amount = 0
-    vat_rates = set()
-
-    for idx, name, api in all_apis():
-        servers, pr, snapshots, floating_ips, primary_ips, volumes = await asyncio.gather(
-            api.list_servers(), api.get_pricing(), api.list_images(),
-            api.list_floating_ips(), api.list_primary_ips(), api.list_volumes(),
-        )
-        pr = pr or {}
-        pricing = pr or pricing
-        if servers:
-            any_servers = True
-        try:
-            backup_pct = float(pr.get("server_backup", {}).get("percentage", 20) or 20)
-        except (TypeError, ValueError):
-            backup_pct = 20.0
-
-        acct_cost = 0
-        if multi and servers:
-            server_details.append(f"\n🔑 *{name}*")
-        for s in servers:
-            sname = s.get("name", "Unnamed")
-            stype = s.get("server_type", {}).get("name", "?")
-            limit_tb = traffic_limit_tb(s)
-            sp = _server_price(s)
-            total_server_cost += sp
-            acct_cost += sp
-            overage_tracker.update_live_overage(s["id"], overage_cost(s))
-            ov_month = overage_tracker.get_server_month_overage(s["id"])
-            acct_cost += ov_month
-            edited = " ✏️" if price_store.get(s["id"]) is not None else ""
-            line = f"• `{sname}` ({stype}): €{sp:.2f}{edited} | {format_traffic(s.get('outgoing_traffic', 0), limit_tb)}"
-            if s.get("backup_window"):
-                backup_count += 1
-                backup_cost += sp * backup_pct / 100
-                acct_cost += sp * backup_pct / 100
-                line += " | 💾"
-            if ov_month > 0:
-                line += f" | ⚠️ €{ov_month:.2f} overage"
-            server_details.append(line)
-
-        # every rate below is this account's own, so an account that is not
-        # charged VAT does not inherit another account's rate
-        acct_snap_size = sum(i.get("image_size") or 0 for i in snapshots)
-        acct_snapshot_cost = acct_snap_size * _image_price_per_gb(pr)
-        acct_floating = sum(_floating_ip_price(pr, f) for f in floating_ips)
-        acct_unassigned = [p for p in primary_ips if not p.get("assignee_id")]
-        acct_pip_cost = sum(_primary_ip_price(pr, p) for p in acct_unassigned)
-        acct_vol_size = sum(v.get("size") or 0 for v in volumes)
-        acct_volume_cost = acct_vol_size * _net(
-            pr.get("volume", {}).get("price_per_gb_month", {}) or pr.get("volume", {})
-        )
-        acct_cost += acct_snapshot_cost + acct_floating + acct_pip_cost + acct_volume_cost
-
-        rate = _vat_rate(pr)
-        vat_rates.add(rate)
-        vat_amount += acct_cost * rate / 100
-
-        snap_size += acct_snap_size
-        snap_count += len(snapshots)
-        snapshot_cost += acct_snapshot_cost
-        floating_cost += acct_floating
-        fip_count += len(floating_ips)
-        assigned_pip_count += len([p for p in primary_ips if p.get("assignee_id")])
-        unassigned_pip_count += len(acct_unassigned)
-        extra_primary_cost += acct_pip_cost
-        vol_size += acct_vol_size
-        vol_count += len(volumes)
-        volume_cost += acct_volume_cost
-
-    if not any_servers:
-        await _edit(query, "⚠️ No servers found or API error occurred.")
-        return
-
-    monthly_overage = overage_tracker.get_current_month_overage()
-    monthly_avoided = overage_tracker.get_current_month_avoided()
-    total_historic = overage_tracker.get_total_overage()
-    total_avoided = overage_tracker.get_total_avoided()
-    monthly_breakdown = overage_tracker.get_monthly_breakdown()
-
-    total_usage = (
-        total_server_cost + monthly_overage + backup_cost
-        + snapshot_cost + floating_cost + extra_primary_cost + volume_cost
-    )
-
-    now = datetime.now()
-    days_in_month = calendar.monthrange(now.year, now.month)[1]
-    projected_overage = monthly_overage / now.day * days_in_month
-
-    primary_line = f"📍 Primary IPs: {assigned_pip_count} on servers (free)"
-    if unassigned_pip_count:
-        primary_line += f" | {unassigned_pip_count} unassigned → €{extra_primary_cost:.2f}"
-
-    # one label only when every account is charged the same; mixed accounts
-    # get the amount without a rate, because no single rate describes it
-    charged = sorted(r for r in vat_rates if r)
-    vat_label = f"VAT {charged[0]:.0f}%" if len(set(charged)) == 1 else "VAT"
+    shown_account = None
+    for s in r["servers"]:
+        if multi and s["account"] != shown_account:
+            server_details.append(f"\n🔑 *{s['account']}*")
+            shown_account = s["account"]
+        edited = " ✏️" if s["custom"] else ""
+        line = f"• `{s['name']}` ({s['type']}): €{s['price']:.2f}{edited} | {format_traffic(s['traffic'], s['limit_tb'])}"
+        if s["backup"]:
+            line += " | 💾"
+        if s["overage"] > 0:
+            line += f" | ⚠️ €{s['overage']:.2f} overage"
+        server_details.append(line)
+
+    res, totals, ov = r["resources"], r["totals"], r["overage"]
+    snaps, vols, backups = res["snapshots"], res["volumes"], res["backups"]
+    fips, pips = res["floating_ips"], res["primary_ips"]
+
+    primary_line = f"📍 Primary IPs: {pips.get('assigned', 0)} on servers (free)"
+    if pips.get("unassigned"):
+        primary_line += f" | {pips['unassigned']} unassigned → €{pips['cost']:.2f}"
+
+    vat_label = totals["vat_label"]
     text = (
         f"💸 *COST REPORT*\n\n"
         f"📦 *Servers (This Month)*\n" + "\n".join(server_details) + "\n\n"
         f"🧩 *Other Resources*\n"
-        f"📸 Snapshots ({snap_count}): {snap_size:.1f} GB → €{snapshot_cost:.2f}\n"
-        f"💽 Volumes ({vol_count}): {vol_size} GB → €{volume_cost:.2f}\n"
-        f"💾 Backups ({backup_count} servers): €{backup_cost:.2f}\n"
-        f"🌐 Floating IPs ({fip_count}): €{floating_cost:.2f}\n"
+        f"📸 Snapshots ({snaps.get('count', 0)}): {snaps.get('size', 0):.1f} GB → €{snaps['cost']:.2f}\n"
+        f"💽 Volumes ({vols.get('count', 0)}): {vols.get('size', 0)} GB → €{vols['cost']:.2f}\n"
+        f"💾 Backups ({backups.get('count', 0)} servers): €{backups['cost']:.2f}\n"
+        f"🌐 Floating IPs ({fips.get('count', 0)}): €{fips['cost']:.2f}\n"
         f"{primary_line}\n\n"
         f"📊 *Summary* (excl. VAT)\n"
-        f"📦 Server costs: €{total_server_cost:.2f}\n"
-        f"📈 Overage: €{monthly_overage:.2f}\n"
-        f"📸 Snapshots: €{snapshot_cost:.2f}\n"
-        f"💽 Volumes: €{volume_cost:.2f}\n"
-        f"💾 Backups: €{backup_cost:.2f}\n"
-        f"🌐 Floating IPs: €{floating_cost:.2f}\n"
+        f"📦 Server costs: €{totals['server_cost']:.2f}\n"
+        f"📈 Overage: €{totals['overage']:.2f}\n"
+        f"📸 Snapshots: €{snaps['cost']:.2f}\n"
+        f"💽 Volumes: €{vols['cost']:.2f}\n"
+        f"💾 Backups: €{backups['cost']:.2f}\n"
+        f"🌐 Floating IPs: €{fips['cost']:.2f}\n"
     )
-    if unassigned_pip_count:
-        text += f"📍 Extra primary IPs: €{extra_primary_cost:.2f}\n"
-    if vat_amount:
-        text += f"🧾 Subtotal: €{total_usage:.2f}\n"
-        text += f"➕ {vat_label}: €{vat_amount:.2f}\n"
-    text += f"💰 *Total: €{total_usage + vat_amount:.2f}*\n\n"
-    if monthly_overage > 0:
+    if pips.get("unassigned"):
+        text += f"📍 Extra primary IPs: €{pips['cost']:.2f}\n"
+    if totals["vat"]:
+        text += f"🧾 Subtotal: €{totals['subtotal']:.2f}\n"
+        text += f"➕ {vat_label}: €{totals['vat']:.2f}\n"
+    text += f"💰 *Total: €{totals['total']:.2f}*\n\n"
+    if ov["month"] > 0:
         text += (
             f"🔮 *Projected Month-End Overage*\n"
-            f"~€{projected_overage:.2f} at the current usage rate\n\n"
+            f"~€{ov['projected']:.2f} at the current usage rate\n\n"
         )
-    if monthly_avoided:
+    if ov["month_avoided"]:
         text += (
             f"♻️ *Saved by Traffic Resets*\n"
-            f"€{monthly_avoided:.2f} this month is not billed — the counter was reset "
+            f"€{ov['month_avoided']:.2f} this month is not billed — the counter was reset "
             f"before Hetzner charged it.\n\n"
         )
-    text += f"🔴 *Total Overage Paid (All Time)*\n€{total_historic:.2f}\n"
-    if total_avoided:
-        text += f"♻️ *Total Saved by Resets*\n€{total_avoided:.2f}\n"
-    if monthly_breakdown:
+    text += f"🔴 *Total Overage Paid (All Time)*\n€{ov['total_paid']:.2f}\n"
+    if ov["total_avoided"]:
+        text += f"♻️ *Total Saved by Resets*\n€{ov['total_avoided']:.2f}\n"
+    if ov["breakdown"]:
         text += "\n*Billed in Previous Months:*\n"
-        for month, cost in monthly_breakdown[:6]:
+        for month, cost in ov["breakdown"][:6]:
             text += f"• {month}: €{cost:.2f}\n"
-    if vat_amount and multi:
+    if totals["vat"] and multi:
         text += (
             "\n_Every price above is net. VAT is added once per account, at the rate "
             "Hetzner reports for each — accounts it reports no VAT for are billed net._\n"
         )
-    elif vat_amount:
+    elif totals["vat"]:
         text += (
             f"\n_Every price above is net; {vat_label} is the rate Hetzner reports for "
             "this account, added once in the total._\n"
         )
     else:
         text += "\n_Hetzner reports no VAT for this account, so the total is net._\n"
-    if price_store.all():
+    if r["any_custom_price"]:
         text += "_✏️ marks a price set by hand in the server's own panel._\n"
-    text += f"\n🕓 Updated: `{now.strftime('%H:%M:%S')}`"
+    return text
+
+
+async def show_overage_cost(query, context, force=False):
+    """Render the cost report from the data the refresher already holds.
+
+    Only the first report after a start, or the Refresh button, waits for
+    the accounts to be collected.
+    """
+    if force:
+        await _edit(query, "🔄 Recomputing the cost report...")
+    result, oldest, refreshing = await cost_refresher.report(force=force)
+    if not result["any_servers"]:
+        await _edit(query, "⚠️ No servers found or API error occurred.")
+        return
+
+    text = _cost_report_text(result, account_count() > 1)
+    age = int(time.time() - oldest)
+    text += f"\n🕓 Updated: `{datetime.fromtimestamp(oldest).strftime('%H:%M:%S')}`"
+    text += f" ({age // 60}m {age % 60}s ago)" if age >= 60 else f" ({age}s ago)"
+    if refreshing:
+        text += "\n⏳ _Newer figures are being collected — tap Refresh to wait for them._"
 
     keyboard = [
-        [InlineKeyboardButton("🔄 Refresh", callback_data="overage_cost")],
+        [
+            InlineKeyboardButton("🔄 Refresh", callback_data="overage_refresh"),
+            InlineKeyboardButton("📤 Export JSON", callback_data="overage_json"),
+        ],
         [InlineKeyboardButton("📊 Server Management", callback_data="list_servers")],
         [InlineKeyboardButton("⬅️ Back", callback_data="start_menu")],
     ]
     await _edit(query, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
 
 
+async def export_overage_cost(query, context):
+    """Send the same figures as the cost report, as a JSON document.
+
+    A file is kept, so it waits for accounts changed since they were last
+    collected rather than exporting their old figures.
+    """
+    result, _oldest, _refreshing = await cost_refresher.report(wait=True)
+    name = f"cost-report-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    await query.message.reply_document(
+        document=json.dumps(result, indent=2, default=str).encode(),
+        filename=name,
+        caption="💸 Cost report (net prices, VAT per account)",
+    )
+
+
 WAIT_PRICE = 100
 
 
@@ -969,8 +1631,9 @@ async def create_snapshot(query, context, server_id):
     name = server.get("name", "Server")
     description = f"{name} {datetime.now().strftime('%Y-%m-%d %H:%M')}"
 
-    await _edit(query, f"📸 Creating snapshot of `{name}`...", parse_mode="Markdown")
-    result = await hetzner_api.create_snapshot(server_id, description)
+    async with _server_lock(query, server_id, "snapshot"):
+        await _edit(query, f"📸 Creating snapshot of `{name}`...", parse_mode="Markdown")
+        result = await hetzner_api.create_snapshot(server_id, description)
 
     keyboard = [[InlineKeyboardButton("📸 View Server Snapshots", callback_data=f"srvsnap_{server_id}")],
                 [InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")],
@@ -1049,22 +1712,32 @@ async def rebuild_confirm(query, context, server_id, image):
 
 
 async def rebuild_go(query, context, server_id, image):
-    await _edit(query, "🔧 Rebuilding server... this takes a minute or two.")
-    result = await hetzner_api.rebuild_server(server_id, image)
-    keyboard = [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
-    if result:
-        pw = result.get("root_password")
-        text = f"✅ *Rebuild started* with `{image}`.\n\n"
-        if pw:
-            text += f"🔑 New root password:\n`{pw}`\n\n⚠️ Save it now — it won't be shown again."
-        else:
-            text += "Your SSH keys were installed, no new password was generated."
-        await _edit(query, text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
-    else:
-        await _edit(query, 
-            "❌ Rebuild failed. Check the logs and try again.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+    async def work(job):
+        async with _server_lock(query, server_id, "rebuild"):
+            await _edit(query, "🔧 Rebuilding server... this takes a minute or two.")
+            result = await hetzner_api.rebuild_server(server_id, image)
+            keyboard = [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
+            if not result:
+                await _edit(query,
+                    "❌ Rebuild failed. Check the logs and try again.",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                )
+                return False
+            pw = result.get("root_password")
+            text = f"with `{image}`.\n\n"
+            if pw:
+                text += f"🔑 New root password:\n`{pw}`\n\n⚠️ Save it now — it won't be shown again."
+            else:
+                text += "Your SSH keys were installed, no new password was generated."
+            # the password is shown at once; the job ends when the rebuild does
+            await _edit(query, "⏳ *Rebuild started* " + text, parse_mode="Markdown")
+            job.note("⏳ installing the image")
+            done = await hetzner_api.wait_for_action(result, timeout=900)
+            head = "✅ *Rebuild finished* " if done is not False else "⚠️ *Rebuild not confirmed* "
+            await _edit(query, head + text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+            return done is not False
+
+    await _start_job(query, "rebuild", f"🔧 Rebuild with {image}", _here(server_id), work)
 
 
 _FAMILY_LABEL = {
@@ -1246,55 +1919,79 @@ async def resize_confirm(query, context, server_id, new_type_name):
 
 
 async def resize_go(query, context, server_id, new_type_name, upgrade_disk):
-    steps = []
+    async def work(job):
+        async with _server_lock(query, server_id, "plan change"):
+            steps = []
+            progress = _progress(query)
+
+            async def log(line):
+                steps.append(line)
+                progress.push("⚖️ *Changing Plan*\n\n" + "\n".join(steps))
+                job.note(line)
+
+            try:
+                await _resize(server_id, new_type_name, upgrade_disk, log)
+            except BaseException:
+                await progress.close()
+                raise
+            if not steps or steps[-1].startswith("❌"):
+                await progress.close()
+                return False
+
+            keyboard = [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
+            await progress.close(
+                "⚖️ *Changing Plan*\n\n" + "\n".join(steps) + "\n\n🎉 *Done!*",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+            )
+
+    await _start_job(query, "resize", f"⚖️ Change plan to {new_type_name}", _here(server_id), work)
 
-    async def log(line):
-        steps.append(line)
-        try:
-            await _edit(query, "⚖️ *Changing Plan*\n\n" + "\n".join(steps), parse_mode="Markdown")
-        except Exception:
-            pass
 
+async def _resize(server_id, new_type_name, upgrade_disk, log):
     server = await hetzner_api.get_server(server_id)
     if not server:
-        await _edit(query, "⚠️ Server not found or API error.")
+        await log("❌ Server not found or API error.")
         return
     was_running = server.get("status") == "running"
 
     if was_running:
-        await log("🔴 Powering off server...")
-        await hetzner_api.power_off(server_id)
-        if not await hetzner_api.wait_for_status(server_id, "off", max_attempts=40):
+        await log(f"🔴 Powering off server... {eta(phase_timings.estimate('power_off', *_timing_key(server)))}")
+        result = await hetzner_api.power_off(server_id)
+        if not await timed_wait(hetzner_api, result, "power_off", server):
             await log("❌ Server failed to power off.")
             return
         await log("✅ Server is OFF")
 
-    await log(f"⚖️ Switching to `{new_type_name}`{' (with disk upgrade)' if upgrade_disk else ''}...")
+    expected = phase_timings.estimate("change_type", new_type_name, location_name(server), upgrade_disk)
+    await log(
+        f"⚖️ Switching to `{new_type_name}`{' (with disk upgrade)' if upgrade_disk else ''}... {eta(expected)}"
+    )
     result = await hetzner_api.change_server_type(server_id, new_type_name, upgrade_disk=upgrade_disk)
     if not result or result.get("error"):
         msg = (result or {}).get("error", {}).get("message", "Unknown error")
         await log(f"❌ Change failed: {msg}")
         return
 
-    for _ in range(30):
-        await asyncio.sleep(5)
-        server = await hetzner_api.get_server(server_id, fresh=True)
-        if server and server.get("server_type", {}).get("name") == new_type_name:
-            await log("✅ Plan changed successfully")
-            break
+    # a disk upgrade copies the disk: allow it longer
+    if await timed_wait(hetzner_api, result, "change_type", server, stype=new_type_name, disk=upgrade_disk,
+                        timeout=1800 if upgrade_disk else 600):
+        await log("✅ Plan changed successfully")
+    else:
+        await log("⚠️ The plan change has not been confirmed yet")
 
     if was_running:
-        await log("🟢 Powering server back on...")
-        await hetzner_api.power_on(server_id)
-        await hetzner_api.wait_for_status(server_id, "running", max_attempts=40)
-        await log("✅ Server is RUNNING")
+        server = {**server, "server_type": {**server.get("server_type", {}), "name": new_type_name}}
+        await log(f"🟢 Powering server back on... {eta(phase_timings.estimate('power_on', *_timing_key(server)))}")
+        result = await hetzner_api.power_on(server_id)
+        if await timed_wait(hetzner_api, result, "power_on", server):
+            await log("✅ Server is RUNNING")
+        else:
+            await log("⚠️ Server started but status check timed out")
 
-    keyboard = [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
-    await _edit(query, 
-        "⚖️ *Changing Plan*\n\n" + "\n".join(steps) + "\n\n🎉 *Done!*",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode="Markdown",
-    )
+
+def _timing_key(server):
+    """(plan, location) a server's steps are timed under in phase_timings."""
+    return server.get("server_type", {}).get("name"), location_name(server)
 
 
 async def show_volumes(query, context, server_id):
@@ -1359,38 +2056,49 @@ async def volume_pick_size(query, context, server_id):
 
 
 async def volume_create(query, context, server_id, size):
-    await _edit(query, f"💽 Creating {size} GB volume...")
-    name = f"vol-{datetime.now().strftime('%y%m%d%H%M%S')}"
-    result = await hetzner_api.create_volume(name, size, server_id)
-    keyboard = [[InlineKeyboardButton("💽 Back to Volumes", callback_data=f"volmenu_{server_id}")]]
-    if result:
-        device = result.get("volume", {}).get("linux_device", "?")
-        await _edit(query, 
-            f"✅ *Volume created & attached*\n\n"
-            f"🏷 Name: `{name}`\n💾 Size: `{size} GB`\n📁 Device: `{device}`\n\n"
-            f"It is formatted as ext4 and auto-mounted.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="Markdown",
-        )
-    else:
-        await _edit(query, 
-            "❌ Volume creation failed. Check the logs and try again.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+    async def work(job):
+        async with _server_lock(query, server_id, "volume change"):
+            await _edit(query, f"💽 Creating {size} GB volume...")
+            name = f"vol-{datetime.now().strftime('%y%m%d%H%M%S')}"
+            result = await hetzner_api.create_volume(name, size, server_id)
+            keyboard = [[InlineKeyboardButton("💽 Back to Volumes", callback_data=f"volmenu_{server_id}")]]
+            if result:
+                device = result.get("volume", {}).get("linux_device", "?")
+                await _edit(query,
+                    f"✅ *Volume created & attached*\n\n"
+                    f"🏷 Name: `{name}`\n💾 Size: `{size} GB`\n📁 Device: `{device}`\n\n"
+                    f"It is formatted as ext4 and auto-mounted.",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode="Markdown",
+                )
+            else:
+                await _edit(query,
+                    "❌ Volume creation failed. Check the logs and try again.",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                )
+            return bool(result)
+
+    await _start_job(query, "volume", f"💽 New {size} GB volume", _here(server_id), work)
 
 
 async def volume_attach(query, context, volume_id, server_id):
-    await _edit(query, "🔗 Attaching volume...")
-    await hetzner_api.attach_volume(volume_id, server_id)
-    await asyncio.sleep(3)
-    await show_volumes(query, context, server_id)
+    async def work(job):
+        async with _server_lock(query, server_id, "volume change"):
+            await _edit(query, "🔗 Attaching volume...")
+            await hetzner_api.wait_for_action(await hetzner_api.attach_volume(volume_id, server_id), timeout=60)
+            await show_volumes(query, context, server_id)
+
+    await _start_job(query, "volume", "🔗 Attach a volume", _here(server_id), work)
 
 
 async def volume_detach(query, context, volume_id, server_id):
-    await _edit(query, "🔌 Detaching volume...")
-    await hetzner_api.detach_volume(volume_id)
-    await asyncio.sleep(3)
-    await show_volumes(query, context, server_id)
+    async def work(job):
+        async with _server_lock(query, server_id, "volume change"):
+            await _edit(query, "🔌 Detaching volume...")
+            await hetzner_api.wait_for_action(await hetzner_api.detach_volume(volume_id), timeout=60)
+            await show_volumes(query, context, server_id)
+
+    await _start_job(query, "volume", "🔌 Detach a volume", _here(server_id), work)
 
 
 async def volume_delete_confirm(query, context, volume_id, server_id):
@@ -1410,21 +2118,25 @@ async def volume_delete_confirm(query, context, volume_id, server_id):
 
 
 async def volume_delete(query, context, volume_id, server_id):
-    await _edit(query, "🗑 Deleting volume...")
-    volumes = await hetzner_api.list_volumes()
-    vol = next((v for v in volumes if v.get("id") == volume_id), None)
-    if vol and vol.get("server"):
-        await hetzner_api.detach_volume(volume_id)
-        await asyncio.sleep(5)
-    result = await hetzner_api.delete_volume(volume_id)
-    keyboard = [[InlineKeyboardButton("💽 Back to Volumes", callback_data=f"volmenu_{server_id}")]]
-    if result is not None:
-        await _edit(query, "✅ Volume deleted.", reply_markup=InlineKeyboardMarkup(keyboard))
-    else:
-        await _edit(query, 
-            "❌ Failed to delete the volume. Check the logs and try again.",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+    async def work(job):
+        async with _server_lock(query, server_id, "volume change"):
+            await _edit(query, "🗑 Deleting volume...")
+            volumes = await hetzner_api.list_volumes()
+            vol = next((v for v in volumes if v.get("id") == volume_id), None)
+            if vol and vol.get("server"):
+                await hetzner_api.wait_for_action(await hetzner_api.detach_volume(volume_id), timeout=60)
+            result = await hetzner_api.delete_volume(volume_id)
+            keyboard = [[InlineKeyboardButton("💽 Back to Volumes", callback_data=f"volmenu_{server_id}")]]
+            if result is not None:
+                await _edit(query, "✅ Volume deleted.", reply_markup=InlineKeyboardMarkup(keyboard))
+            else:
+                await _edit(query,
+                    "❌ Failed to delete the volume. Check the logs and try again.",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                )
+            return result is not None
+
+    await _start_job(query, "volume", "🗑 Delete a volume", _here(server_id), work)
 
 
 async def show_server_fips(query, context, server_id):
@@ -1464,17 +2176,17 @@ async def show_server_fips(query, context, server_id):
 
 
 async def server_fip_assign(query, context, fip_id, server_id):
-    await _edit(query, "🔗 Attaching floating IP...")
-    await hetzner_api.assign_floating_ip(fip_id, server_id)
-    await asyncio.sleep(2)
-    await show_server_fips(query, context, server_id)
+    async with _server_lock(query, server_id, "floating IP change"):
+        await _edit(query, "🔗 Attaching floating IP...")
+        await hetzner_api.wait_for_action(await hetzner_api.assign_floating_ip(fip_id, server_id), timeout=60)
+        await show_server_fips(query, context, server_id)
 
 
 async def server_fip_unassign(query, context, fip_id, server_id):
-    await _edit(query, "🔌 Detaching floating IP...")
-    await hetzner_api.unassign_floating_ip(fip_id)
-    await asyncio.sleep(2)
-    await show_server_fips(query, context, server_id)
+    async with _server_lock(query, server_id, "floating IP change"):
+        await _edit(query, "🔌 Detaching floating IP...")
+        await hetzner_api.wait_for_action(await hetzner_api.unassign_floating_ip(fip_id), timeout=60)
+        await show_server_fips(query, context, server_id)
 
 
 async def backup_toggle_confirm(query, context, server_id):
@@ -1505,21 +2217,22 @@ async def backup_toggle_confirm(query, context, server_id):
 
 
 async def backup_toggle_go(query, context, server_id, mode):
-    await _edit(query, "💾 Updating backup settings...")
-    if mode == "on":
-        result = await hetzner_api.enable_backup(server_id)
-    else:
-        result = await hetzner_api.disable_backup(server_id)
-    if result:
-        await asyncio.sleep(2)
-        await show_server_detail(query, context, server_id, refresh=True)
-    else:
-        await _edit(query, 
-            "❌ Failed to change backup settings. Check the logs and try again.",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
-            ),
-        )
+    async with _server_lock(query, server_id, "backup change"):
+        await _edit(query, "💾 Updating backup settings...")
+        if mode == "on":
+            result = await hetzner_api.enable_backup(server_id)
+        else:
+            result = await hetzner_api.disable_backup(server_id)
+        if result:
+            await hetzner_api.wait_for_action(result, timeout=60)
+            await show_server_detail(query, context, server_id, refresh=True)
+        else:
+            await _edit(query, 
+                "❌ Failed to change backup settings. Check the logs and try again.",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("🖥 Back to Server", callback_data=f"server_{server_id}")]]
+                ),
+            )
 
 
 _IP_LABEL = {"fip": ("🌐", "Floating IP"), "pip": ("📍", "Primary IP")}
@@ -1543,9 +2256,9 @@ def _ip_location_name(kind, ip):
 
 async def show_ip_list(query, context, kind):
     emoji, label = _IP_LABEL[kind]
-    ips, pricing, servers = await asyncio.gather(
+    ips, index, servers = await asyncio.gather(
         _fetch_ips(kind),
-        hetzner_api.get_pricing(),
+        hetzner_api.get_pricing_index(),
         hetzner_api.list_servers(),
     )
     server_names = {s["id"]: s.get("name", "?") for s in servers}
@@ -1566,9 +2279,9 @@ async def show_ip_list(query, context, kind):
             loc = _ip_location_name(kind, ip)
             _, flag = get_location_info(loc)
             if kind == "fip":
-                price = _floating_ip_price(pricing, ip)
+                price = index.floating_ip_price(ip)
             else:
-                price = 0 if aid else _primary_ip_price(pricing, ip)
+                price = 0 if aid else index.primary_ip_price(ip)
             total_cost += price
             attach = f"🔗 {server_names.get(aid, aid)}" if aid else "🆓 unassigned"
             cost_str = "free (on server)" if (kind == "pip" and aid) else f"€{price:.2f}/mo"
@@ -1663,26 +2376,50 @@ async def ip_create(query, context, kind, ip_type, place, count):
     emoji, label = _IP_LABEL[kind]
     await _edit(query, f"{emoji} Creating {count} {label.lower()}(s)...")
     stamp = datetime.now().strftime('%y%m%d%H%M%S')
+    create = hetzner_api.create_floating_ip if kind == "fip" else hetzner_api.create_primary_ip
+    find = hetzner_api.find_floating_ip if kind == "fip" else hetzner_api.find_primary_ip
+    field = "floating_ip" if kind == "fip" else "primary_ip"
+
+    async def one(i, _note):
+        name = f"{kind}-{stamp}-{i + 1}"
+        refused = [False]
+
+        async def attempt():
+            result = await create(ip_type, place, name)
+            if result is not None:
+                return result.get(field) or {"ip": name}
+            refused[0] = last_failure_refused()
+            if last_failure_transient():
+                # a timeout or a 5xx may come after the IP was made: look for it
+                # by its name before anything is sent again
+                return await find(name)
+            return None
+
+        # only a create Hetzner turned away untouched is sent again
+        result, tries = await retry(attempt, lambda: refused[0])
+        if not result:
+            return False, (name, tries)
+        return True, (result, tries)
+
+    start = time.perf_counter()
+    limit = _bulk_limit(1)
+    results = await run_bounded(range(count), one, limit)
+    took = time.perf_counter() - start
+
     lines = []
     fresh = []
-    ok = 0
-    for i in range(count):
-        name = f"{kind}-{stamp}-{i + 1}"
-        if kind == "fip":
-            result = await hetzner_api.create_floating_ip(ip_type, place, name)
-            created = (result or {}).get("floating_ip", {})
+    for _i, ok, (item, tries) in results:
+        again = f" (try {tries})" if tries > 1 else ""
+        if ok:
+            lines.append(f"✅ `{item.get('ip', '?')}`{again}")
+            if item.get("id"):
+                fresh.append(item)
         else:
-            result = await hetzner_api.create_primary_ip(ip_type, place, name)
-            created = (result or {}).get("primary_ip", {})
-        if result:
-            ok += 1
-            lines.append(f"✅ `{created.get('ip', name)}`")
-            if created.get("id"):
-                fresh.append(created)
-        else:
-            lines.append(f"❌ {name} — creation failed")
+            lines.append(f"❌ {item} — creation failed{again}")
+    ok = sum(1 for r in results if r[1])
     text = (
         f"{emoji} *Create {label}s — done ({ok}/{count})*\n\n" + "\n".join(lines)
+        + f"\n\n⏱ {took:.1f}s, up to {min(limit, count)} at a time"
     )
     keyboard = []
     # putting a new IP on a server is the usual next step, so offer it here
@@ -1794,30 +2531,37 @@ async def pip_detach_confirm(query, context, pip_id):
     )
 
 
-async def _run_ip_job(query, context, coro_factory, done_title):
-    """Stream a swap/detach into the message as it runs."""
-    async def progress(logs):
+async def _run_ip_job(query, context, coro_factory, done_title, server_id):
+    """Stream a swap/detach into the message as it runs, as a job on the server."""
+    async def work(job):
+        channel = _progress(query)
+        bus = _flow_bus(channel, job, "⏳ *Working...*")
+        try:
+            ok, logs = await coro_factory(bus)
+        except BaseException:
+            await bus.close()
+            await channel.close()
+            raise
+        await bus.close()
         body = "\n".join(f"{e} {m}" for e, m in logs)
-        await _edit(query, f"⏳ *Working...*\n\n{body}", parse_mode="Markdown")
+        keyboard = [
+            [InlineKeyboardButton("📍 Primary IPs", callback_data="pips")],
+            [InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")],
+        ]
+        await channel.close(
+            f"{'✅' if ok else '❌'} *{done_title}*\n\n{body}",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+        return ok
 
-    ok, logs = await coro_factory(progress)
-    body = "\n".join(f"{e} {m}" for e, m in logs)
-    keyboard = [
-        [InlineKeyboardButton("📍 Primary IPs", callback_data="pips")],
-        [InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")],
-    ]
-    await _edit(query,
-        f"{'✅' if ok else '❌'} *{done_title}*\n\n{body}",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode="Markdown",
-    )
+    await _start_job(query, "ip", f"📍 {done_title}", _here(server_id), work)
 
 
 async def pip_attach_go(query, context, pip_id, server_id):
     await _run_ip_job(
         query, context,
-        lambda cb: swap_primary_ip(server_id, pip_id, progress_callback=cb),
-        "IP swap",
+        lambda bus: swap_primary_ip(server_id, pip_id, progress=bus),
+        "IP swap", server_id,
     )
 
 
@@ -1829,8 +2573,8 @@ async def pip_detach_go(query, context, pip_id):
         return
     await _run_ip_job(
         query, context,
-        lambda cb: detach_primary_ip(pip["assignee_id"], pip_id, progress_callback=cb),
-        "IP detached",
+        lambda bus: detach_primary_ip(pip["assignee_id"], pip_id, progress=bus),
+        "IP detached", pip["assignee_id"],
     )
 
 
@@ -1869,21 +2613,41 @@ async def ip_delete_selected(query, context, kind):
     await _edit(query, f"🗑 Deleting {len(sel)} {label.lower()}(s)...")
     ips = await _fetch_ips(kind)
     ip_by_id = {ip["id"]: ip for ip in ips}
+    delete = hetzner_api.delete_floating_ip if kind == "fip" else hetzner_api.delete_primary_ip
+
+    async def one(ip_id, _note):
+        sent = [0]
+
+        async def attempt():
+            sent[0] += 1
+            result = await delete(ip_id)
+            if result is None and sent[0] > 1 and last_failure_not_found():
+                return {}               # an earlier try went through after all
+            return result
+
+        result, tries = await retry(attempt, last_failure_transient)
+        return result is not None, tries
+
+    start = time.perf_counter()
+    limit = _bulk_limit(1)
+    results = await run_bounded(sorted(sel), one, limit)
+    took = time.perf_counter() - start
+
     lines = []
-    ok = 0
-    for ip_id in sorted(sel):
+    for ip_id, ok, tries in results:
         addr = ip_by_id.get(ip_id, {}).get("ip", ip_id)
-        if kind == "fip":
-            result = await hetzner_api.delete_floating_ip(ip_id)
+        again = f" (try {tries})" if tries > 1 else ""
+        if ok:
+            lines.append(f"✅ `{addr}` deleted{again}")
         else:
-            result = await hetzner_api.delete_primary_ip(ip_id)
-        if result is not None:
-            ok += 1
-            lines.append(f"✅ `{addr}` deleted")
-        else:
-            lines.append(f"❌ `{addr}` failed (still attached?)")
-    context.user_data[f"{kind}_sel"] = set()
-    text = f"🗑 *Delete {label}s — done ({ok}/{len(lines)})*\n\n" + "\n".join(lines)
+            lines.append(f"❌ `{addr}` failed (still attached?){again}")
+    ok = sum(1 for r in results if r[1])
+    # what failed stays selected, ready for another try
+    context.user_data[f"{kind}_sel"] = {ip_id for ip_id, done, _tries in results if not done}
+    text = (
+        f"🗑 *Delete {label}s — done ({ok}/{len(lines)})*\n\n" + "\n".join(lines)
+        + f"\n\n⏱ {took:.1f}s, up to {min(limit, len(lines))} at a time"
+    )
     keyboard = [
         [InlineKeyboardButton(f"{emoji} View {label}s", callback_data=f"{kind}s")],
         [InlineKeyboardButton("⬅️ Back to Menu", callback_data="start_menu")],
@@ -1901,3 +2665,162 @@ async def show_start_menu(query):
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode="Markdown",
     )
+
+
+async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats — how long each screen takes, slowest first."""
+    if update.effective_user.id != Config.ADMIN_ID:
+        return
+    rows = router.summary()
+    if not rows:
+        await update.message.reply_text("📈 No button presses recorded yet.")
+        return
+    lines = [
+        f"`{key:<18}` {calls:>4}× p50 {p50 * 1000:>6.0f}ms p95 {p95 * 1000:>6.0f}ms"
+        + (f" ⚠️{errors}" if errors else "")
+        for key, calls, errors, p50, p95 in rows[:30]
+    ]
+    rc = render_cache.summary()
+    if rc["edits"] or rc["edits_skipped"]:
+        lines += [
+            "",
+            f"🖼 Edits: {rc['edits']} sent, {rc['edits_skipped']} skipped as unchanged; "
+            f"fragments {rc['fragment_hits']} reused / {rc['fragment_misses']} drawn",
+        ]
+    sup = inflight.summary()
+    if sup["cancelled"] or sup["skipped"]:
+        lines += [
+            "",
+            f"⏭ Superseded: {sup['cancelled']} cancelled while loading, "
+            f"{sup['skipped']} dropped before starting",
+            f"   API calls: ~{sup['calls_saved']} saved, {sup['calls_spent']} spent before cancel",
+        ]
+    await update.message.reply_text(
+        "📈 *Screen latency*\n\n" + "\n".join(lines), parse_mode="Markdown",
+    )
+
+
+async def _clear_price(query, context, sid):
+    # same buttons as the price conversation, for a message left over from
+    # before a restart — the conversation state is gone but the panel is not
+    price_store.clear(sid)
+    await show_server_detail(query, context, sid)
+
+
+async def _clear_ip_selection(query, context, kind):
+    context.user_data[f"{kind}_sel"] = set()
+    await show_ip_list(query, context, kind)
+
+
+def _ip_routes(kind):
+    return [
+        (f"{kind}s", lambda q, c: show_ip_list(q, c, kind)),
+        (f"{kind}_new", lambda q, c: ip_new_type(q, c, kind)),
+        (f"{kind}newt_", lambda q, c, t: ip_new_place(q, c, kind, t), str),
+        (f"{kind}newl_", lambda q, c, t, place: ip_new_count(q, c, kind, t, place), str, str),
+        (f"{kind}newc_", lambda q, c, t, place, n: ip_create(q, c, kind, t, place, n), str, str, int),
+        (f"{kind}tog_", lambda q, c, ip_id: ip_toggle(q, c, kind, ip_id), int),
+        (f"{kind}delsel_yes", lambda q, c: ip_delete_selected(q, c, kind)),
+        (f"{kind}delsel", lambda q, c: ip_delete_confirm(q, c, kind)),
+        (f"{kind}clear", lambda q, c: _clear_ip_selection(q, c, kind)),
+    ]
+
+
+# callback data -> handler(query, context, *params); see router.Router for
+# how keys match. Keys ending in "_" take the parameter types listed after
+# the handler, everything else must match the callback data exactly.
+ROUTES = [
+    ("acct_", select_account, int),
+    ("list_servers", open_server_list),
+    ("page_", show_server_list, int),
+    ("lsort", list_sort),
+    ("lstatus", list_status),
+    ("lloc", list_location),
+    ("lclear", list_clear),
+    ("lrefresh", lambda q, c: show_server_list(q, c, rebuild=True)),
+    ("lselmode", list_select_mode),
+    ("lsel_", list_select_toggle, int),
+    ("lselall", list_select_all),
+    ("lselnone", list_select_none),
+    ("bulk", bulk_menu),
+    ("bulkask_", bulk_confirm, str),
+    ("bulkgo_", bulk_run, str),
+    ("fleet", lambda q, c: show_fleet(q, c, rebuild=True)),
+    ("fpage_", show_fleet, int),
+    ("fsort", fleet_sort),
+    ("fclear", fleet_clear),
+    ("frefresh", lambda q, c: show_fleet(q, c, rebuild=True)),
+    ("fsrv_", open_fleet_server, int, int),
+    ("atrisk_", show_at_risk, str),
+    ("atreset", at_risk_reset_confirm),
+    ("atresetgo", at_risk_reset_run),
+    ("advice", show_reset_advice),
+    ("advreset", advice_reset_confirm),
+    ("server_", show_server_detail, int),
+    ("refresh_", lambda q, c, sid: show_server_detail(q, c, sid, refresh=True), int),
+    ("poweron_", lambda q, c, sid: power_action(q, c, sid, "on"), int),
+    ("poweroff_", lambda q, c, sid: power_action(q, c, sid, "off"), int),
+    ("reset_", reset_traffic, int),
+    ("resetpw_confirm_", reset_password_confirm, int),
+    ("resetpw_", reset_password, int),
+    ("overage_cost", show_overage_cost),
+    ("overage_refresh", lambda q, c: show_overage_cost(q, c, force=True)),
+    ("overage_json", export_overage_cost),
+    ("priceclear_", _clear_price, int),
+    ("pricecancel_", show_server_detail, int),
+    ("snapshots", show_snapshots),
+    ("snap_new", snapshot_pick_server),
+    ("snapcreate_", create_snapshot, int),
+    ("snapdel_confirm_", delete_snapshot, int),
+    ("snapdel_", delete_snapshot_confirm, int),
+    ("snap_", show_snapshot_detail, int),
+    ("srvsnap_", show_server_snapshots, int),
+    *_ip_routes("fip"),
+    *_ip_routes("pip"),
+    ("pipatgo_", pip_attach_go, int, int),
+    ("pipatts_", pip_attach_confirm, int, int),
+    ("pipatt_", pip_attach_pick, int),
+    ("pipdetgo_", pip_detach_go, int),
+    ("pipdet_", pip_detach_confirm, int),
+    ("rebuildgo_", rebuild_go, int, str),
+    ("rebuildimg_", rebuild_confirm, int, str),
+    ("rebuild_", rebuild_pick_image, int),
+    ("resizego_", resize_go, int, str, flag),
+    ("resizet_", resize_confirm, int, str),
+    ("resizef_", resize_pick_type, int, str),
+    ("resize_", resize_pick_family, int),
+    ("volmenu_", show_volumes, int),
+    ("volnewc_", volume_create, int, int),
+    ("volnew_", volume_pick_size, int),
+    ("voldetach_", volume_detach, int, int),
+    ("volattach_", volume_attach, int, int),
+    ("voldelgo_", volume_delete, int, int),
+    ("voldel_", volume_delete_confirm, int, int),
+    ("srvfip_", show_server_fips, int),
+    ("fipas_", server_fip_assign, int, int),
+    ("fipun_", server_fip_unassign, int, int),
+    ("backupgo_", backup_toggle_go, int, str),
+    ("backup_", backup_toggle_confirm, int),
+    ("jobs", show_jobs),
+    ("jobcancelgo_", job_cancel, int),
+    ("jobcancel_", job_cancel_confirm, int),
+    ("start_menu", lambda q, c: show_start_menu(q)),
+]
+
+# screens that only fetch and draw: a newer press on the same message may
+# cancel them while they load (inflight.py). Anything that changes a server,
+# an IP or the admin's selection is left to finish.
+READ_ONLY_ROUTES = {
+    "acct_", "list_servers", "page_", "bulk", "bulkask_", "lsort", "lstatus", "lloc", "lclear", "lrefresh",
+    "fleet", "fpage_", "fsort", "fclear", "frefresh", "fsrv_", "atrisk_", "atreset", "server_", "refresh_",
+    "advice", "advreset",
+    "overage_cost", "overage_refresh", "snapshots", "snap_new", "snap_", "srvsnap_",
+    "snapdel_", "resetpw_", "fips", "pips", "fip_new", "pip_new", "fipnewt_", "pipnewt_",
+    "fipnewl_", "pipnewl_", "fipdelsel", "pipdelsel", "pipatt_", "pipatts_", "pipdet_",
+    "rebuild_", "rebuildimg_", "resize_", "resizef_", "resizet_", "volmenu_", "volnew_",
+    "voldel_", "srvfip_", "backup_", "jobs", "jobcancel_", "start_menu",
+}
+
+router = Router()
+for _key, _handler, *_params in ROUTES:
+    router.add(_key, _handler, *_params, read_only=_key in READ_ONLY_ROUTES)
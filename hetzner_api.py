@@ -4,6 +4,9 @@ import contextvars
 import logging
 import time
 from config import Config
+from pricing_index import PricingIndex
+from bounce_plans import BounceTable
+from phase_timings import phase_timings
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +23,36 @@ LONG_TTL_PREFIXES = {
     '/images?type=system': 3600,
 }
 RATE_LIMIT_SOFT_FLOOR = 200         # slow down when fewer requests remain
+# Hetzner error codes worth trying again; anything else is the request's fault
+TRANSIENT_ERROR_CODES = {
+    'conflict', 'locked', 'rate_limit_exceeded', 'timeout', 'unavailable',
+    'service_error', 'maintenance', 'network',
+}
+# ... of which these mean Hetzner turned the request away without doing
+# anything, so even a create may be sent again
+REFUSED_ERROR_CODES = {'locked', 'rate_limit_exceeded'}
+# Waiting for an action or a status: look again soon at first, when a quick
+# change is likely, then less and less often
+POLL_FIRST = 1.0                    # seconds before the first look
+POLL_GROWTH = 1.5                   # each wait this much longer than the last
+POLL_MAX = 8.0                      # ... up to this
+EXPECTED_SHARE = 0.8                # with an expected duration: first look this far in
+ACTION_TIMEOUT = 300                # seconds an action may run before giving up
+
+
+def poll_delays(first=POLL_FIRST, cap=POLL_MAX, growth=POLL_GROWTH, expected=None):
+    """Seconds to wait before each look: first, then growing up to cap.
+
+    Given `expected`, how long the wait usually takes (see phase_timings.py),
+    the first look is put off until shortly before then and the looks after
+    it start short again: tight polling only where completion is likely.
+    """
+    if expected:
+        yield max(first, expected * EXPECTED_SHARE)
+    delay = first
+    while True:
+        yield delay
+        delay = min(cap, delay * growth)
 
 
 class HetznerAPI:
@@ -32,6 +65,11 @@ class HetznerAPI:
         self._throttle_lock = asyncio.Lock()
         self._last_request = 0.0
         self._cache = {}
+        self.pricing_index = None       # last one built; see get_pricing_index
+        self.bounce_table = None        # last one built; see get_bounce_table
+        self.generation = 0             # bumped on every successful write
+        self.on_write = []              # callback(api) after each one; see cost_refresher.watch
+        self.rate_remaining = None      # last RateLimit-Remaining Hetzner reported
 
     def _cache_get(self, endpoint):
         hit = self._cache.get(endpoint)
@@ -47,6 +85,16 @@ class HetznerAPI:
                 break
         self._cache[endpoint] = (time.monotonic() + ttl, result)
 
+    def _wrote(self):
+        """State changed: drop every cached response and tell the listeners."""
+        self._cache.clear()
+        self.generation += 1
+        for callback in self.on_write:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Write listener failed: {e}")
+
     async def _throttle(self):
         async with self._throttle_lock:
             wait = MIN_REQUEST_INTERVAL - (time.monotonic() - self._last_request)
@@ -61,8 +109,11 @@ class HetznerAPI:
                 return cached
 
         url = f"{self.base_url}{endpoint}"
+        counter = _call_counter.get()
         for attempt in range(retry):
             await self._throttle()
+            if counter is not None:
+                counter[0] += 1
             try:
                 async with aiohttp.ClientSession() as session:
                     async with session.request(
@@ -79,30 +130,41 @@ class HetznerAPI:
                         except Exception:
                             # DELETE returns 204 with an empty body
                             result = {}
+                        if method == 'DELETE' and response.status == 404 and attempt > 0:
+                            # gone after a try whose answer was lost: that try deleted it
+                            _last_error.set(None)
+                            self._wrote()
+                            return {}
                         if response.status >= 400:
                             logger.error(f"API Error {response.status}: {result}")
+                            code = ((result or {}).get('error') or {}).get('code')
+                            _last_error.set((response.status, code))
                             return None
+                        _last_error.set(None)
                         result = result if result is not None else {}
                         if method == 'GET':
                             self._cache_set(endpoint, result)
                         else:
-                            # state changed: drop every cached response
-                            self._cache.clear()
+                            self._wrote()
                         remaining = response.headers.get('RateLimit-Remaining')
-                        if remaining and int(float(remaining)) < RATE_LIMIT_SOFT_FLOOR:
+                        if remaining:
+                            self.rate_remaining = int(float(remaining))
+                        if remaining and self.rate_remaining < RATE_LIMIT_SOFT_FLOOR:
                             logger.warning(f"Rate limit low ({remaining} left), slowing down...")
                             await asyncio.sleep(3)
                         return result
             except Exception as e:
                 logger.error(f"Request failed (attempt {attempt + 1}): {e}")
+                _last_error.set((None, 'network'))
                 if attempt < retry - 1:
                     await asyncio.sleep(2 ** attempt)
                 else:
                     return None
+        _last_error.set((429, 'rate_limit_exceeded'))
         return None
 
-    async def list_servers(self):
-        result = await self._request('GET', '/servers')
+    async def list_servers(self, fresh=False):
+        result = await self._request('GET', '/servers', fresh=fresh)
         return result.get('servers', []) if result else []
 
     async def get_server(self, server_id, fresh=False):
@@ -156,12 +218,19 @@ class HetznerAPI:
         return result.get('floating_ips', []) if result else []
 
     async def create_floating_ip(self, ip_type, home_location, name, description=None):
+        # sent once: a create whose answer was lost may still have happened
+        # (see find_floating_ip)
         return await self._request('POST', '/floating_ips', {
             'type': ip_type,
             'home_location': home_location,
             'name': name,
             'description': description or name,
-        })
+        }, retry=1)
+
+    async def find_floating_ip(self, name):
+        result = await self._request('GET', f'/floating_ips?name={name}', fresh=True)
+        ips = (result or {}).get('floating_ips') or []
+        return ips[0] if ips else None
 
     async def delete_floating_ip(self, fip_id):
         # returns {} on success (204), None on failure
@@ -181,7 +250,12 @@ class HetznerAPI:
             'name': name,
             'assignee_type': 'server',
             'auto_delete': False,
-        })
+        }, retry=1)             # sent once, as create_floating_ip
+
+    async def find_primary_ip(self, name):
+        result = await self._request('GET', f'/primary_ips?name={name}', fresh=True)
+        ips = (result or {}).get('primary_ips') or []
+        return ips[0] if ips else None
 
     async def delete_primary_ip(self, pip_id):
         # returns {} on success (204), None on failure
@@ -259,19 +333,82 @@ class HetznerAPI:
         result = await self._request('GET', '/pricing')
         return result.get('pricing', {}) if result else {}
 
-    async def wait_for_status(self, server_id, target_status, max_attempts=40):
-        for i in range(max_attempts):
+    async def get_pricing_index(self):
+        """Price lookups for this account, rebuilt only when the catalogue changes."""
+        pricing, types = await asyncio.gather(self.get_pricing(), self.get_server_types())
+        self.pricing_index = PricingIndex.refresh(self.pricing_index, pricing, types)
+        return self.pricing_index
+
+    async def get_bounce_table(self, timings=phase_timings):
+        """Traffic reset bounce plans, rebuilt only when the type catalogue changes."""
+        self.bounce_table = BounceTable.refresh(self.bounce_table, await self.get_server_types(), timings)
+        return self.bounce_table
+
+    async def get_action(self, action_id):
+        result = await self._request('GET', f'/actions/{action_id}', fresh=True)
+        return result.get('action') if result else None
+
+    async def get_actions(self, action_ids):
+        """Several actions in one request."""
+        query = '&'.join(f'id={i}' for i in action_ids)
+        result = await self._request('GET', f'/actions?{query}', fresh=True)
+        return result.get('actions', []) if result else []
+
+    async def wait_for_action(self, result, timeout=ACTION_TIMEOUT, server_id=None, status=None, expected=None):
+        """Wait until the action a POST returned (`result`) has finished.
+
+        True once it succeeded, False if it failed or ran past `timeout`.
+        A `result` without an action (an error, or an endpoint that answers
+        at once) falls back to waiting for the server to reach `status`
+        when both are given, and is otherwise None. `expected` is passed to
+        poll_delays.
+        """
+        action = (result or {}).get('action')
+        if not action or not action.get('id'):
+            if server_id is not None and status:
+                return await self.wait_for_status(server_id, status, max_attempts=timeout // 5, expected=expected)
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delays = poll_delays(expected=expected)
+        while action.get('status') == 'running':
+            delay = next(delays)
+            if loop.time() + delay > deadline:
+                logger.warning(f"Action {action['id']} ({action.get('command')}) still running after {timeout}s")
+                return False
+            await asyncio.sleep(delay)
+            action = await self.get_action(action['id']) or action
+        if action.get('status') != 'success':
+            logger.warning(f"Action {action['id']} ({action.get('command')}) failed: {action.get('error')}")
+            return False
+        return True
+
+    async def wait_for_status(self, server_id, target_status, max_attempts=40, expected=None):
+        """Wait for the server to reach `target_status`.
+
+        Allows as long as the old fixed 5 s polling did for `max_attempts`
+        looks, but looks again soon at first (see poll_delays).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_attempts * 5
+        delays = poll_delays(expected=expected)
+        while True:
             server = await self.get_server(server_id, fresh=True)
             if server and server.get('status') == target_status:
                 logger.info(f"Server {server_id} reached status: {target_status}")
                 return True
-            await asyncio.sleep(5)
+            delay = next(delays)
+            if loop.time() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
         logger.warning(f"Server {server_id} did not reach {target_status} in time")
         return False
 
 # One client per Hetzner account (separate token, cache and throttle each).
 APIS = [HetznerAPI(a['token']) for a in Config.ACCOUNTS] or [HetznerAPI(Config.HETZNER_API_TOKEN)]
 _current = contextvars.ContextVar('hz_account', default=0)
+_call_counter = contextvars.ContextVar('hz_call_counter', default=None)
+_last_error = contextvars.ContextVar('hz_last_error', default=None)
 
 
 def set_account(i):
@@ -282,6 +419,43 @@ def current_account():
     return _current.get()
 
 
+def count_api_calls(counter):
+    """Add every request this task sends from now on to `counter[0]`.
+
+    Tasks started from here inherit the counter, so a handler's background
+    work is counted with it. Cache hits are not requests and are not counted.
+    """
+    _call_counter.set(counter)
+
+
+def last_failure_transient():
+    """Whether the last request this task sent failed in a way worth retrying.
+
+    Read right after a call that returned None: 5xx answers, exhausted
+    network retries and the codes in TRANSIENT_ERROR_CODES count; a
+    validation error or a missing resource does not.
+    """
+    err = _last_error.get()
+    if err is None:
+        return False
+    status, code = err
+    return code in TRANSIENT_ERROR_CODES or (status is not None and status >= 500)
+
+
+def last_failure_refused():
+    """Whether the last request this task sent was turned away unprocessed
+    (429, or a code in REFUSED_ERROR_CODES): safe to send again even if it
+    creates something."""
+    err = _last_error.get()
+    return err is not None and (err[0] == 429 or err[1] in REFUSED_ERROR_CODES)
+
+
+def last_failure_not_found():
+    """Whether the last request this task sent failed with a 404."""
+    err = _last_error.get()
+    return err is not None and err[0] == 404
+
+
 def account_count():
     return len(APIS)
 
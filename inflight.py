@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from hetzner_api import count_api_calls
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight:
+    """Read-only screens still loading, per message, so a newer press can drop them.
+
+    Tapping 🔄 Refresh three times, or moving on while a slow screen is still
+    fetching, used to run every press to the end, each one spending API calls
+    to draw a message that the next press would overwrite anyway. Now:
+
+      * `arrived` is told about every press on a message as it comes in, and
+        cancels the screen still loading on that message, if any;
+      * `run` starts a screen as a task of its own, counting the API calls it
+        sends, and skips it outright if a newer press on the same message has
+        already arrived.
+
+    Only screens that do not change anything are run through here: a power
+    action or a reset is never cancelled half way.
+
+    Savings are estimated per route from the calls a finished run needs on
+    average, less what the cancelled run had already sent.
+    """
+
+    def __init__(self):
+        self._latest = {}            # key -> update id of the newest press
+        self._running = {}           # key -> task of the screen loading there
+        self._superseded = set()     # tasks cancelled by a newer press
+        self._runs = {}              # route -> [finished runs, API calls]
+        self.cancelled = 0           # stopped while loading
+        self.skipped = 0             # dropped before they started
+        self.calls_spent = 0         # sent by the cancelled ones before they stopped
+        self.calls_saved = 0.0       # estimate of what they would still have sent
+
+    def arrived(self, key, update_id):
+        """A new press on `key`; cancel the screen still loading there."""
+        self._latest[key] = update_id
+        task = self._running.get(key)
+        if task is not None and not task.done():
+            self._superseded.add(task)
+            task.cancel()
+
+    def forget(self, key):
+        """Nothing is running or waiting on `key` any more."""
+        self._latest.pop(key, None)
+        self._running.pop(key, None)
+
+    def _average(self, route):
+        runs, calls = self._runs.get(route, (0, 0))
+        return calls / runs if runs else 0.0
+
+    async def run(self, key, update_id, route, make_coro):
+        """Run `make_coro()` for a press on `key`; False if it was superseded."""
+        if self._latest.get(key, update_id) != update_id:
+            self.skipped += 1
+            self.calls_saved += self._average(route)
+            return False
+        counter = [0]
+
+        async def body():
+            count_api_calls(counter)
+            await make_coro()
+
+        task = asyncio.ensure_future(body())
+        self._running[key] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if task not in self._superseded:
+                raise                # the press itself was cancelled (shutdown)
+            self._superseded.discard(task)
+            self.cancelled += 1
+            self.calls_spent += counter[0]
+            self.calls_saved += max(0.0, self._average(route) - counter[0])
+            logger.debug(f"Superseded {route} after {counter[0]} API calls")
+            return False
+        finally:
+            if self._running.get(key) is task:
+                del self._running[key]
+        entry = self._runs.setdefault(route, [0, 0])
+        entry[0] += 1
+        entry[1] += counter[0]
+        return True
+
+    def summary(self):
+        return {
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+            "calls_spent": self.calls_spent,
+            "calls_saved": round(self.calls_saved),
+        }
+
+
+inflight = InFlight()
+
+
+def demo():
+    from hetzner_api import _call_counter
+
+    async def screen(calls, delay):
+        for _ in range(calls):
+            _call_counter.get()[0] += 1          # what _request does per request
+            await asyncio.sleep(delay)
+
+    async def press(f, key, uid, calls, delay):
+        f.arrived(key, uid)
+        await asyncio.sleep(0)                   # the update waits its turn ...
+        return await f.run(key, uid, "refresh_", lambda: screen(calls, delay))
+
+    async def run():
+        f = InFlight()
+        key = (1, 10)
+        assert await f.run(key, 1, "refresh_", lambda: screen(4, 0))   # learn: 4 calls a run
+
+        # first press starts loading; second arrives mid-way and cancels it
+        first = asyncio.ensure_future(press(f, key, 2, 4, 0.01))
+        await asyncio.sleep(0.015)
+        second = asyncio.ensure_future(press(f, key, 3, 4, 0))
+        assert await first is False and await second is True
+        assert f.cancelled == 1 and 1 <= f.calls_spent <= 3
+        assert f.calls_spent + f.calls_saved == 4
+
+        # a press still waiting when a newer one arrives never runs at all
+        f.arrived(key, 4)
+        f.arrived(key, 5)
+        assert await f.run(key, 4, "refresh_", lambda: screen(4, 0)) is False
+        assert f.skipped == 1
+
+        # other messages are left alone
+        f.arrived((1, 11), 6)
+        assert await f.run((1, 11), 6, "server_", lambda: screen(1, 0))
+        f.forget(key)
+        assert key not in f._latest and not f._running
+
+        # a cancel that is not a newer press still propagates
+        t = asyncio.ensure_future(f.run((1, 12), 7, "server_", lambda: screen(1, 1)))
+        await asyncio.sleep(0.01)
+        t.cancel()
+        try:
+            await t
+            assert False
+        except asyncio.CancelledError:
+            pass
+        return f
+
+    f = asyncio.run(run())
+    print('inflight demo OK', f.summary())
+
+
+if __name__ == '__main__':
+    demo()
@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import logging
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+KEEP_FINISHED = 20                  # finished jobs still listed on the Jobs screen
+ACTIVE = ("queued", "running")
+
+
+class Job:
+    """One long operation started from the bot: a reset, a resize, an IP swap...
+
+    `servers` are the (account, server id) it works on; no other job may
+    hold any of them until it ends. `progress` is its latest step, for the
+    Jobs screen. `state` is "queued", "running", "done", "failed" or
+    "cancelled".
+    """
+
+    def __init__(self, job_id, kind, title, servers):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        self.servers = frozenset(servers)
+        self.state = "queued"
+        self.progress = ""
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    def note(self, text):
+        self.progress = text
+
+    @property
+    def active(self):
+        return self.state in ACTIVE
+
+    def age(self, now=None):
+        """Seconds it has been running (or ran), or waited if still queued."""
+        end = self.finished or now or time.time()
+        return end - (self.started or self.created)
+
+
+class JobManager:
+    """Long operations run as background tasks, so the button that started
+    one returns at once and the work can be listed and cancelled.
+
+    A job is refused if any server it needs is held by a job still queued
+    or running (a reset and a resize of the same server would undo each
+    other). At most `limit` jobs run at a time; the rest wait their turn
+    as "queued".
+    """
+
+    def __init__(self, limit=None, keep=KEEP_FINISHED):
+        self.limit = limit or Config.JOB_CONCURRENCY
+        self.keep = keep
+        self.jobs = {}               # id -> Job, oldest first
+        self._holders = {}           # (account, server id) -> Job
+        self._ids = itertools.count(1)
+        self._gate = None
+
+    def holder(self, acct, server_id):
+        """The job holding this server, or None."""
+        return self._holders.get((acct, server_id))
+
+    def free(self, servers):
+        """Those of `servers` ((account, server id)) no job holds."""
+        return [key for key in servers if key not in self._holders]
+
+    def submit(self, kind, title, servers, work):
+        """Start `work(job)` as a job. Returns (job, None), or (None, the job in the way).
+
+        `work` is an async function; what it returns is the job's result,
+        and False marks the job failed.
+        """
+        servers = list(servers)
+        busy = next((self._holders[key] for key in servers if key in self._holders), None)
+        if busy is not None:
+            return None, busy
+        job = Job(next(self._ids), kind, title, servers)
+        self.jobs[job.id] = job
+        for key in job.servers:
+            self._holders[key] = job
+        job.task = asyncio.ensure_future(self._run(job, work))
+        return job, None
+
+    async def _run(self, job, work):
+        if self._gate is None:
+            self._gate = asyncio.Semaphore(self.limit)
+        try:
+            async with self._gate:
+                job.state = "running"
+                job.started = time.time()
+                job.result = await work(job)
+                job.state = "failed" if job.result is False else "done"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            logger.info(f"Job #{job.id} ({job.title}) cancelled")
+        except Exception as e:
+            job.state = "failed"
+            job.note(f"❌ {e}")
+            logger.error(f"Job #{job.id} ({job.title}) failed: {e}")
+        finally:
+            job.finished = time.time()
+            for key in job.servers:
+                if self._holders.get(key) is job:
+                    del self._holders[key]
+            self._prune()
+        return job.result
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job_id):
+        """Stop a job, queued or running. False if it is not active."""
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.task.cancel()
+        return True
+
+    def active(self):
+        return [job for job in self.jobs.values() if job.active]
+
+    def recent(self):
+        """Finished jobs still kept, newest first."""
+        return [job for job in reversed(list(self.jobs.values())) if not job.active]
+
+
+job_manager = JobManager()
+
+
+def demo():
+    async def run():
+        jobs = JobManager(limit=2, keep=3)
+        order = []
+
+        def step(name, delay, result=True):
+            async def work(job):
+                order.append(f"{name}+")
+                job.note(f"{name} working")
+                await asyncio.sleep(delay)
+                order.append(f"{name}-")
+                return result
+            return work
+
+        reset, none = jobs.submit("reset", "Reset s1", [(0, 1)], step("reset", 0.05))
+        assert none is None and reset.state == "queued"
+        # the same server on the same account is taken; on another account it is not
+        clash, busy = jobs.submit("resize", "Resize s1", [(0, 1)], step("resize", 0))
+        assert clash is None and busy is reset
+        other, _ = jobs.submit("resize", "Resize s1 on B", [(1, 1)], step("other", 0.02))
+        third, _ = jobs.submit("volume", "Volume on s2", [(0, 2)], step("third", 0.01, False))
+        await asyncio.sleep(0.005)
+        # two run, the third waits for a slot
+        assert (reset.state, other.state, third.state) == ("running", "running", "queued")
+        assert reset.progress == "reset working" and jobs.holder(0, 1) is reset
+        assert jobs.free([(0, 1), (0, 3)]) == [(0, 3)]
+        await asyncio.gather(reset.task, other.task, third.task)
+        assert order.index("third+") > order.index("other-")
+        assert (reset.state, third.state) == ("done", "failed") and jobs.holder(0, 1) is None
+
+        # cancelled while running, and while still queued
+        slow, _ = jobs.submit("reset", "Reset s5", [(0, 5)], step("slow", 10))
+        slow2, _ = jobs.submit("reset", "Reset s6", [(0, 6)], step("slow2", 10))
+        waiting, _ = jobs.submit("reset", "Reset s7", [(0, 7)], step("waiting", 0))
+        await asyncio.sleep(0.01)
+        assert jobs.cancel(slow.id) and jobs.cancel(waiting.id) and jobs.cancel(slow2.id)
+        await asyncio.gather(slow.task, waiting.task, slow2.task)
+        assert (slow.state, waiting.state) == ("cancelled", "cancelled") and "waiting+" not in order
+        assert not jobs.cancel(slow.id) and jobs.free([(0, 5), (0, 7)]) == [(0, 5), (0, 7)]
+
+        # a job that raises is failed, not lost; old finished jobs are dropped
+        async def boom(job):
+            raise RuntimeError("no such server")
+        broken, _ = jobs.submit("rebuild", "Rebuild s8", [(0, 8)], boom)
+        await broken.task
+        assert broken.state == "failed" and broken.progress == "❌ no such server"
+        assert len(jobs.recent()) == 3 and jobs.recent()[0] is broken and not jobs.active()
+
+    asyncio.run(run())
+    print('jobs demo OK')
+
+
+if __name__ == '__main__':
+    demo()
@@ -12,10 +12,15 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from config import Config
 from handlers import (
-    start_handler, button_handler, _start_console,
+    start_handler, button_handler, stats_handler, _start_console,
     price_ask, price_recv, price_cancel, price_clear, WAIT_PRICE,
+    search_ask, search_recv, search_cancel, WAIT_SEARCH,
 )
 from monitor import traffic_monitor
+from cost_refresher import cost_refresher, REFRESH_INTERVAL
+from update_processor import SerialPerConversation
+from reset_orchestrator import recover_resets
+from reset_advisor import auto_reset
 from shell_handler import (
     recv_port, recv_user, recv_auth_type,
     recv_password, recv_key, recv_command,
@@ -68,11 +73,24 @@ async def on_error(update, context):
         pass
 
 
+async def on_startup(app):
+    # traffic resets a restart cut short: finish them without holding up polling
+    app.create_task(recover_resets(app.bot))
+
+
 def main():
     setup_logging()
     check_hetzner_token()
     warnings.filterwarnings("ignore", category=PTBUserWarning)
-    app = Application.builder().token(Config.TELEGRAM_TOKEN).build()
+    # updates run side by side; each chat's conversation, and each panel
+    # message, still sees its own updates one at a time and in order
+    app = (
+        Application.builder()
+        .token(Config.TELEGRAM_TOKEN)
+        .concurrent_updates(SerialPerConversation())
+        .post_init(on_startup)
+        .build()
+    )
 
     console_conv = ConversationHandler(
         entry_points=[
@@ -133,14 +151,34 @@ def main():
         per_user=True,
     )
 
+    search_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(search_ask, pattern="^[lf]search$")],
+        states={
+            WAIT_SEARCH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, search_recv),
+                CallbackQueryHandler(search_cancel, pattern="^[lf]searchcancel$"),
+            ],
+        },
+        fallbacks=[CallbackQueryHandler(search_cancel, pattern="^[lf]searchcancel$")],
+        per_message=False,
+        per_chat=True,
+        per_user=True,
+    )
+
     app.add_handler(CommandHandler("start", start_handler))
+    app.add_handler(CommandHandler("stats", stats_handler))
     app.add_handler(console_conv)
     app.add_handler(price_conv)
+    app.add_handler(search_conv)
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_error_handler(on_error)
 
     scheduler = AsyncIOScheduler()
     scheduler.add_job(traffic_monitor, "interval", hours=1, args=[app.bot])
+    scheduler.add_job(cost_refresher.refresh_all, "interval", seconds=REFRESH_INTERVAL)
+    cost_refresher.watch()
+    if Config.AUTO_RESET:
+        scheduler.add_job(auto_reset, "interval", hours=1, args=[app.bot])
     scheduler.start()
 
     logging.info("🚀 Bot started successfully")
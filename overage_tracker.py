@@ -7,6 +7,7 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 
 MONTH_KEY = re.compile(r'^\d{4}-\d{2}$')
+COMPACT_EVERY = 200                 # journal events between two snapshots
 
 
 class OverageTracker:
@@ -32,19 +33,67 @@ class OverageTracker:
     `live.month` is the month the current cycle *started* in, not the month it
     was last read in, so a counter that has not rolled over yet is not charged
     to the new month.
+
+    Every change is appended to a journal next to the data file, one JSON
+    event per line: `live` (the counter moved), `drop` (it went down),
+    `reset` (the bot reset it) and `file` (a cycle was filed as paid or
+    avoided). The data file itself is only a snapshot, rewritten every
+    `COMPACT_EVERY` events, and records how far into the journal it reaches;
+    the state is that snapshot plus the journal after it. The journal is
+    never truncated and opens with a `base` event holding the state it
+    started from, so any earlier point can be rebuilt with `state_at`.
     """
 
-    def __init__(self, data_file='overage_history.json'):
+    def __init__(self, data_file='overage_history.json', journal_file=None,
+                 compact_every=COMPACT_EVERY):
         self.data_file = Path(data_file)
+        self.journal_file = Path(journal_file) if journal_file else \
+            self.data_file.with_name(self.data_file.stem + '.journal.jsonl')
+        self.compact_every = compact_every
+        self._seq = 0          # last event applied by the latest load
+        self._tail = 0         # journal events not yet in the snapshot
 
     def _load_data(self):
+        data, mark = self._load_snapshot()
+        self._seq, self._tail = mark.get('seq', 0), 0
+        for event in self._read_journal(mark.get('offset', 0)):
+            if event.get('seq', 0) <= mark.get('seq', 0):
+                continue
+            self._apply(data, event)
+            self._seq = event['seq']
+            self._tail += 1
+        return data
+
+    def _load_snapshot(self):
         if not self.data_file.exists():
-            return {'months': {}, 'live': {}}
+            return {'months': {}, 'live': {}}, {}
         try:
-            return self._migrate(json.loads(self.data_file.read_text()))
+            raw = json.loads(self.data_file.read_text())
+            mark = raw.pop('journal', None) or {}
+            return self._migrate(raw), mark
         except Exception as e:
             logger.error(f"Failed to load overage data: {e}")
-            return {'months': {}, 'live': {}}
+            return {'months': {}, 'live': {}}, {}
+
+    def _read_journal(self, offset=0):
+        """Events from `offset` bytes on; a torn last line is skipped."""
+        if not self.journal_file.exists():
+            return []
+        try:
+            with self.journal_file.open('rb') as f:
+                if offset <= self.journal_file.stat().st_size:
+                    f.seek(offset)
+                lines = f.read().decode('utf-8', 'replace').splitlines()
+        except Exception as e:
+            logger.error(f"Failed to read overage journal: {e}")
+            return []
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events
 
     @classmethod
     def _migrate(cls, data):
@@ -104,8 +153,15 @@ class OverageTracker:
         return {'months': months, 'live': live}
 
     def _save_data(self, data):
+        """Write a snapshot covering every journal event so far."""
         try:
-            self.data_file.write_text(json.dumps(data, indent=2))
+            offset = self.journal_file.stat().st_size if self.journal_file.exists() else 0
+            tmp = self.data_file.with_name(self.data_file.name + '.tmp')
+            tmp.write_text(json.dumps(
+                {**data, 'journal': {'seq': self._seq, 'offset': offset}}, indent=2
+            ))
+            tmp.replace(self.data_file)
+            self._tail = 0
         except Exception as e:
             logger.error(f"Failed to save overage data: {e}")
 
@@ -113,46 +169,103 @@ class OverageTracker:
     def _now_month():
         return datetime.now().strftime('%Y-%m')
 
+    @staticmethod
+    def _apply(data, event):
+        """Replay one journal event onto the state."""
+        kind, sid = event.get('type'), event.get('sid')
+        if kind == 'base':
+            data.clear()
+            data.update(json.loads(json.dumps(event.get('data') or {})))
+            data.setdefault('months', {})
+            data.setdefault('live', {})
+        elif kind == 'live':
+            data.setdefault('live', {})[sid] = {'cost': event['cost'], 'month': event['month']}
+        elif kind == 'file':
+            entry = data.setdefault('months', {}).setdefault(event['month'], {})
+            target = entry.setdefault(event['bucket'], {})
+            target[sid] = round(target.get(sid, 0) + event['cost'], 2)
+            entry['updated_at'] = event.get('at', '')
+        # `drop` and `reset` only mark why the events after them happened
+
+    def _append(self, data, events):
+        """Apply events to `data` and journal them, compacting when due."""
+        if not events:
+            return
+        lines = []
+        if not self.journal_file.exists():
+            # a new journal starts from whatever state it is taking over
+            self._seq += 1
+            lines.append({'seq': self._seq, 'at': datetime.now().isoformat(),
+                          'type': 'base', 'data': json.loads(json.dumps(data))})
+        for event in events:
+            self._seq += 1
+            event = {'seq': self._seq, 'at': datetime.now().isoformat(), **event}
+            self._apply(data, event)
+            lines.append(event)
+        try:
+            # a line torn by a crash mid-append is closed off, or the first
+            # new event would land on the end of it and be skipped on reading
+            torn = self._torn_tail()
+            with self.journal_file.open('a') as f:
+                f.write('\n' * torn + ''.join(json.dumps(e) + '\n' for e in lines))
+        except Exception as e:
+            logger.error(f"Failed to append overage journal: {e}")
+            return
+        self._tail += len(lines)
+        if self._tail >= self.compact_every:
+            self._save_data(data)
+
+    def _torn_tail(self):
+        """Whether the journal's last line is missing its newline."""
+        if not self.journal_file.exists() or not self.journal_file.stat().st_size:
+            return False
+        with self.journal_file.open('rb') as f:
+            f.seek(-1, 2)
+            return f.read(1) != b'\n'
+
+    def compact(self):
+        """Fold the journal tail into the snapshot now."""
+        self._save_data(self._load_data())
+
     @classmethod
-    def _file_cycle(cls, data, sid, cycle, bucket):
-        """Record a finished cycle's cost under the month it started in."""
+    def _file_cycle(cls, sid, cycle, bucket, reason):
+        """Event filing a finished cycle's cost under the month it started in."""
         cost = round(cycle.get('cost', 0) or 0, 2)
         if not cost:
-            return 0
-        month = cycle.get('month') or cls._now_month()
-        entry = data.setdefault('months', {}).setdefault(month, {})
-        target = entry.setdefault(bucket, {})
-        target[sid] = round(target.get(sid, 0) + cost, 2)
-        entry['updated_at'] = datetime.now().isoformat()
-        return cost
+            return None
+        return {'type': 'file', 'sid': sid, 'month': cycle.get('month') or cls._now_month(),
+                'bucket': bucket, 'cost': cost, 'reason': reason}
 
     def update_live_overage(self, server_id, overage_cost):
         """Record the current overage, closing the old cycle if it reset."""
         sid = str(server_id)
         data = self._load_data()
-        live = data.setdefault('live', {})
         now = self._now_month()
-        cycle = live.get(sid)
+        cycle = data.get('live', {}).get(sid)
         current = max(0.0, round(overage_cost, 2))
+        events = []
 
         if cycle and current + 1e-6 < (cycle.get('cost') or 0):
             # the counter dropped, so that cycle is over. It was billed only
             # if it ran past the end of its own month; a drop inside the same
             # month is a traffic reset, and a reset is what stops the charge.
             billed = cycle.get('month') != now
-            filed = self._file_cycle(data, sid, cycle, 'paid' if billed else 'avoided')
+            bucket = 'paid' if billed else 'avoided'
+            events.append({'type': 'drop', 'sid': sid, 'from': cycle.get('cost', 0),
+                           'to': current, 'month': cycle.get('month')})
+            filed = self._file_cycle(sid, cycle, bucket, 'drop')
+            if filed:
+                events.append(filed)
             logger.info(
                 f"Server {sid}: traffic cycle ended (€{cycle.get('cost', 0):.2f} -> €{current:.2f})"
-                + (f", €{filed:.2f} recorded as {'paid' if billed else 'avoided'}" if filed else "")
+                + (f", €{filed['cost']:.2f} recorded as {bucket}" if filed else "")
             )
             cycle = None
 
-        if cycle is None:
-            cycle = {'cost': current, 'month': now}
-        else:
-            cycle['cost'] = current
-        live[sid] = cycle
-        self._save_data(data)
+        month = now if cycle is None else cycle.get('month')
+        if cycle is None or cycle.get('cost') != current or events:
+            events.append({'type': 'live', 'sid': sid, 'cost': current, 'month': month})
+        self._append(data, events)
 
     def commit_overage(self, server_id):
         """Settle before a traffic reset the bot performs itself.
@@ -162,13 +275,38 @@ class OverageTracker:
         """
         sid = str(server_id)
         data = self._load_data()
-        cycle = data.setdefault('live', {}).get(sid)
-        if cycle:
-            filed = self._file_cycle(data, sid, cycle, 'avoided')
-            if filed:
-                logger.info(f"Server {sid}: €{filed:.2f} overage cleared by traffic reset")
-        data['live'][sid] = {'cost': 0.0, 'month': self._now_month()}
-        self._save_data(data)
+        cycle = data.get('live', {}).get(sid)
+        events = [{'type': 'reset', 'sid': sid, 'from': (cycle or {}).get('cost', 0)}]
+        filed = self._file_cycle(sid, cycle, 'avoided', 'reset') if cycle else None
+        if filed:
+            events.append(filed)
+            logger.info(f"Server {sid}: €{filed['cost']:.2f} overage cleared by traffic reset")
+        events.append({'type': 'live', 'sid': sid, 'cost': 0.0, 'month': self._now_month()})
+        self._append(data, events)
+
+    def history(self, server_id=None, month=None):
+        """Journal events, oldest first, optionally for one server or month.
+
+        This is how a month's figure was reached: every counter reading,
+        drop, reset and filing that went into it.
+        """
+        sid = None if server_id is None else str(server_id)
+        return [
+            e for e in self._read_journal()
+            if e.get('type') != 'base'
+            and (sid is None or e.get('sid') == sid)
+            and (month is None or e.get('month') == month)
+        ]
+
+    def state_at(self, when):
+        """The tracked state as it stood at `when` (a datetime or ISO string)."""
+        cutoff = when.isoformat() if isinstance(when, datetime) else str(when)
+        data = {'months': {}, 'live': {}}
+        for event in self._read_journal():
+            if event.get('at', '') > cutoff:
+                break
+            self._apply(data, event)
+        return data
 
     def get_server_month_overage(self, server_id):
         """What this server owes this month — what its counter says, or nothing.
@@ -203,6 +341,24 @@ class OverageTracker:
             sum(m.get('avoided', {}).values()) for m in self._load_data().get('months', {}).values()
         ), 2)
 
+    def summary(self):
+        """The month and all-time figures the cost report shows, in one read."""
+        data = self._load_data()
+        now = self._now_month()
+        months = data.get('months', {})
+        return {
+            'month_overage': round(sum(
+                c.get('cost', 0) or 0 for c in data.get('live', {}).values() if c.get('month') == now
+            ), 2),
+            'month_avoided': round(sum(months.get(now, {}).get('avoided', {}).values()), 2),
+            'total_overage': round(sum(sum(m.get('paid', {}).values()) for m in months.values()), 2),
+            'total_avoided': round(sum(sum(m.get('avoided', {}).values()) for m in months.values()), 2),
+            'breakdown': [
+                (month, round(sum(entry.get('paid', {}).values()), 2))
+                for month, entry in sorted(months.items(), reverse=True) if month != now
+            ],
+        }
+
     def get_monthly_breakdown(self):
         """Billed cost per month, newest first. Excludes the month in progress,
         which is still on the counter and shown live in the summary."""
@@ -253,6 +409,7 @@ def demo():
     # month as paid, and the new month starts owing nothing
     t = fresh()
     t.update_live_overage(3, 6.0)
+    t.compact()
     data = json.loads(open(t.data_file).read())
     data['live']['3']['month'] = '1999-01'          # cycle belongs to last month
     open(t.data_file, 'w').write(json.dumps(data))
@@ -285,6 +442,52 @@ def demo():
     assert t.get_server_month_overage(7) == 0, "stale month total still warns"
     assert t.get_current_month_avoided() == 0.20    # kept, just not owed
     assert dict(t.get_monthly_breakdown())['1999-01'] == 3.0
+
+    # every change is an append; the snapshot only comes with compaction
+    t = OverageTracker(os.path.join(tempfile.mkdtemp(), 'o4.json'), compact_every=3)
+    t.update_live_overage(5, 1.0)
+    assert not t.data_file.exists() and t.journal_file.exists()
+    t.update_live_overage(5, 1.0)                   # unchanged => nothing written
+    assert len(t.history(5)) == 1
+    t.update_live_overage(5, 2.0)
+    t.commit_overage(5)
+    assert t.data_file.exists(), "not compacted"
+    snap = json.loads(t.data_file.read_text())
+    assert snap['journal']['seq'] >= 4
+    t.update_live_overage(5, 0.5)                   # lands in the tail only
+    fresh_view = OverageTracker(t.data_file, t.journal_file)
+    assert fresh_view.get_server_month_overage(5) == 0.5
+    assert fresh_view.get_current_month_avoided() == 2.0
+    kinds = [e['type'] for e in t.history(5)]
+    assert kinds == ['live', 'live', 'reset', 'file', 'live', 'live'], kinds
+    assert [e for e in t.history(month=now) if e['type'] == 'file'][0]['reason'] == 'reset'
+
+    # a crash mid-append tears the last line; what comes after it still counts
+    with t.journal_file.open('a') as f:
+        f.write('{"seq": 99, "type": "fi')
+    torn = OverageTracker(t.data_file, t.journal_file)
+    torn.update_live_overage(5, 0.75)
+    assert OverageTracker(t.data_file, t.journal_file).get_server_month_overage(5) == 0.75
+    t.update_live_overage(5, 0.5)
+
+    # any earlier point can be rebuilt from the journal alone
+    before_reset = t.history(5)[1]['at']
+    past = t.state_at(before_reset)
+    assert past['live']['5']['cost'] == 2.0 and not past['months']
+    assert t.state_at(datetime.now())['live']['5']['cost'] == 0.5
+
+    # a file from before the journal existed is carried over as its base
+    p = os.path.join(tempfile.mkdtemp(), 'o5.json')
+    open(p, 'w').write(json.dumps({'months': {'1999-01': {'paid': {'8': 4.0}, 'avoided': {}}},
+                                   'live': {'8': {'cost': 1.0, 'month': now}}}))
+    t = OverageTracker(p)
+    t.update_live_overage(8, 0.0)
+    assert t.state_at(datetime.now())['months']['1999-01']['paid'] == {'8': 4.0}
+    assert t.get_total_overage() == 4.0 and t.get_current_month_avoided() == 1.0
+    assert t.summary() == {
+        'month_overage': t.get_current_month_overage(), 'month_avoided': 1.0,
+        'total_overage': 4.0, 'total_avoided': 1.0, 'breakdown': t.get_monthly_breakdown(),
+    }
     print('overage_tracker demo OK')
 
 
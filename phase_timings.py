@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import statistics
+from pathlib import Path
+from utils import location_name
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLES = 20                    # most recent timings kept per key
+# seconds assumed before anything has been measured
+DEFAULTS = {"power_off": 10.0, "power_on": 15.0, "change_type": 45.0}
+DISK_UPGRADE_DEFAULT = 180.0        # a plan change that copies the disk
+
+
+def _key(kind, stype, location, disk):
+    return f"{kind}|{stype or '*'}|{location or '*'}|{int(bool(disk))}"
+
+
+class PhaseTimings:
+    """How long power changes and plan changes have taken, to predict the next.
+
+    Every timed step (see `timed_wait`) is filed under its kind ("power_off",
+    "power_on", "change_type"), the server type — for a plan change, the one
+    being changed to — the location and whether the disk was upgraded. An
+    estimate is the median of the closest match that has samples: the exact
+    key, then the same type anywhere, then the kind as a whole, then
+    DEFAULTS.
+
+    File format:
+      {"change_type|cx32|fsn1|0": [38.2, 41.0, 39.5]}    # seconds, oldest first
+    """
+
+    def __init__(self, data_file='phase_timings.json'):
+        self.data_file = Path(data_file)
+        self._samples = None
+        self.version = 0                # bumped on every record, for whoever ranks by these
+
+    def _load(self):
+        if self._samples is None:
+            self._samples = {}
+            if self.data_file.exists():
+                try:
+                    self._samples = json.loads(self.data_file.read_text())
+                except Exception as e:
+                    logger.error(f"Failed to load phase timings: {e}")
+        return self._samples
+
+    def _save(self):
+        try:
+            tmp = self.data_file.with_name(self.data_file.name + '.tmp')
+            tmp.write_text(json.dumps(self._samples, indent=2))
+            tmp.replace(self.data_file)
+        except Exception as e:
+            logger.error(f"Failed to save phase timings: {e}")
+
+    def record(self, kind, stype, location, seconds, disk=False):
+        samples = self._load().setdefault(_key(kind, stype, location, disk), [])
+        samples.append(round(seconds, 1))
+        del samples[:-MAX_SAMPLES]
+        self.version += 1
+        self._save()
+
+    def estimate(self, kind, stype=None, location=None, disk=False):
+        """Seconds a step of this kind is expected to take."""
+        samples = self._load()
+        exact = samples.get(_key(kind, stype, location, disk))
+        if exact:
+            return statistics.median(exact)
+        for prefix in (f"{kind}|{stype}|", f"{kind}|"):
+            pooled = [
+                t for key, times in samples.items()
+                if key.startswith(prefix) and key.endswith(f"|{int(bool(disk))}")
+                for t in times
+            ]
+            if pooled:
+                return statistics.median(pooled)
+        return DISK_UPGRADE_DEFAULT if kind == "change_type" and disk else DEFAULTS[kind]
+
+
+phase_timings = PhaseTimings()
+
+
+def eta(seconds):
+    """A duration the way a progress line shows it: "~40s", "~3 min"."""
+    if seconds < 90:
+        return f"~{max(1, round(seconds))}s"
+    return f"~{round(seconds / 60)} min"
+
+
+async def timed_wait(api, result, kind, server, stype=None, disk=False, timings=phase_timings,
+                     timeout=None):
+    """`api.wait_for_action` for a step of `kind` just sent for `server`.
+
+    Its history sets the expected duration, so the wait looks seldom until
+    the step is due; a step that finished is added to that history.
+    `stype` is the plan being changed to (plan changes); power changes go
+    by the server's own.
+    """
+    stype = stype or (server.get('server_type') or {}).get('name')
+    location = location_name(server)
+    expected = timings.estimate(kind, stype, location, disk)
+    status = {"power_off": "off", "power_on": "running"}.get(kind)
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    kwargs = {"timeout": timeout} if timeout else {}
+    ok = await api.wait_for_action(
+        result, server_id=server.get('id') if status else None, status=status, expected=expected, **kwargs,
+    )
+    if ok:
+        timings.record(kind, stype, location, loop.time() - began, disk)
+    return ok
+
+
+def demo():
+    import os
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 't.json')
+    t = PhaseTimings(path)
+    assert t.estimate("power_on") == 15.0 and t.estimate("change_type", disk=True) == 180.0
+    for s in (30, 42, 40):
+        t.record("change_type", "cx32", "fsn1", s)
+    t.record("change_type", "cx32", "hel1", 60)
+    t.record("change_type", "cx42", "fsn1", 90)
+    assert t.estimate("change_type", "cx32", "fsn1") == 40               # exact: median
+    assert t.estimate("change_type", "cx32", "nbg1") == 41               # same type elsewhere
+    assert t.estimate("change_type", "cpx11", "nbg1") == 42              # any plan change
+    assert t.estimate("change_type", "cx32", "fsn1", disk=True) == 180   # no disk upgrades yet
+    for s in range(MAX_SAMPLES + 5):
+        t.record("power_off", "cx22", "fsn1", s)
+    assert len(PhaseTimings(path)._load()["power_off|cx22|fsn1|0"]) == MAX_SAMPLES
+    assert eta(40) == "~40s" and eta(200) == "~3 min"
+
+    class API:
+        async def wait_for_action(self, result, timeout=300, server_id=None, status=None, expected=None):
+            self.asked = (server_id, status, expected)
+            await asyncio.sleep(0.01)
+            return True
+
+    api = API()
+    server = {"id": 4, "server_type": {"name": "cx22"}, "location": {"name": "fsn1"}}
+    assert asyncio.run(timed_wait(api, {}, "power_off", server, timings=t))
+    assert api.asked == (4, "off", t.estimate("power_off", "cx22", "fsn1"))
+    assert asyncio.run(timed_wait(api, {}, "change_type", server, stype="cx42", timings=t))
+    assert api.asked == (None, None, 90) and len(t._load()["change_type|cx42|fsn1|0"]) == 2
+    print('phase_timings demo OK')
+
+
+if __name__ == '__main__':
+    demo()
@@ -16,53 +16,88 @@ class PriceStore:
 
     File format:
       {"servers": {"123638116": 3.79}}   # gross EUR per month, as billed
+
+    The file is parsed once and kept in memory. It is read again only when
+    its modification time or size changes — an edit by hand is still picked
+    up — and the store's own writes update the copy in memory directly.
     """
 
     def __init__(self, data_file='price_overrides.json'):
         self.data_file = Path(data_file)
+        self._prices = {}      # server id (str) -> float, already validated
+        self._stamp = None     # (mtime_ns, size) the map was read at
 
-    def _load(self):
-        if not self.data_file.exists():
-            return {}
+    def _file_stamp(self):
         try:
-            data = json.loads(self.data_file.read_text())
-            return data.get('servers', {}) if isinstance(data, dict) else {}
-        except Exception as e:
-            logger.error(f"Failed to load price overrides: {e}")
-            return {}
+            st = self.data_file.stat()
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _load(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return self._prices
+        servers = {}
+        if stamp is not None:
+            try:
+                data = json.loads(self.data_file.read_text())
+                servers = data.get('servers', {}) if isinstance(data, dict) else {}
+            except Exception as e:
+                logger.error(f"Failed to load price overrides: {e}")
+        self._prices = {}
+        for sid, value in servers.items():
+            try:
+                self._prices[str(sid)] = float(value)
+            except (TypeError, ValueError):
+                continue
+        self._stamp = stamp
+        return self._prices
 
     def _save(self, servers):
         try:
             self.data_file.write_text(json.dumps({'servers': servers}, indent=2))
         except Exception as e:
             logger.error(f"Failed to save price overrides: {e}")
+            return
+        self._prices = servers
+        self._stamp = self._file_stamp()
 
     def get(self, server_id):
         """Override for this server, or None to use the API price."""
-        value = self._load().get(str(server_id))
-        try:
-            return float(value) if value is not None else None
-        except (TypeError, ValueError):
-            return None
+        return self._load().get(str(server_id))
 
     def set(self, server_id, price):
-        servers = self._load()
+        servers = dict(self._load())
         servers[str(server_id)] = round(float(price), 2)
         self._save(servers)
 
     def clear(self, server_id):
-        servers = self._load()
+        servers = dict(self._load())
         servers.pop(str(server_id), None)
         self._save(servers)
 
     def all(self):
-        return self._load()
+        return dict(self._load())
 
     def apply(self, server_id, api_price):
         """Price to bill for this server."""
         override = self.get(server_id)
         return api_price if override is None else override
 
+    def apply_many(self, servers, api_price):
+        """Billed price of every server, in one pass over the overrides.
+
+        `api_price` maps a server to its list price and is only called for
+        servers without an override. Returns {server id: (price, overridden)}.
+        """
+        overrides = self._load()
+        result = {}
+        for s in servers:
+            override = overrides.get(str(s.get('id')))
+            result[s.get('id')] = (api_price(s), False) if override is None else (override, True)
+        return result
+
 
 price_store = PriceStore()
 
@@ -83,6 +118,24 @@ def demo():
     assert PriceStore(path).get(123) == 3.79        # survives a reload
     s.clear(123)
     assert s.get(123) is None and s.get(456) == 5.00
+    # one pass for a whole fleet; the list price is only asked for when needed
+    asked = []
+    billed = s.apply_many([{'id': 456}, {'id': 789}], lambda srv: asked.append(srv['id']) or 6.64)
+    assert billed == {456: (5.00, True), 789: (6.64, False)} and asked == [789]
+    # reads come from memory until the file itself changes
+    reads = []
+    original = Path.read_text
+    Path.read_text = lambda self, *a, **k: reads.append(1) or original(self, *a, **k)
+    try:
+        for _ in range(5):
+            s.get(456)
+        assert not reads, "re-read an unchanged file"
+        other = PriceStore(path)
+        other.set(456, 4.20)                        # written by someone else
+        os.utime(path, ns=(0, 1))                   # mtime moved
+        assert s.get(456) == 4.20 and reads
+    finally:
+        Path.read_text = original
     print('price_store demo OK')
 
 
@@ -0,0 +1,154 @@
+import logging
+from utils import location_name
+
+logger = logging.getLogger(__name__)
+
+
+def _net(price_dict):
+    try:
+        return float((price_dict or {}).get('net', 0) or 0)
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+class PricingIndex:
+    """Flat price lookups over the /pricing and /server_types payloads.
+
+    Both payloads nest their prices as a list per type, one entry per
+    location, so every lookup used to be a scan. The index walks them once
+    and answers each question with a dict lookup:
+
+      server  (type, location)          -> (net €/month, net €/TB over)
+      ips     (kind, ip type, location) -> net €/month, kind 'fip' / 'pip'
+      per GB  image, volume             -> net €/GB/month
+
+    A lookup the payloads cannot answer returns None, so a caller holding a
+    type dict of its own can still fall back to reading it directly.
+    """
+
+    def __init__(self, pricing, server_types):
+        self.pricing = pricing or {}
+        self.server_types = server_types or []
+        self._server = {}
+        self._server_first = {}      # type -> its first entry, the scan's fallback
+        self._ips = {}
+        self.image_per_gb = _net(self.pricing.get('image', {}).get('price_per_gb_month'))
+        volume = self.pricing.get('volume', {})
+        self.volume_per_gb = _net(volume.get('price_per_gb_month') or volume)
+        self.fip_fallback = _net(self.pricing.get('floating_ip', {}).get('price_monthly'))
+        try:
+            self.vat_rate = float(self.pricing.get('vat_rate') or 0)
+        except (TypeError, ValueError):
+            self.vat_rate = 0.0
+        try:
+            self.backup_pct = float(
+                self.pricing.get('server_backup', {}).get('percentage', 20) or 20
+            )
+        except (TypeError, ValueError):
+            self.backup_pct = 20.0
+
+        # /server_types is what servers embed; /pricing fills any gaps
+        for source in (self.server_types, self.pricing.get('server_types', [])):
+            for t in source:
+                self._add_server_type(t)
+        for kind, key in (('fip', 'floating_ips'), ('pip', 'primary_ips')):
+            for entry in self.pricing.get(key, []):
+                for p in entry.get('prices', []):
+                    self._ips.setdefault(
+                        (kind, entry.get('type'), p.get('location')),
+                        _net(p.get('price_monthly')),
+                    )
+
+    def _add_server_type(self, t):
+        name = t.get('name')
+        if not name:
+            return
+        for p in t.get('prices', []):
+            per_tb = p.get('price_per_tb_traffic')
+            row = (_net(p.get('price_monthly')), _net(per_tb) if per_tb else None)
+            self._server.setdefault((name, p.get('location')), row)
+            self._server_first.setdefault(name, row)
+
+    @classmethod
+    def refresh(cls, index, pricing, server_types):
+        """`index` if the payloads are the ones it was built from, else a new one.
+
+        The API client hands back the same cached objects until they expire,
+        so identity settles almost every call; equal contents fetched again
+        keep the old index too.
+        """
+        if index is not None:
+            if index.pricing is pricing and index.server_types is server_types:
+                return index
+            if index.pricing == (pricing or {}) and index.server_types == (server_types or []):
+                index.pricing, index.server_types = pricing or {}, server_types or []
+                return index
+        logger.info("Rebuilding pricing index")
+        return cls(pricing, server_types)
+
+    def _server_row(self, type_name, location):
+        return self._server.get((type_name, location)) or self._server_first.get(type_name)
+
+    def server_price(self, type_name, location):
+        """Net monthly list price of a server type at a location."""
+        row = self._server_row(type_name, location)
+        return row[0] if row else None
+
+    def traffic_per_tb(self, type_name, location):
+        """Net price of one TB over the allowance, or None if not quoted."""
+        row = self._server_row(type_name, location)
+        return row[1] if row else None
+
+    def floating_ip_price(self, fip):
+        loc = (fip.get('home_location') or {}).get('name')
+        price = self._ips.get(('fip', fip.get('type'), loc))
+        return self.fip_fallback if price is None else price
+
+    def primary_ip_price(self, pip):
+        return self._ips.get(('pip', pip.get('type'), location_name(pip)), 0.0)
+
+
+def demo():
+    types = [
+        {'name': 'cx23', 'prices': [
+            {'location': 'fsn1', 'price_monthly': {'net': '3.49'}, 'price_per_tb_traffic': {'net': '1.00'}},
+            {'location': 'hel1', 'price_monthly': {'net': '3.99'}, 'price_per_tb_traffic': {'net': '2.50'}},
+        ]},
+    ]
+    pricing = {
+        'vat_rate': '19.00',
+        'image': {'price_per_gb_month': {'net': '0.011'}},
+        'volume': {'price_per_gb_month': {'net': '0.044'}},
+        'floating_ip': {'price_monthly': {'net': '3.00'}},
+        'floating_ips': [{'type': 'ipv4', 'prices': [{'location': 'hel1', 'price_monthly': {'net': '3.50'}}]}],
+        'primary_ips': [{'type': 'ipv4', 'prices': [{'location': 'hel1', 'price_monthly': {'net': '0.50'}}]}],
+        'server_types': [{'name': 'cax11', 'prices': [
+            {'location': 'hel1', 'price_monthly': {'net': '3.79'}}]}],
+    }
+    idx = PricingIndex(pricing, types)
+    assert idx.server_price('cx23', 'hel1') == 3.99
+    assert idx.traffic_per_tb('cx23', 'hel1') == 2.50
+    assert idx.server_price('cx23', 'ash') == 3.49          # unknown place -> first entry
+    assert idx.server_price('cax11', 'hel1') == 3.79        # filled in from /pricing
+    assert idx.traffic_per_tb('cax11', 'hel1') is None      # not quoted -> caller decides
+    assert idx.server_price('nope', 'hel1') is None
+    assert idx.floating_ip_price({'type': 'ipv4', 'home_location': {'name': 'hel1'}}) == 3.50
+    assert idx.floating_ip_price({'type': 'ipv6', 'home_location': {'name': 'hel1'}}) == 3.00
+    assert idx.primary_ip_price({'type': 'ipv4', 'location': {'name': 'hel1'}}) == 0.50
+    assert idx.primary_ip_price({'type': 'ipv4', 'datacenter': {'location': {'name': 'hel1'}}}) == 0.50
+    assert idx.primary_ip_price({'type': 'ipv4', 'location': {'name': 'fsn1'}}) == 0.0
+    assert (idx.vat_rate, idx.backup_pct) == (19.0, 20.0)
+    assert (idx.image_per_gb, idx.volume_per_gb) == (0.011, 0.044)
+
+    # only rebuilt when the payload really changed
+    assert PricingIndex.refresh(idx, pricing, types) is idx
+    import json
+    same = json.loads(json.dumps(pricing))
+    assert PricingIndex.refresh(idx, same, types) is idx and idx.pricing is same
+    changed = {**same, 'vat_rate': '0'}
+    assert PricingIndex.refresh(idx, changed, types) is not idx
+    print('pricing_index demo OK')
+
+
+if __name__ == '__main__':
+    demo()
@@ -0,0 +1,223 @@
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 3.0             # seconds between edits of one progress message
+
+
+class ProgressChannel:
+    """A progress message that is edited at most once per `interval`.
+
+    Long flows (traffic reset, resize, IP swaps) log a line every few
+    seconds, and each line used to be a Telegram edit awaited inline: the
+    flow waited on Telegram, and a burst of lines ran into flood limits.
+
+    `push` only records the latest text and returns at once; a background
+    task edits the message with whatever is newest when the interval allows,
+    so lines logged in between are folded into one edit. `close` waits for
+    an edit under way, then always sends the final state.
+
+    `edit(text, **kwargs)` is the coroutine that changes the message.
+    """
+
+    def __init__(self, edit, interval=PROGRESS_INTERVAL):
+        self._edit = edit
+        self.interval = interval
+        self._pending = None
+        self._sent = None
+        self._last = float('-inf')
+        self._wake = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+        self.pushed = 0
+        self.edits = 0
+
+    def push(self, text):
+        """Make `text` the message's next state. Never waits."""
+        if self._closing.is_set():
+            return
+        self._pending = text
+        self.pushed += 1
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._pump())
+        self._wake.set()
+
+    async def _send(self, text, **kwargs):
+        try:
+            await self._edit(text, **kwargs)
+        except Exception as e:
+            logger.warning(f"Progress edit failed: {e}")
+        self._sent = text
+        self._last = time.monotonic()
+        self.edits += 1
+
+    async def _pump(self):
+        while not self._closing.is_set():
+            await self._wake.wait()
+            self._wake.clear()
+            delay = self._last + self.interval - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._closing.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if self._closing.is_set():
+                return                       # close() sends the final state
+            text, self._pending = self._pending, None
+            if text is not None and text != self._sent:
+                await self._send(text)
+
+    async def close(self, final=None, **kwargs):
+        """Stop editing and send `final` (or the last pushed text) right away."""
+        self._closing.set()
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+        text = final if final is not None else self._pending
+        if text is not None and (text != self._sent or kwargs):
+            await self._send(text, **kwargs)
+        self._pending = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class ProgressBus:
+    """A flow's progress lines, handed to any number of subscribers without
+    the flow ever waiting on them.
+
+    `publish(emoji, message)` appends a line and returns at once. Each
+    subscriber has its own task and a pending slot of one: lines published
+    while it is still busy with the last delivery are folded into its next
+    one, so a slow subscriber (a Telegram edit) falls behind only to the
+    latest state and holds up neither the flow nor the other subscribers.
+
+    A subscriber is called as `callback(lines, new)`: every line so far and
+    the ones added since its last call (a log file writes `new`, a message
+    redraws `lines`). It may be a plain function or a coroutine function;
+    an error in one is logged and does not stop it. `close` delivers what
+    is left to every subscriber and waits for them.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self._subscribers = []       # [callback, lines it has seen, wake event, task]
+        self._closing = False
+
+    def subscribe(self, callback):
+        sub = [callback, 0, asyncio.Event(), None]
+        sub[3] = asyncio.ensure_future(self._deliver(sub))
+        self._subscribers.append(sub)
+        if self.lines:
+            sub[2].set()
+        return self
+
+    def publish(self, emoji, message):
+        """Add a line. Never waits."""
+        if self._closing:
+            return
+        self.lines.append((emoji, message))
+        for sub in self._subscribers:
+            sub[2].set()
+
+    async def _deliver(self, sub):
+        callback, _seen, wake, _task = sub
+        while True:
+            await wake.wait()
+            wake.clear()
+            if sub[1] < len(self.lines):
+                lines = list(self.lines)
+                new, sub[1] = lines[sub[1]:], len(lines)
+                try:
+                    result = callback(lines, new)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.warning(f"Progress subscriber failed: {e}")
+            if self._closing and sub[1] >= len(self.lines):
+                return
+
+    async def close(self):
+        """Stop taking lines; return once every subscriber has had them all."""
+        self._closing = True
+        for sub in self._subscribers:
+            sub[2].set()
+        await asyncio.gather(*(sub[3] for sub in self._subscribers))
+
+
+def log_lines(title):
+    """A ProgressBus subscriber writing each line to the log once."""
+    def write(_lines, new):
+        for emoji, message in new:
+            logger.info(f"{title}: {emoji} {message}")
+    return write
+
+
+def demo():
+    sent = []
+
+    async def edit(text, **kwargs):
+        await asyncio.sleep(0.001)
+        sent.append((text, kwargs))
+
+    async def run():
+        p = ProgressChannel(edit, interval=0.05)
+        start = time.monotonic()
+        for i in range(20):                       # a line every 10 ms for 200 ms
+            p.push(f"line {i}")
+            await asyncio.sleep(0.01)
+        assert time.monotonic() - start < 0.3     # pushing never waited on an edit
+        await p.close("done", reply_markup="kb")
+        assert p.pushed == 20 and p.edits == len(sent)
+        # the first line goes out at once, then one edit per interval at most
+        assert sent[0][0] == "line 0" and 3 <= len(sent) <= 7, sent
+        assert sent[-1] == ("done", {"reply_markup": "kb"})
+
+        # nothing pushed after close; no final given -> the last line is flushed
+        sent.clear()
+        async with ProgressChannel(edit, interval=10) as q:
+            q.push("a")
+            await asyncio.sleep(0.01)
+            q.push("b")
+            q.push("c")
+        q.push("late")
+        assert [t for t, _ in sent] == ["a", "c"], sent
+
+        # a bus: the flow publishes without waiting; a slow subscriber gets the latest,
+        # a log gets every line once, a failing one does not stop the others
+        redraws, logged, notes, after_error = [], [], [], []
+
+        async def slow(lines, new):
+            await asyncio.sleep(0.05)
+            redraws.append(len(lines))
+
+        def broken(lines, new):
+            if len(lines) == 1:
+                raise RuntimeError("gone")
+            after_error.append(len(lines))
+
+        bus = ProgressBus().subscribe(slow).subscribe(lambda lines, new: logged.extend(new))
+        bus.subscribe(broken).subscribe(lambda lines, new: notes.append(lines[-1][1]))
+        start = time.monotonic()
+        for i in range(30):
+            bus.publish("⏳", f"step {i}")
+            await asyncio.sleep(0.005)
+        assert time.monotonic() - start < 0.3
+        await bus.close()
+        bus.publish("🎉", "late")
+        assert [m for _e, m in logged] == [f"step {i}" for i in range(30)]
+        assert redraws[-1] == 30 and len(redraws) < 10, redraws          # folded while busy
+        assert notes[-1] == "step 29" and after_error[-1] == 30 and len(bus.lines) == 30
+
+    asyncio.run(run())
+    print('progress demo OK')
+
+
+if __name__ == '__main__':
+    demo()
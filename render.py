@@ -0,0 +1,154 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from utils import location_name
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGES = 256                  # messages whose last edit is remembered
+MAX_FRAGMENTS = 4096                # rendered rows / panels kept
+
+
+def server_version(server):
+    """Everything a server's list row and panel are drawn from.
+
+    Two fetches of an unchanged server give the same version, so their
+    rendering can be reused; any field that shows on screen changing gives
+    a new one.
+    """
+    st = server.get("server_type") or {}
+    return (
+        server.get("id"), server.get("name"), server.get("status"),
+        st.get("name"), st.get("cores"), st.get("memory"), st.get("disk"),
+        location_name(server),
+        server.get("outgoing_traffic"), server.get("included_traffic"),
+        server.get("backup_window"),
+        ((server.get("public_net") or {}).get("ipv4") or {}).get("ip"),
+    )
+
+
+class RenderCache:
+    """What each message shows, and screen parts already drawn.
+
+    Shown: for every message the bot edited, a digest of the (text, markup,
+    parse mode) it sent and the plain text Telegram echoed back. An edit
+    whose digest matches is skipped without a request — but only while the
+    message the admin pressed still carries that echoed text, so a message
+    changed by anything else (the SSH console edits its own) is never
+    mistaken for up to date.
+
+    Fragments: rendered rows and panels, keyed by what they were drawn from
+    (see `server_version`), so an unchanged server is not formatted again.
+    """
+
+    def __init__(self, max_messages=MAX_MESSAGES, max_fragments=MAX_FRAGMENTS):
+        self.max_messages = max_messages
+        self.max_fragments = max_fragments
+        self._shown = OrderedDict()         # (chat, message) -> (digest, plain text)
+        self._fragments = OrderedDict()
+        self.edits = 0
+        self.edits_skipped = 0
+        self.fragment_hits = 0
+        self.fragment_misses = 0
+
+    @staticmethod
+    def digest(text, kwargs):
+        h = hashlib.blake2b(text.encode(), digest_size=16)
+        markup = kwargs.get("reply_markup")
+        if markup is not None:
+            h.update(markup.to_json().encode() if hasattr(markup, "to_json") else repr(markup).encode())
+        for key in sorted(k for k in kwargs if k != "reply_markup"):
+            h.update(f"\0{key}={kwargs[key]!r}".encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def _key(message):
+        return (message.chat_id, message.message_id)
+
+    def unchanged(self, message, digest):
+        """True if `message` already shows what `digest` describes."""
+        if message is None:
+            return False
+        entry = self._shown.get(self._key(message))
+        if entry and entry[0] == digest and entry[1] == message.text:
+            self.edits_skipped += 1
+            return True
+        return False
+
+    def remember(self, message, digest, sent):
+        """Record an edit of `message`; `sent` is what Telegram returned."""
+        if message is None:
+            return
+        self.edits += 1
+        key = self._key(message)
+        text = getattr(sent, "text", None)
+        if text is None:
+            self._shown.pop(key, None)
+            return
+        self._shown[key] = (digest, text)
+        self._shown.move_to_end(key)
+        while len(self._shown) > self.max_messages:
+            self._shown.popitem(last=False)
+
+    def fragment(self, key, render):
+        """`render()`'s result for `key`, drawn once while `key` stays the same."""
+        try:
+            value = self._fragments[key]
+        except KeyError:
+            self.fragment_misses += 1
+            value = self._fragments[key] = render()
+            while len(self._fragments) > self.max_fragments:
+                self._fragments.popitem(last=False)
+            return value
+        self.fragment_hits += 1
+        self._fragments.move_to_end(key)
+        return value
+
+    def summary(self):
+        return {
+            "edits": self.edits,
+            "edits_skipped": self.edits_skipped,
+            "fragment_hits": self.fragment_hits,
+            "fragment_misses": self.fragment_misses,
+        }
+
+
+render_cache = RenderCache()
+
+
+def demo():
+    from types import SimpleNamespace as NS
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+    kb = lambda label: InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data="x")]])
+    c = RenderCache(max_messages=2, max_fragments=2)
+    d1 = c.digest("*hi*", {"reply_markup": kb("a"), "parse_mode": "Markdown"})
+    assert d1 == c.digest("*hi*", {"parse_mode": "Markdown", "reply_markup": kb("a")})
+    assert d1 != c.digest("*hi*", {"reply_markup": kb("b"), "parse_mode": "Markdown"})
+    assert d1 != c.digest("*hi*", {"reply_markup": kb("a")})
+
+    msg = NS(chat_id=1, message_id=10, text="hi")
+    assert not c.unchanged(msg, d1)                  # never edited
+    c.remember(msg, d1, NS(text="hi"))
+    assert c.unchanged(msg, d1)                      # same content, same message
+    # the console rewrote the message since: the edit must go through
+    assert not c.unchanged(NS(chat_id=1, message_id=10, text="$ uptime"), d1)
+    c.remember(NS(chat_id=1, message_id=11, text=""), d1, NS(text="x"))
+    c.remember(NS(chat_id=1, message_id=12, text=""), d1, NS(text="x"))
+    assert not c.unchanged(msg, d1)                  # evicted, oldest first
+    c.remember(msg, d1, True)                        # no message echoed back
+    assert not c.unchanged(msg, d1)
+
+    calls = []
+    srv = {"id": 1, "name": "a", "status": "running", "outgoing_traffic": 5}
+    draw = lambda s: lambda: calls.append(s["id"]) or f"row {s['name']}"
+    assert c.fragment(("row", server_version(srv)), draw(srv)) == "row a"
+    assert c.fragment(("row", server_version(dict(srv))), draw(srv)) == "row a"
+    moved = {**srv, "outgoing_traffic": 6}
+    c.fragment(("row", server_version(moved)), draw(moved))
+    assert calls == [1, 1] and c.fragment_hits == 1
+    print('render demo OK', c.summary())
+
+
+if __name__ == '__main__':
+    demo()
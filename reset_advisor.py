@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from config import Config
+from hetzner_api import all_apis
+from jobs import job_manager
+from bounce_plans import hourly_price
+from phase_timings import phase_timings
+from reset_orchestrator import ResetOrchestrator, reset_estimate
+from reset_store import reset_store
+from server_index import server_indexes
+from utils import location_name, traffic_limit_tb, traffic_price_per_tb
+
+logger = logging.getLogger(__name__)
+
+TB = 1024 ** 4
+
+
+def month_end(now=None):
+    """Epoch seconds at which the current (UTC) month's traffic counters restart."""
+    today = datetime.fromtimestamp(now or time.time(), timezone.utc)
+    year, month = (today.year + 1, 1) if today.month == 12 else (today.year, today.month + 1)
+    return datetime(year, month, 1, tzinfo=timezone.utc).timestamp()
+
+
+def reset_cost(server, bounce, timings=phase_timings):
+    """(€ a traffic reset through `bounce` costs, seconds it takes).
+
+    The cost is the bounce plan's hourly price for the time the server
+    spends on it, plus RESET_DOWNTIME_COST for the length of the reset.
+    """
+    location = location_name(server)
+    original = (server.get('server_type') or {}).get('name')
+    took = reset_estimate(server, bounce['name'], timings=timings)
+    on_bounce = (
+        timings.estimate('change_type', bounce['name'], location)
+        + timings.estimate('power_on', bounce['name'], location)
+        + timings.estimate('power_off', bounce['name'], location)
+        + timings.estimate('change_type', original, location)
+    )
+    cost = hourly_price(bounce, location) * on_bounce / 3600 + Config.RESET_DOWNTIME_COST * took / 3600
+    return cost, took
+
+
+def advise(used, limit, rate, per_tb, cost, now, end):
+    """Reset or pay, for one server. All traffic in bytes, `rate` per hour.
+
+    Resetting the counter stops Hetzner billing the overage so far, so one
+    reset is enough as long as what is sent after it fits the allowance:
+    the best time is the first moment that holds, `limit / rate` hours
+    before the month ends (now, if that has passed). Waiting until then
+    costs nothing and avoids a second reset later in the month.
+
+    Returns a dict:
+      action         "ok" (no overage coming), "pay" (the reset costs more
+                     than it saves), "reset" (do it now) or "wait" (reset
+                     at best_at)
+      pay            € owed at the end of the month if nothing is done
+      saving         pay - cost when a reset is advised, else 0
+      break_even_tb  TB over the allowance at which a reset pays for itself
+      break_even_at  when the overage reaches that at this pace (epoch s),
+                     or None if it does not this month
+      best_at        when to reset (epoch s), or None
+    """
+    hours_left = max(0.0, (end - now) / 3600)
+    over_at_end = max(0.0, used + rate * hours_left - limit)
+    pay = over_at_end / TB * per_tb
+    break_even = cost / per_tb * TB if per_tb else float('inf')
+    break_even_at = None
+    if rate > 0:
+        hours = (limit + break_even - used) / rate
+        if hours <= hours_left:
+            break_even_at = now + max(0.0, hours) * 3600
+    advice = {
+        'action': 'ok', 'pay': pay, 'saving': 0.0, 'break_even_tb': break_even / TB,
+        'break_even_at': break_even_at, 'best_at': None,
+    }
+    if pay <= 0:
+        return advice
+    if pay <= cost:
+        advice['action'] = 'pay'
+        return advice
+    best_at = max(now, end - limit / rate * 3600) if rate > 0 else now
+    advice.update(action='reset' if best_at <= now else 'wait', saving=pay - cost, best_at=best_at)
+    return advice
+
+
+async def advise_fleet(fleet, apis, timings=phase_timings, now=None):
+    """`advise` for every server of a FleetIndex, most saved first.
+
+    One pass over the fleet. What a reset costs depends only on the plan
+    and location, so it is worked out once per (account, plan, location);
+    each account's bounce table and pricing index are fetched once, all
+    accounts at the same time. `apis` maps account index to its client.
+
+    Each entry is the advice dict plus "server", "acct", "bounce" (plan
+    name or None), "cost" and "took" (the reset's € and seconds).
+    """
+    now = now or time.time()
+    end = month_end(now)
+    accts = sorted({fleet.account_of[s.get('id')] for s in fleet.servers})
+    fetched = await asyncio.gather(*(
+        asyncio.gather(apis[acct].get_bounce_table(timings), apis[acct].get_pricing_index())
+        for acct in accts
+    ))
+    tables = dict(zip(accts, fetched))
+    resets = {}
+    results = []
+    for position, server in enumerate(fleet.servers):
+        acct = fleet.account_of[server.get('id')]
+        table, index = tables[acct]
+        current = server.get('server_type') or {}
+        key = (acct, current.get('name'), location_name(server))
+        if key not in resets:
+            bounce = table.pick(current, key[2])
+            resets[key] = (bounce, *(reset_cost(server, bounce, timings) if bounce else (float('inf'), 0.0)))
+        bounce, cost, took = resets[key]
+        advice = advise(
+            server.get('outgoing_traffic') or 0, traffic_limit_tb(server) * TB, fleet.pace(position, now),
+            traffic_price_per_tb(server, index), cost, now, end,
+        )
+        advice.update(server=server, acct=acct, bounce=bounce and bounce['name'], cost=cost, took=took)
+        results.append(advice)
+    results.sort(key=lambda a: (-a['saving'], -a['pay']))
+    return results
+
+
+async def auto_reset(bot=None):
+    """Run hourly with AUTO_RESET on: reset every server the advice says is due."""
+    if not Config.AUTO_RESET:
+        return []
+    apis = {idx: api for idx, _name, api in all_apis()}
+    fleet = await server_indexes.load_fleet(all_apis(), rebuild=True)
+    advice = await advise_fleet(fleet, apis)
+    due = [a for a in advice if a['action'] == 'reset' and not reset_store.get(a['server']['id'])]
+    # a server some job is already working on waits for the next round
+    free = set(job_manager.free((a['acct'], a['server']['id']) for a in due))
+    due = [a for a in due if (a['acct'], a['server']['id']) in free]
+    if not due:
+        return []
+    logger.info(f"Auto reset: {len(due)} servers due")
+    targets = [(a['acct'], a['server']['id']) for a in due]
+
+    async def work(job):
+        ended = set()
+
+        def changed(sid, state, _detail):
+            if state in ("ok", "failed"):
+                ended.add(sid)
+            job.note(f"{len(ended)} of {len(targets)} done")
+
+        results, _took = await ResetOrchestrator(apis).run(targets, changed)
+        return results
+
+    job, _busy = job_manager.submit("reset", f"🤖 Automatic reset × {len(due)}", targets, work)
+    results = await job.task
+    if not results:
+        return []
+    server_indexes.fleet = None
+    lines = [
+        f"{'✅' if r['ok'] else '❌'} `{a['server'].get('name', '?')}` — "
+        + (f"saves ~€{a['saving']:.2f}" if r['ok'] else r['detail'])
+        for a, r in zip(due, results)
+    ]
+    if bot:
+        try:
+            await bot.send_message(
+                chat_id=Config.ADMIN_ID,
+                text="🤖 *Automatic traffic resets*\n\n" + "\n".join(lines),
+                parse_mode="Markdown",
+            )
+        except Exception as e:
+            logger.error(f"Failed to report automatic resets: {e}")
+    return results
+
+
+def demo():
+    import os
+    import tempfile
+    from phase_timings import PhaseTimings
+    from bounce_plans import BounceTable
+    from server_index import FleetIndex
+
+    now = datetime(2026, 10, 11, tzinfo=timezone.utc).timestamp()     # 10 days in, 21 to go
+    end = month_end(now)
+    assert end == datetime(2026, 11, 1, tzinfo=timezone.utc).timestamp()
+    assert month_end(datetime(2026, 12, 31, tzinfo=timezone.utc).timestamp()) == \
+        datetime(2027, 1, 1, tzinfo=timezone.utc).timestamp()
+    limit = 20 * TB
+
+    # 1 TB a day: 31 TB by the end, 11 over at €1 => €11 to pay; a €0.05 reset is worth it,
+    # and the best time is when the last 20 days of traffic still fit: tomorrow
+    a = advise(10 * TB, limit, TB / 24, 1.0, 0.05, now, end)
+    assert a['action'] == 'wait' and round(a['pay'], 2) == 11 and round(a['saving'], 2) == 10.95
+    assert round((a['best_at'] - now) / 86400, 3) == 1
+    assert round(a['break_even_tb'], 2) == 0.05 and round((a['break_even_at'] - now) / 86400, 2) == 10.05
+    # already over, at a pace the rest of the month fits in: reset right away
+    assert advise(25 * TB, limit, TB / 48, 1.0, 0.05, now, end)['action'] == 'reset'
+    # a little over at the end: cheaper to pay than to reset
+    a = advise(19.9 * TB, limit, 0.02 * TB / 24, 1.0, 0.5, now, end)
+    assert a['action'] == 'pay' and a['pay'] < 0.5 and a['break_even_at'] is None
+    assert advise(2 * TB, limit, 0.1 * TB / 24, 1.0, 0.05, now, end)['action'] == 'ok'
+
+    # the whole fleet at once
+    types = [
+        {'name': n, 'architecture': 'x86', 'cores': c, 'memory': c * 2, 'disk': c * 20,
+         'prices': [{'location': 'fsn1', 'price_hourly': {'net': str(h)}, 'price_monthly': {'net': '5'},
+                     'price_per_tb_traffic': {'net': '1.00'}}]}
+        for n, c, h in (('cx22', 2, 0.006), ('cx32', 4, 0.011), ('cx42', 8, 0.026))
+    ]
+    started = datetime(2026, 10, 1, tzinfo=timezone.utc).isoformat()
+    srv = lambda i, t, used: {'id': i, 'name': f's{i}', 'status': 'running', 'location': {'name': 'fsn1'},
+                              'server_type': types[t], 'created': started,
+                              'outgoing_traffic': used * TB, 'included_traffic': limit}
+    timings = PhaseTimings(os.path.join(tempfile.mkdtemp(), 't.json'))
+
+    class API:
+        def __init__(self):
+            self.tables = 0
+            self.bounce_table = None
+
+        async def get_bounce_table(self, timings):
+            self.tables += 1
+            self.bounce_table = BounceTable.refresh(self.bounce_table, types, timings)
+            return self.bounce_table
+
+        async def get_pricing_index(self):
+            return None
+
+    apis = {0: API(), 1: API()}
+    servers = [srv(i, i % 2, 25 if i % 3 == 0 else 5) for i in range(1, 601)]
+    fleet = FleetIndex([(0, servers[:300]), (1, servers[300:] + [srv(999, 2, 40)])])
+    fleet._since = [datetime(2026, 10, 1, tzinfo=timezone.utc).timestamp()] * len(fleet.servers)
+    start = time.perf_counter()
+    advice = asyncio.run(advise_fleet(fleet, apis, timings, now))
+    took = time.perf_counter() - start
+    assert len(advice) == 601 and all(api.tables == 1 for api in apis.values())
+    # 25 TB in 10 days: the last 8 days' 20 TB fit after a reset
+    assert advice[0]['action'] == 'wait' and advice[0]['saving'] > 0
+    assert round((end - advice[0]['best_at']) / 86400, 3) == 8
+    assert advice[0]['bounce'] in ('cx32', 'cx42')
+    assert {a['action'] for a in advice if a['server']['outgoing_traffic'] == 5 * TB} == {'ok'}
+    nothing_bigger = next(a for a in advice if a['server']['id'] == 999)
+    assert nothing_bigger['bounce'] is None and nothing_bigger['action'] == 'pay'
+    print(f'reset_advisor demo OK ({took * 1000:.1f} ms for {len(advice)} servers)')
+
+
+if __name__ == '__main__':
+    demo()
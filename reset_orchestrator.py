@@ -0,0 +1,862 @@
+import asyncio
+import logging
+from config import Config
+from hetzner_api import all_apis, last_failure_transient, poll_delays, RATE_LIMIT_SOFT_FLOOR
+from overage_tracker import overage_tracker
+from reset_store import reset_store
+from phase_timings import phase_timings, eta
+from bounce_plans import BounceTable
+from server_manager import pick_upgrade_type, settle_overage
+from batch import budget_limit, retry
+from server_locks import server_locks
+from utils import location_name
+
+logger = logging.getLogger(__name__)
+
+STATUS_TIMEOUT = 200                # seconds a power change may take
+TYPE_TIMEOUT = 300                  # seconds a plan change may take
+CALLS_PER_RESET = 10                # requests one reset sends, status checks aside
+
+# The steps of one reset, in order: (phase, what it does, label, icon).
+# "off" powers the server off, "on" powers it on, "bounce"/"back" change its
+# plan to the larger one and back to where it was.
+PHASES = (
+    ("power_off", "off", "Power off", "🔴"),
+    ("upgrade", "bounce", "Upgrade", "🔼"),
+    ("boot", "on", "Boot upgraded", "🟢"),
+    ("power_off_again", "off", "Power off again", "🔴"),
+    ("downgrade", "back", "Downgrade", "🔽"),
+    ("power_on", "on", "Power on", "🟢"),
+)
+PHASE_INDEX = {phase: i for i, (phase, *_rest) in enumerate(PHASES)}
+ROLLBACK_FROM = PHASE_INDEX["power_off_again"]   # the way back is the second half
+# what each step is timed as in phase_timings
+STEP_KIND = {"off": "power_off", "on": "power_on", "bounce": "change_type", "back": "change_type"}
+# statuses a server passes through on its own; nothing is sent until it settles
+TRANSITIONAL = {"initializing", "starting", "stopping", "migrating", "rebuilding"}
+
+
+class StatusPoller:
+    """One account's shared watch over the actions and servers resets wait on.
+
+    A reset that sent a power or plan change waits for the action Hetzner
+    returned to finish; one that has no action to go by waits for the
+    server to show a state. Whatever is waiting, one request per round
+    answers every action (/actions?id=…) and one every server (/servers; a
+    server the list does not include is fetched on its own).
+
+    Each waiter has its own poll_delays schedule, capped at `interval`:
+    given how long its step is expected to take, it needs no look until
+    the step is nearly due, then looks often. A round happens when the
+    first waiter is due, and answers the others as well. The poll stops
+    once nothing waits.
+    """
+
+    def __init__(self, api, interval=5.0):
+        self.api = api
+        self.interval = interval
+        self._waiting = {}              # server id -> [(predicate, future)]
+        self._actions = {}              # action id -> [future]
+        self._looks = {}                # future -> [when it is due a look, its poll_delays, kind]
+        self._changed = asyncio.Event()
+        self._task = None
+        self.polls = 0
+
+    def _watch(self, future, kind, expected):
+        delays = poll_delays(min(1.0, self.interval), cap=self.interval, expected=expected)
+        self._looks[future] = [asyncio.get_running_loop().time() + next(delays), delays, kind]
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _settle(self, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._looks.pop(future, None)
+
+    async def wait(self, server_id, predicate, timeout, expected=None):
+        """The server once `predicate(server)` holds, or None after `timeout`."""
+        entry = (predicate, asyncio.get_running_loop().create_future())
+        self._waiting.setdefault(server_id, []).append(entry)
+        self._watch(entry[1], "server", expected)
+        try:
+            return await self._settle(entry[1], timeout)
+        finally:
+            waiters = self._waiting.get(server_id, [])
+            if entry in waiters:
+                waiters.remove(entry)
+            if not waiters:
+                self._waiting.pop(server_id, None)
+
+    async def wait_action(self, action, timeout, expected=None):
+        """The action once it is no longer running, or None after `timeout`."""
+        if action.get("status") != "running":
+            return action
+        future = asyncio.get_running_loop().create_future()
+        self._actions.setdefault(action["id"], []).append(future)
+        self._watch(future, "action", expected)
+        try:
+            return await self._settle(future, timeout)
+        finally:
+            futures = self._actions.get(action["id"], [])
+            if future in futures:
+                futures.remove(future)
+            if not futures:
+                self._actions.pop(action["id"], None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._looks:
+                self._changed.clear()
+                first = min(due for due, _delays, _kind in self._looks.values())
+                try:
+                    # a new waiter may be due sooner: it wakes the loop to look again
+                    await asyncio.wait_for(self._changed.wait(), max(0.0, first - loop.time()))
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+                now = loop.time()
+                due = [look for look in self._looks.values() if look[0] <= now]
+                try:
+                    if self._actions and any(kind == "action" for _when, _delays, kind in due):
+                        await self._poll_actions()
+                    if self._waiting and any(kind == "server" for _when, _delays, kind in due):
+                        await self._poll_servers()
+                except Exception as e:
+                    # one bad round must not strand every reset waiting on this account
+                    logger.error(f"Status poll failed, trying again next round: {e}")
+                for look in due:
+                    look[0] = now + next(look[1])
+        finally:
+            self._task = None
+
+    async def _poll_actions(self):
+        actions = await self.api.get_actions(list(self._actions))
+        self.polls += 1
+        for action in actions:
+            if action.get("status") == "running":
+                continue
+            for future in list(self._actions.get(action.get("id"), ())):
+                if not future.done():
+                    future.set_result(action)
+
+    async def _poll_servers(self):
+        servers = await self.api.list_servers(fresh=True)
+        self.polls += 1
+        if not servers:
+            return                      # API trouble: the next round tries again
+        by_id = {s.get("id"): s for s in servers}
+        for server_id in list(self._waiting):
+            server = by_id.get(server_id)
+            if server is None:
+                server = await self.api.get_server(server_id, fresh=True)
+                self.polls += 1
+            for predicate, future in list(self._waiting.get(server_id, ())):
+                if server and not future.done() and predicate(server):
+                    future.set_result(server)
+
+
+def _plan_of(server):
+    return ((server or {}).get("server_type") or {}).get("name")
+
+
+def reset_estimate(server, bounce=None, start=0, timings=phase_timings):
+    """Seconds PHASES[start:] are expected to take on `server`."""
+    location = location_name(server)
+    original = _plan_of(server)
+    total = 0.0
+    for _phase, step, _label, _icon in PHASES[start:]:
+        stype = {"bounce": bounce, "back": original}.get(step, original)
+        total += timings.estimate(STEP_KIND[step], stype, location)
+    return total
+
+
+class ResetOrchestrator:
+    """Traffic resets of many servers, across accounts, run side by side.
+
+    Each server goes through PHASES on its own; up to `per_account` servers
+    of one account are between their first and last phase at a time (fewer
+    when the account's API budget runs low), so one server's plan change
+    overlaps another's power-off. Their waits share one StatusPoller per
+    account instead of polling a server each.
+
+    Every phase is written to `store` before it starts, with the plan the
+    server started on and the one it bounces through. A phase whose outcome
+    the server already shows is skipped, so a reset can be picked up again
+    at the phase it was in (see `recover`). If the upgrade or the boot after
+    it fails, the second half runs at once to put the server back on its
+    own plan.
+
+    Each step is timed into `timings`; what it took before sets the ETA in
+    its progress note and when the poller first looks.
+
+    `apis` maps account index to its HetznerAPI client.
+    """
+
+    def __init__(self, apis, per_account=None, poll_interval=None, tracker=overage_tracker,
+                 store=reset_store, timings=phase_timings):
+        self.apis = apis
+        self.timings = timings
+        self.per_account = per_account or Config.RESET_CONCURRENCY
+        interval = poll_interval or Config.RESET_POLL_INTERVAL
+        self.pollers = {acct: StatusPoller(api, interval) for acct, api in apis.items()}
+        self.tracker = tracker
+        self.store = store
+
+    def limit(self, acct):
+        api = self.apis[acct]
+        return budget_limit(self.per_account, api.rate_remaining, CALLS_PER_RESET, RATE_LIMIT_SOFT_FLOOR)
+
+    async def run(self, targets, on_change=None):
+        """Reset every (account, server id) in `targets`.
+
+        `on_change(server_id, state, detail)` is called as a server starts
+        ("running"), moves on a phase, and ends ("ok" / "failed"), and with
+        "queued" if it has to wait for another flow holding the server's
+        lock (see server_locks.py); it must not block. Returns ([result], seconds the whole run took), results
+        in the order of `targets`, each a dict with "acct", "server_id",
+        "ok", "detail", "owed" (€ settled), "phases" ({phase: seconds})
+        and "took". Cancelled, a server whose reset had begun is rolled
+        back or finished (see `_stopped`) before the cancellation goes on.
+        """
+        return await self._run([(acct, sid, self._reset) for acct, sid in targets], on_change)
+
+    async def recover(self, on_change=None):
+        """Finish the resets `store` says were under way when the bot stopped.
+
+        One that had not got past the upgrade, with the server still on its
+        own plan, is rolled back: the server is powered on again if it was
+        running. Any other is resumed at the phase it was in. Results as
+        from `run`, with "outcome" set to "resumed" or "rolled back".
+        """
+        jobs = []
+        for server_id, record in self.store.unfinished().items():
+            if record.get("acct") not in self.apis:
+                logger.warning(f"Unfinished reset of {server_id}: account {record.get('acct')} is gone")
+                continue
+            jobs.append((record["acct"], server_id, self._resume))
+        if not jobs:
+            return [], 0.0
+        return await self._run(jobs, on_change)
+
+    async def _run(self, jobs, on_change):
+        gates = {acct: asyncio.Semaphore(self.limit(acct)) for acct in {a for a, _sid, _job in jobs}}
+        loop = asyncio.get_running_loop()       # its clock, so a simulated run reports simulated time
+        start = loop.time()
+
+        def emit(server_id, state, detail=""):
+            if on_change:
+                on_change(server_id, state, detail)
+
+        async def one(acct, server_id, job):
+            result = {"acct": acct, "server_id": server_id, "ok": False, "detail": "",
+                      "owed": 0, "phases": {}, "took": 0.0}
+            # the server's lock first: a server some other flow is busy with
+            # waits without taking one of the account's slots
+            waiting = lambda holder: emit(server_id, "queued", f"⏳ waiting for {holder} to finish")
+            async with server_locks.hold(server_id, "traffic reset", acct, waiting), gates[acct]:
+                began = loop.time()
+                emit(server_id, "running")
+                note = lambda d: emit(server_id, "running", d)
+                try:
+                    result["ok"], result["detail"] = await job(acct, server_id, result, note)
+                except asyncio.CancelledError:
+                    await self._stopped(acct, server_id, result, note)
+                    emit(server_id, "failed", result["detail"])
+                    raise
+                except Exception as e:
+                    logger.error(f"Traffic reset of {server_id} failed: {e}")
+                    result["detail"] = str(e)
+                result["took"] = loop.time() - began
+            emit(server_id, "ok" if result["ok"] else "failed", result["detail"])
+            return result
+
+        results = await asyncio.gather(*(one(acct, sid, job) for acct, sid, job in jobs))
+        return results, loop.time() - start
+
+    async def _stopped(self, acct, server_id, result, note):
+        """Put a server whose reset was cancelled part way back in order.
+
+        What `recover` does at the next start, done now: rolled back if it
+        had not left its plan, else taken through the remaining phases. It
+        is shielded from the cancellation, so the server is not left off or
+        on the bounce plan. Cancelled again while it runs, it carries on in
+        the background and the store still has the reset for the next start.
+        """
+        if not self.store.get(server_id):
+            result["detail"] = "cancelled before anything was changed"
+            return
+        logger.info(f"Traffic reset of {server_id} cancelled: putting the server back in order")
+        note("🛑 Cancelled — putting the server back in order")
+        ok, detail = await asyncio.shield(self._resume(acct, server_id, result, note))
+        result["detail"] = f"cancelled; {detail}" if ok else f"cancelled, and {detail}"
+
+    async def _reset(self, acct, server_id, result, note):
+        api = self.apis[acct]
+        if self.store.get(server_id):
+            # left by a reset that was stopped: the server's lock is ours, so
+            # nothing else is running it. Finish that one first.
+            note("↪️ An earlier reset of this server did not finish — picking it up")
+            ok, detail = await self._resume(acct, server_id, result, note)
+            if not ok or result.pop("outcome", None) == "resumed":
+                return ok, detail
+        server = await api.get_server(server_id, fresh=True)
+        if not server:
+            return False, "could not fetch the server"
+        current = (server.get("server_type") or {}).get("name")
+        if not current:
+            return False, "unknown plan"
+        table = await api.get_bounce_table(self.timings)
+        target = table.pick(server["server_type"], location_name(server))
+        if not target:
+            return False, f"no larger plan to bounce {current} through"
+        bounce = target["name"]
+        note(f"💾 Current plan {current}, bouncing through {bounce}")
+        self.store.begin(server_id, acct, current, bounce, server.get("status") == "running", PHASES[0][0])
+        return await self._phases(acct, server_id, server, result, note, 0, before=server)
+
+    async def _resume(self, acct, server_id, result, note):
+        record = self.store.get(server_id)
+        api = self.apis[acct]
+        server = await api.get_server(server_id, fresh=True)
+        if not server:
+            if last_failure_transient():
+                return False, "could not fetch the server; tried again at the next start"
+            self.store.finish(server_id)
+            return False, "server no longer exists"
+        at = PHASE_INDEX.get(record.get("phase"), 0)
+        on_own_plan = (server.get("server_type") or {}).get("name") == record["original"]
+        if at <= PHASE_INDEX["upgrade"] and on_own_plan and server.get("status") not in TRANSITIONAL:
+            result["outcome"] = "rolled back"
+            if not record.get("was_running") or server.get("status") == "running":
+                self.store.finish(server_id)
+                return True, "never left its plan"
+            ok, detail = await self._phases(acct, server_id, server, result, note, PHASE_INDEX["power_on"])
+            return ok, "powered on again, never left its plan" if ok else detail
+        # the overage is not settled here: the monitor sees the counter drop
+        result["outcome"] = "resumed"
+        note(f"↪️ resuming at {PHASES[at][2].lower()}")
+        return await self._phases(acct, server_id, server, result, note, at)
+
+    async def _phases(self, acct, server_id, server, result, note, start, before=None):
+        """Run PHASES[start:] on the server, recording each in the store.
+
+        `server` is its latest state. `before`, its state when the reset
+        began, is settled with the overage tracker once the upgrade lands.
+        """
+        api = self.apis[acct]
+        poller = self.pollers[acct]
+        loop = asyncio.get_running_loop()
+        record = self.store.get(server_id)
+        original, bounce = record["original"], record["bounce"]
+        location = location_name(server)
+
+        for i in range(start, len(PHASES)):
+            phase, step, label, icon = PHASES[i]
+            self.store.advance(server_id, phase)
+            began = loop.time()
+            if step in ("off", "on"):
+                call = api.power_off if step == "off" else api.power_on
+                landed = {"status": "off" if step == "off" else "running"}
+                timeout = STATUS_TIMEOUT
+            else:
+                plan = bounce if step == "bounce" else original
+                call = lambda sid, plan=plan: api.change_server_type(sid, plan, upgrade_disk=False)
+                landed = {"status": "off", "server_type": {**(server.get("server_type") or {}), "name": plan}}
+                timeout = TYPE_TIMEOUT
+            kind = STEP_KIND[step]
+            stype = _plan_of(landed) or _plan_of(server) or original   # plan changed to, else the one it is on
+            expected = self.timings.estimate(kind, stype, location)
+            done = lambda s, landed=landed: all(
+                _plan_of(s) == _plan_of(landed) if key == "server_type" else s.get(key) == value
+                for key, value in landed.items()
+            )
+            if server.get("status") in TRANSITIONAL:
+                # still moving from before (a resumed reset): let it settle first
+                server = await poller.wait(
+                    server_id, lambda s: s.get("status") not in TRANSITIONAL, timeout,
+                ) or server
+            failure = None
+            if not done(server):
+                left = reset_estimate({**server, "server_type": {"name": original}}, bounce, i, self.timings)
+                note(f"{icon} {label}… {eta(expected)} · {eta(left)} left")
+                sent, _tries = await retry(lambda: call(server_id), last_failure_transient)
+                sent_at = loop.time()
+                action = sent.get("action") if sent else None
+                if sent is None:
+                    failure = "request failed"
+                elif action and action.get("id"):
+                    # the action finishing is the step finishing: no need to watch the server
+                    finished = await poller.wait_action(action, timeout, expected)
+                    if finished is not None and finished.get("status") == "success":
+                        server = {**server, **landed}
+                        self.timings.record(kind, stype, location, loop.time() - sent_at)
+                    elif finished is not None:
+                        failure = (finished.get("error") or {}).get("message") or "action failed"
+                    elif step == "on":
+                        logger.warning(f"Server {server_id}: start not confirmed after {label.lower()}")
+                        note(f"⚠️ {label}: not confirmed yet")
+                        server = {**server, **landed}
+                    else:
+                        failure = "timed out"
+                else:
+                    reached = await poller.wait(server_id, done, timeout, expected)
+                    if reached is not None:
+                        server = reached
+                        self.timings.record(kind, stype, location, loop.time() - sent_at)
+                    elif step == "on":
+                        # it was asked to start; the next power-off, or the admin, will see
+                        logger.warning(f"Server {server_id}: not seen running after {label.lower()}")
+                        note(f"⚠️ {label}: not seen running yet")
+                        server = {**server, "status": "running"}
+                    else:
+                        failure = "timed out"
+            result["phases"][phase] = loop.time() - began
+            if failure:
+                return await self._failed(acct, server_id, result, note, i, f"{label}: {failure}", _plan_of(server))
+            note(f"✅ {label} done in {result['phases'][phase]:.0f}s")
+            if phase == "upgrade" and before is not None:
+                result["owed"] = settle_overage(before, self.tracker)
+                if result["owed"]:
+                    note(f"💰 €{result['owed']:.2f} overage cleared from this month's bill")
+        self.store.finish(server_id)
+        logger.info(f"Server {server_id}: traffic reset via {bounce} done")
+        return True, f"reset via {bounce}"
+
+    async def _failed(self, acct, server_id, result, note, at, why, plan):
+        record = self.store.get(server_id)
+        if at == 0:
+            # nothing was changed yet
+            self.store.finish(server_id)
+            return False, why
+        if at < ROLLBACK_FROM:
+            note(f"↩️ {why}, putting it back on {record['original']}")
+            server = await self.apis[acct].get_server(server_id, fresh=True) or {}
+            ok, detail = await self._phases(acct, server_id, server, result, note, ROLLBACK_FROM)
+            return False, f"{why}; " + (f"back on {record['original']}" if ok else detail)
+        # kept in the store: the next start tries again
+        logger.error(f"Server {server_id}: reset stopped at {why}, left on {plan}")
+        return False, f"{why}, left on {plan or '?'}"
+
+
+async def recover_resets(bot=None):
+    """Run at startup: finish resets the last run left half done, and say so."""
+    orchestrator = ResetOrchestrator({idx: api for idx, _name, api in all_apis()})
+    results, _took = await orchestrator.recover()
+    if not results:
+        return results
+    lines = [
+        f"{'✅' if r['ok'] else '❌'} `{r['server_id']}` {r.get('outcome', '')} — {r['detail']}"
+        for r in results
+    ]
+    logger.warning("Unfinished traffic resets picked up: " + "; ".join(lines))
+    if bot:
+        try:
+            await bot.send_message(
+                chat_id=Config.ADMIN_ID,
+                text="♻️ *Traffic resets interrupted by a restart*\n\n" + "\n".join(lines),
+                parse_mode="Markdown",
+            )
+        except Exception as e:
+            logger.error(f"Failed to report recovered resets: {e}")
+    return results
+
+
+def timing_report(results, took):
+    """Lines giving each phase's average and slowest time, and the total."""
+    lines = []
+    for phase, _step, label, _icon in PHASES:
+        times = [r["phases"][phase] for r in results if phase in r["phases"]]
+        if times:
+            lines.append(f"{label}: avg {sum(times) / len(times):.0f}s, max {max(times):.0f}s")
+    done = [r["took"] for r in results if r["ok"]]
+    one = f", {sum(done) / len(done):.0f}s per server" if done else ""
+    lines.append(f"Total: {took:.0f}s for {len(results)} server{'s' if len(results) != 1 else ''}{one}")
+    return lines
+
+
+class _VirtualClock(asyncio.SelectorEventLoop):
+    """An event loop whose clock jumps to the next timer instead of waiting.
+
+    Minutes of simulated API latency run in milliseconds, and loop.time()
+    (what the orchestrator times phases with) reads simulated seconds.
+    """
+
+    def __init__(self):
+        import selectors
+        clock = self
+
+        class Skip(selectors.DefaultSelector):
+            def select(self, timeout=None):
+                if timeout:
+                    clock._now += timeout
+                return super().select(0)
+
+        super().__init__(Skip())
+        self._now = 0.0
+
+    def time(self):
+        return self._now
+
+    @classmethod
+    def simulate(cls, coro):
+        """(what `coro` returns, simulated seconds it took)."""
+        loop = cls()
+
+        async def main():
+            try:
+                return await coro
+            finally:
+                # pollers still between rounds when the run ends
+                left = asyncio.all_tasks() - {asyncio.current_task()}
+                for task in left:
+                    task.cancel()
+                await asyncio.gather(*left, return_exceptions=True)
+
+        try:
+            return loop.run_until_complete(main()), loop.time()
+        finally:
+            loop.close()
+
+
+class _BenchAPI:
+    """A Hetzner account as the reset sees it, with rough real-world timings.
+
+    Requests go out one at a time, MIN_REQUEST_INTERVAL apart (the client's
+    throttle). Power off takes ~10 s, power on ~15 s, a plan change ~40 s,
+    each varied a little per server.
+    """
+
+    def __init__(self, n, seed=1):
+        import random
+        rnd = random.Random(seed)
+        self.types = [
+            {"name": "cx22", "architecture": "x86", "cores": 2, "memory": 4, "disk": 40, "prices": []},
+            {"name": "cx32", "architecture": "x86", "cores": 4, "memory": 8, "disk": 80, "prices": []},
+        ]
+        self.servers = {
+            i: {"id": i, "status": "running", "location": {"name": "fsn1"}, "server_type": dict(self.types[0]),
+                "outgoing_traffic": 0, "included_traffic": 20 * 1024 ** 4}
+            for i in range(1, n + 1)
+        }
+        self.speed = {i: rnd.uniform(0.8, 1.3) for i in self.servers}
+        self.bounce_table = None
+        self.actions = {}
+        self.rate_remaining = None
+        self.requests = 0
+        self._lock = asyncio.Lock()
+
+    async def _request(self):
+        from hetzner_api import MIN_REQUEST_INTERVAL
+        async with self._lock:
+            await asyncio.sleep(MIN_REQUEST_INTERVAL)
+            self.requests += 1
+
+    def _act(self, sid, seconds, **changes):
+        action = self.actions[len(self.actions) + 1] = {"id": len(self.actions) + 1, "status": "running"}
+
+        async def land():
+            await asyncio.sleep(seconds * self.speed[sid])
+            self.servers[sid].update(changes)
+            action["status"] = "success"
+        asyncio.ensure_future(land())
+        return {"action": dict(action)}
+
+    async def list_servers(self, fresh=False):
+        await self._request()
+        return [dict(s) for s in self.servers.values()]
+
+    async def get_server(self, sid, fresh=False):
+        await self._request()
+        return dict(self.servers[sid])
+
+    async def get_server_types(self):
+        await self._request()
+        return self.types
+
+    async def get_bounce_table(self, timings):
+        self.bounce_table = BounceTable.refresh(self.bounce_table, await self.get_server_types(), timings)
+        return self.bounce_table
+
+    async def get_actions(self, ids):
+        await self._request()
+        return [dict(self.actions[i]) for i in ids]
+
+    async def power_off(self, sid):
+        await self._request()
+        return self._act(sid, 10, status="off")
+
+    async def power_on(self, sid):
+        await self._request()
+        return self._act(sid, 15, status="running")
+
+    async def change_server_type(self, sid, plan, upgrade_disk=False):
+        await self._request()
+        self.servers[sid]["status"] = "migrating"
+        kind = next(t for t in self.types if t["name"] == plan)
+        return self._act(sid, 40, status="off", server_type=dict(kind))
+
+    async def wait_for_status(self, sid, status, max_attempts=40):
+        # the client's wait as it was: a look every 5 s
+        for _ in range(max_attempts):
+            if (await self.get_server(sid, fresh=True) or {}).get("status") == status:
+                return True
+            await asyncio.sleep(5)
+        return False
+
+
+async def _fixed_sleep_reset(api, sid):
+    """The single-server reset as it used to run: fixed sleeps and 5 s polls."""
+    server = await api.get_server(sid)
+    current = server["server_type"]["name"]
+    bounce = pick_upgrade_type(await api.get_server_types(), server["server_type"], "fsn1")["name"]
+    if server["status"] == "running":
+        await api.power_off(sid)
+        await api.wait_for_status(sid, "off")
+        await asyncio.sleep(2)
+    for plan, settle in ((bounce, 5), (current, 0)):
+        if settle == 0:
+            await api.power_off(sid)
+            await api.wait_for_status(sid, "off")
+            await asyncio.sleep(2)
+        await api.change_server_type(sid, plan)
+        await asyncio.sleep(5)
+        for _ in range(30):
+            if (await api.get_server(sid, fresh=True))["server_type"]["name"] == plan:
+                break
+            await asyncio.sleep(5)
+        await asyncio.sleep(3)
+        await api.power_on(sid)
+        await api.wait_for_status(sid, "running")
+        await asyncio.sleep(settle)
+    return True
+
+
+def bench(counts=(1, 10)):
+    """End-to-end reset time on a simulated account, before and after.
+
+    "before" is the old single-server reset, run once per server the way it
+    had to be done by hand; "after" is the orchestrator, waiting on actions.
+    """
+    import os
+    import tempfile
+    from overage_tracker import OverageTracker
+    from reset_store import ResetStore
+    from phase_timings import PhaseTimings
+
+    tmp = tempfile.mkdtemp()
+    for n in counts:
+        api = _BenchAPI(n)
+
+        async def before():
+            for sid in api.servers:
+                await _fixed_sleep_reset(api, sid)
+
+        _none, old_took = _VirtualClock.simulate(before())
+        old_calls = api.requests
+
+        api = _BenchAPI(n)
+        orch = ResetOrchestrator(
+            {0: api}, tracker=OverageTracker(os.path.join(tmp, f"o{n}.json")),
+            store=ResetStore(os.path.join(tmp, f"r{n}.json")),
+            timings=PhaseTimings(os.path.join(tmp, f"t{n}.json")),
+        )
+        (results, took), _end = _VirtualClock.simulate(orch.run([(0, sid) for sid in api.servers]))
+        assert all(r["ok"] for r in results)
+        print(f"{n:>3} server{'s' if n > 1 else ' '}  before {old_took:7.0f} s  {old_calls:5} requests"
+              f"   after {took:6.0f} s  {api.requests:4} requests   ({old_took / took:.1f}x faster)")
+        if n == 1:
+            print("    " + "\n    ".join(timing_report(results, took)))
+
+
+def demo():
+    import os
+    import tempfile
+    from overage_tracker import OverageTracker
+    from reset_store import ResetStore
+    from phase_timings import PhaseTimings
+
+    scale = 0.01                        # one fake "second"
+    types = [
+        {"name": "cx22", "architecture": "x86", "cores": 2, "memory": 4, "disk": 40,
+         "prices": [{"location": "fsn1", "price_hourly": {"gross": "0.01"}}]},
+        {"name": "cx32", "architecture": "x86", "cores": 4, "memory": 8, "disk": 80,
+         "prices": [{"location": "fsn1", "price_hourly": {"gross": "0.02"}}]},
+    ]
+
+    class FakeAPI:
+        """Power changes land after 3 "s", plan changes after 8."""
+
+        def __init__(self, ids):
+            self.servers = {
+                i: {"id": i, "name": f"s{i}", "status": "running", "location": {"name": "fsn1"},
+                    "server_type": dict(types[0]), "outgoing_traffic": 0, "included_traffic": 20 * 1024 ** 4}
+                for i in ids
+            }
+            self.rate_remaining = None
+            self.actions = {}
+            self.lists = self.gets = self.action_polls = 0
+            self.bounce_table = None
+
+        async def list_servers(self, fresh=False):
+            self.lists += 1
+            return [dict(s) for s in self.servers.values()]
+
+        async def get_server(self, server_id, fresh=False):
+            self.gets += 1
+            return dict(self.servers[server_id])
+
+        async def get_server_types(self):
+            return types
+
+        async def get_bounce_table(self, timings):
+            self.bounce_table = BounceTable.refresh(self.bounce_table, types, timings)
+            return self.bounce_table
+
+        async def get_actions(self, ids):
+            self.action_polls += 1
+            return [dict(self.actions[i]) for i in ids]
+
+        def _later(self, server_id, delay, **changes):
+            action = self.actions[len(self.actions) + 1] = {"id": len(self.actions) + 1, "status": "running"}
+
+            async def land():
+                await asyncio.sleep(delay * scale)
+                self.servers[server_id].update(changes)
+                action["status"] = "success"
+            asyncio.ensure_future(land())
+            return {"action": dict(action)}
+
+        async def power_off(self, server_id):
+            return self._later(server_id, 3, status="off")
+
+        async def power_on(self, server_id):
+            return self._later(server_id, 3, status="running")
+
+        async def change_server_type(self, server_id, plan, upgrade_disk=False):
+            self.servers[server_id]["status"] = "migrating"
+            kind = next(t for t in types if t["name"] == plan)
+            return self._later(server_id, 8, status="off", server_type=dict(kind))
+
+    tmp = tempfile.mkdtemp()
+    tracker = OverageTracker(os.path.join(tmp, "o.json"))
+    store = ResetStore(os.path.join(tmp, "r.json"))
+    timings = PhaseTimings(os.path.join(tmp, "t.json"))
+    for kind, fake_seconds in (("power_off", 3), ("power_on", 3), ("change_type", 8)):
+        timings.record(kind, "cx11", "nbg1", fake_seconds * scale)     # only the pooled guess fits
+    apis = {0: FakeAPI([1, 2, 3, 4]), 1: FakeAPI([5, 6])}
+    seen = []
+    orch = ResetOrchestrator(apis, per_account=2, poll_interval=scale, tracker=tracker, store=store,
+                             timings=timings)
+    targets = [(0, 1), (0, 2), (0, 3), (0, 4), (1, 5), (1, 6)]
+    results, took = asyncio.run(orch.run(targets, lambda *e: seen.append(e)))
+
+    assert all(r["ok"] for r in results), results
+    assert [r["server_id"] for r in results] == [1, 2, 3, 4, 5, 6]
+    assert all(s["server_type"]["name"] == "cx22" and s["status"] == "running"
+               for api in apis.values() for s in api.servers.values())
+    assert set(results[0]["phases"]) == set(PHASE_INDEX) and store.unfinished() == {}
+    one = results[0]["took"]
+    # account 0 runs two waves of two, account 1 one wave: about twice one reset
+    assert 1.6 * one < took < 2.6 * one, (one, took)
+    # steps end on their actions, one shared request per poll for all of them
+    assert apis[0].gets == 4 and apis[0].lists == 0 and apis[0].action_polls < took / scale, apis[0].action_polls
+    assert (6, "ok", "reset via cx32") in seen
+    assert any(sid == 3 and d.startswith("🔼 Upgrade… ~1s · ~1s left") for sid, _state, d in seen)
+    # every step was timed under the server's own key
+    assert len(timings._load()["change_type|cx32|fsn1|0"]) == 6
+    assert len(timings._load()["power_off|cx32|fsn1|0"]) == 6
+
+    # a reset cancelled while the server is on the bounce plan: finished before the job stops
+    crashed = FakeAPI([7])
+    orch7 = lambda: ResetOrchestrator({0: crashed}, poll_interval=scale, tracker=tracker, store=store,
+                                      timings=timings)
+
+    async def cancel_mid_bounce():
+        notes = []
+        task = asyncio.ensure_future(orch7().run([(0, 7)], lambda *e: notes.append(e)))
+        while (store.get(7) or {}).get("phase") != "boot":
+            await asyncio.sleep(scale)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return notes
+
+    notes = asyncio.run(cancel_mid_bounce())
+    assert store.unfinished() == {} and notes[-1][1:] == ("failed", "cancelled; reset via cx32"), notes[-1]
+    assert crashed.servers[7]["server_type"]["name"] == "cx22" and crashed.servers[7]["status"] == "running"
+    (r,), _ = asyncio.run(orch7().run([(0, 7)]))
+    assert r["ok"], r
+
+    # the bot stops while a server is on the bounce plan; the next start finishes the job
+    crashed.servers[7].update(status="off", server_type=dict(types[1]))
+    store.begin(7, 0, "cx22", "cx32", True, "boot")
+    (r,), _ = asyncio.run(ResetOrchestrator(
+        {0: crashed}, poll_interval=scale, tracker=tracker, store=store, timings=timings).recover())
+    assert r["ok"] and r["outcome"] == "resumed" and store.unfinished() == {}
+    assert crashed.servers[7]["server_type"]["name"] == "cx22" and crashed.servers[7]["status"] == "running"
+
+    # a record left by a stopped reset does not block the next one: it is rolled back first
+    crashed.servers[7]["status"] = "off"
+    store.begin(7, 0, "cx22", "cx32", True, "upgrade")
+    (r,), _ = asyncio.run(orch7().run([(0, 7)]))
+    assert r["ok"] and r["detail"] == "reset via cx32" and "outcome" not in r, r
+    assert crashed.servers[7]["status"] == "running" and store.unfinished() == {}
+
+    # stopped after powering off, before the upgrade landed: powered on again
+    crashed.servers[7]["status"] = "off"
+    store.begin(7, 0, "cx22", "cx32", True, "upgrade")
+    (r,), _ = asyncio.run(ResetOrchestrator(
+        {0: crashed}, poll_interval=scale, store=store, timings=timings).recover())
+    assert r["ok"] and r["outcome"] == "rolled back" and crashed.servers[7]["status"] == "running"
+
+    # a plan change that never lands: the server is put back on its own plan
+    stuck = FakeAPI([9])
+
+    async def never(server_id, plan, upgrade_disk=False):
+        stuck.servers[server_id]["status"] = "migrating"
+        return {"action": {}}
+
+    stuck.change_server_type = never
+    global TYPE_TIMEOUT, STATUS_TIMEOUT
+    saved, TYPE_TIMEOUT, STATUS_TIMEOUT = (TYPE_TIMEOUT, STATUS_TIMEOUT), 20 * scale, 20 * scale
+    try:
+        (r,), _ = asyncio.run(ResetOrchestrator(
+            {0: stuck}, poll_interval=scale, tracker=tracker, store=store, timings=timings,
+        ).run([(0, 9)]))
+    finally:
+        TYPE_TIMEOUT, STATUS_TIMEOUT = saved
+    assert not r["ok"] and r["detail"] == "Upgrade: timed out; back on cx22", r
+    assert stuck.servers[9]["status"] == "running" and store.unfinished() == {}
+
+    # a poll round that blows up: the next round carries on and the reset still lands quickly
+    flaky = FakeAPI([10])
+    real_get_actions, fails = flaky.get_actions, [2]
+
+    async def get_actions(ids):
+        if fails[0]:
+            fails[0] -= 1
+            raise RuntimeError("connection reset")
+        return await real_get_actions(ids)
+
+    flaky.get_actions = get_actions
+    (r,), flaky_took = asyncio.run(ResetOrchestrator(
+        {0: flaky}, poll_interval=scale, tracker=tracker, store=store, timings=timings,
+    ).run([(0, 10)]))
+    assert r["ok"] and not fails[0] and flaky_took < 2 * one, (r, flaky_took, one)
+
+    fake = [{**r, "took": r["took"] / scale, "phases": {p: t / scale for p, t in r["phases"].items()}}
+            for r in results]
+    print("reset_orchestrator demo OK, in fake seconds:")
+    print("\n".join(timing_report(fake, took / scale)))
+
+
+if __name__ == '__main__':
+    import sys
+    bench() if 'bench' in sys.argv[1:] else demo()
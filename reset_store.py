@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ResetStore:
+    """Traffic resets under way, written down after every step.
+
+    A reset spends minutes with the server on a larger, dearer plan. If the
+    bot stops in the middle, this file is what lets the next start find the
+    server and finish the job (see ResetOrchestrator.recover) instead of
+    leaving it on the bounce plan.
+
+    File format:
+      {"resets": {"123638116": {
+          "acct": 0,                  # account index
+          "original": "cx22",         # plan to end on
+          "bounce": "cx32",           # plan passed through
+          "was_running": true,        # powered on when the reset began
+          "phase": "downgrade",       # phase under way (see PHASES)
+          "started": "2026-10-19T22:51:07", "updated": "2026-10-19T22:53:40"}}}
+
+    A record is removed once its reset ends, whichever way. Every write
+    replaces the file whole (written beside it, then renamed), so a crash
+    mid-write leaves the previous version.
+    """
+
+    def __init__(self, data_file='reset_state.json'):
+        self.data_file = Path(data_file)
+
+    def _load(self):
+        if not self.data_file.exists():
+            return {}
+        try:
+            data = json.loads(self.data_file.read_text())
+            return data.get('resets', {}) if isinstance(data, dict) else {}
+        except Exception as e:
+            logger.error(f"Failed to load reset state: {e}")
+            return {}
+
+    def _save(self, resets):
+        try:
+            tmp = self.data_file.with_name(self.data_file.name + '.tmp')
+            with tmp.open('w') as f:
+                f.write(json.dumps({'resets': resets}, indent=2))
+                f.flush()
+                os.fsync(f.fileno())
+            tmp.replace(self.data_file)
+        except Exception as e:
+            logger.error(f"Failed to save reset state: {e}")
+
+    def begin(self, server_id, acct, original, bounce, was_running, phase):
+        resets = self._load()
+        now = datetime.now().isoformat(timespec='seconds')
+        resets[str(server_id)] = {
+            'acct': acct, 'original': original, 'bounce': bounce,
+            'was_running': was_running, 'phase': phase, 'started': now, 'updated': now,
+        }
+        self._save(resets)
+
+    def advance(self, server_id, phase):
+        """Record that the reset of `server_id` has moved on to `phase`."""
+        resets = self._load()
+        record = resets.get(str(server_id))
+        if record is None:
+            return
+        record['phase'] = phase
+        record['updated'] = datetime.now().isoformat(timespec='seconds')
+        self._save(resets)
+
+    def finish(self, server_id):
+        resets = self._load()
+        if resets.pop(str(server_id), None) is not None:
+            self._save(resets)
+
+    def get(self, server_id):
+        return self._load().get(str(server_id))
+
+    def unfinished(self):
+        """{server id (int): record} of every reset that never ended."""
+        return {int(sid): record for sid, record in self._load().items()}
+
+
+reset_store = ResetStore()
+
+
+def demo():
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'r.json')
+    s = ResetStore(path)
+    assert s.unfinished() == {}
+    s.begin(7, 1, 'cx22', 'cx32', True, 'power_off')
+    s.advance(7, 'upgrade')
+    s.advance(8, 'upgrade')                         # never begun: ignored
+    assert s.get(7)['phase'] == 'upgrade' and s.get(8) is None
+    again = ResetStore(path)                        # what the next start sees
+    assert list(again.unfinished()) == [7] and again.get(7)['bounce'] == 'cx32'
+    again.finish(7)
+    assert s.unfinished() == {} and not os.path.exists(path + '.tmp')
+    open(path, 'w').write('{not json')
+    assert s.unfinished() == {}                     # unreadable: logged, not raised
+    print('reset_store demo OK')
+
+
+if __name__ == '__main__':
+    demo()
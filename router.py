@@ -0,0 +1,175 @@
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 500               # most recent timings kept per route
+
+
+def flag(value):
+    """Parameter type for a "1"/"0" switch in callback data."""
+    return value == "1"
+
+
+class RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Router:
+    """Callback data -> handler, looked up instead of tested one by one.
+
+    A key without a trailing underscore matches the whole callback data
+    ("snap_new"); a key ending in one is a prefix ("snap_"), and whatever
+    follows it is split on "_" into the route's parameter types — the last
+    parameter takes the rest, underscores included. The longest registered
+    prefix wins, so "snapdel_confirm_" beats "snapdel_" however the table is
+    ordered.
+
+    Matching cuts the data at each underscore from the right and tries each
+    cut as a key: a handful of dict lookups, whatever the number of routes.
+
+    Every dispatch is timed and counted per route; errors are counted and
+    re-raised for the application's error handler.
+
+    A route added with `read_only=True` only draws a screen, so the bot may
+    drop it when a newer press makes it pointless (see inflight.py).
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._read_only = set()
+        self.stats = {}
+
+    def add(self, key, handler, *params, read_only=False):
+        if key in self._routes:
+            raise ValueError(f"route {key!r} registered twice")
+        self._routes[key] = (handler, params)
+        self.stats[key] = RouteStats()
+        if read_only:
+            self._read_only.add(key)
+
+    def read_only_key(self, data):
+        """The route `data` goes to if that route is read-only, else None."""
+        try:
+            found = self.match(data)
+        except ValueError:
+            return None
+        return found[0] if found and found[0] in self._read_only else None
+
+    def match(self, data):
+        """(key, handler, parsed args), or None when nothing is registered."""
+        route = self._routes.get(data)
+        if route and not data.endswith("_"):
+            return data, route[0], ()
+        cut = data.rfind("_")
+        while cut != -1:
+            key = data[:cut + 1]
+            route = self._routes.get(key)
+            if route:
+                handler, params = route
+                rest = data[cut + 1:]
+                raw = rest.split("_", len(params) - 1) if params else ([rest] if rest else [])
+                if len(raw) != len(params):
+                    return None
+                return key, handler, tuple(t(v) for t, v in zip(params, raw))
+            cut = data.rfind("_", 0, cut)
+        return None
+
+    async def dispatch(self, data, *args):
+        """Run the route for `data`; False when none matches."""
+        try:
+            found = self.match(data)
+        except ValueError:
+            logger.warning(f"Malformed callback data: {data!r}")
+            return False
+        if not found:
+            return False
+        key, handler, parsed = found
+        stats = self.stats[key]
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            await handler(*args, *parsed)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latencies.append(time.perf_counter() - start)
+        return True
+
+    def summary(self):
+        """[(key, calls, errors, p50 s, p95 s)] for every route used, slowest p95 first."""
+        rows = [
+            (key, s.calls, s.errors, s.percentile(50), s.percentile(95))
+            for key, s in self.stats.items() if s.calls
+        ]
+        return sorted(rows, key=lambda r: r[4], reverse=True)
+
+
+def demo():
+    import asyncio
+    seen = []
+
+    def h(name):
+        async def handler(*args):
+            seen.append((name,) + args)
+            if name == 'boom':
+                raise RuntimeError
+        return handler
+
+    r = Router()
+    r.add("snap_", h('snap'), int, read_only=True)
+    r.add("snap_new", h('new'))
+    r.add("snapdel_", h('del'), int)
+    r.add("snapdel_confirm_", h('delc'), int)
+    r.add("rebuildgo_", h('rebuild'), int, str)
+    r.add("resizego_", h('resize'), int, str, flag)
+    r.add("fipdelsel", h('ask'))
+    r.add("fipdelsel_yes", h('yes'))
+    r.add("boom_", h('boom'), int)
+
+    async def run():
+        for data in ("snap_new", "snap_7", "snapdel_confirm_8", "snapdel_9",
+                     "rebuildgo_5_debian_12_custom", "resizego_5_cpx22_1",
+                     "fipdelsel", "fipdelsel_yes"):
+            assert await r.dispatch(data, 'q', 'c'), data
+        assert not await r.dispatch("unknown_1", 'q', 'c')
+        assert not await r.dispatch("snap_x", 'q', 'c')        # bad int is not routed
+        assert not await r.dispatch("resizego_5", 'q', 'c')    # too few parts
+        try:
+            await r.dispatch("boom_1", 'q', 'c')
+            assert False, "errors must reach the error handler"
+        except RuntimeError:
+            pass
+
+    asyncio.run(run())
+    assert seen == [
+        ('new', 'q', 'c'), ('snap', 'q', 'c', 7), ('delc', 'q', 'c', 8), ('del', 'q', 'c', 9),
+        ('rebuild', 'q', 'c', 5, 'debian_12_custom'), ('resize', 'q', 'c', 5, 'cpx22', True),
+        ('ask', 'q', 'c'), ('yes', 'q', 'c'), ('boom', 'q', 'c', 1),
+    ], seen
+    assert r.read_only_key("snap_7") == "snap_" and r.read_only_key("snap_new") is None
+    assert r.read_only_key("snap_x") is None
+    stats = {row[0]: row for row in r.summary()}
+    assert stats['boom_'][1:3] == (1, 1) and stats['snap_'][1:3] == (1, 0)
+    assert 'snapdel_' in stats and 'unknown_' not in stats
+    try:
+        r.add("snap_", h('again'))
+        assert False
+    except ValueError:
+        pass
+    print('router demo OK')
+
+
+if __name__ == '__main__':
+    demo()
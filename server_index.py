@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+from utils import location_name, traffic_limit_tb
+
+logger = logging.getLogger(__name__)
+
+SORTS = ("traffic", "name", "location")
+MAX_VIEWS = 64                      # sorted / filtered views kept per index
+
+
+def _counting_since(server, month_start):
+    """When the server's traffic counter started counting this month (epoch s)."""
+    start = month_start
+    created = server.get("created")
+    if created:
+        try:
+            start = max(start, datetime.fromisoformat(created.replace("Z", "+00:00")))
+        except ValueError:
+            pass
+    return start.timestamp()
+
+
+class ServerIndex:
+    """One account's server list, laid out for paging, sorting and search.
+
+    Built from a single /servers fetch. Each server's traffic share, name
+    and location are worked out once; a view (sort + filters + search) is
+    computed on first use and kept, so turning pages, or going back to a
+    view seen before, is a slice of a list already in memory.
+
+    Views:
+      sort      "traffic" (highest share of the allowance first), "name"
+                or "location" (then name)
+      status    only servers with this status, e.g. "running"
+      location  only servers in this location, e.g. "fsn1"
+      search    only servers whose name or public IP contains this text
+                (any case)
+    """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.built_at = time.time()
+        self._pct = []
+        self._name = []
+        self._loc = []
+        self._text = []              # what a search looks in: name and IPs
+        for s in servers:
+            limit = traffic_limit_tb(s) * 1024 ** 4
+            self._pct.append((s.get("outgoing_traffic") or 0) / limit * 100 if limit else 0.0)
+            name = (s.get("name") or "").lower()
+            self._name.append(name)
+            self._loc.append(location_name(s) or "")
+            net = s.get("public_net") or {}
+            ips = ((net.get("ipv4") or {}).get("ip") or "", (net.get("ipv6") or {}).get("ip") or "")
+            self._text.append("\n".join((name, *ips)).lower())
+        month_start = datetime.now(timezone.utc).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0,
+        )
+        self._since = [_counting_since(s, month_start) for s in servers]
+        self.locations = sorted({loc for loc in self._loc if loc})
+        self.statuses = sorted({s.get("status") or "unknown" for s in servers})
+        self._sorted = {}
+        self._views = {}
+
+    def _order(self, sort):
+        order = self._sorted.get(sort)
+        if order is None:
+            positions = range(len(self.servers))
+            if sort == "traffic":
+                order = sorted(positions, key=lambda i: (-self._pct[i], self._name[i]))
+            elif sort == "location":
+                order = sorted(positions, key=lambda i: (self._loc[i], self._name[i]))
+            else:
+                order = sorted(positions, key=lambda i: self._name[i])
+            self._sorted[sort] = order
+        return order
+
+    def view(self, sort="traffic", status=None, location=None, search=None):
+        """Servers matching the filters, in `sort` order."""
+        search = (search or "").strip().lower() or None
+        key = (sort, status, location, search)
+        servers = self._views.get(key)
+        if servers is None:
+            servers = [
+                self.servers[i] for i in self._order(sort)
+                if (status is None or (self.servers[i].get("status") or "unknown") == status)
+                and (location is None or self._loc[i] == location)
+                and (search is None or search in self._text[i])
+            ]
+            if len(self._views) >= MAX_VIEWS:
+                self._views.clear()
+            self._views[key] = servers
+        return servers
+
+    def pace(self, position, now=None):
+        """Bytes an hour the server has sent since its counter started this month."""
+        elapsed = max((now or time.time()) - self._since[position], 60)
+        return (self.servers[position].get("outgoing_traffic") or 0) / elapsed * 3600
+
+    @staticmethod
+    def _past_limit(pct):
+        """Whether a server at `pct` of its allowance has used it up; 100% has."""
+        return pct >= 100
+
+    def _over(self):
+        """Positions of servers past their allowance."""
+        return (i for i, pct in enumerate(self._pct) if self._past_limit(pct))
+
+    def hours_to_limit(self, position, now=None):
+        """Hours until the server uses up its allowance at this month's pace.
+
+        0 once past it; None when it has sent nothing yet (no pace to go by).
+        """
+        pct = self._pct[position]
+        if self._past_limit(pct):
+            return 0.0
+        if pct <= 0:
+            return None
+        now = now or time.time()
+        elapsed = max(now - self._since[position], 60)
+        return elapsed * (100 - pct) / pct / 3600
+
+    def at_risk(self, k=10, by="time", overage=None, now=None):
+        """The `k` servers most at risk, as [(server, hours to limit or €)].
+
+        by="time": soonest to reach the allowance (servers already past it
+        first); by="overage": most owed for traffic beyond the allowance,
+        `overage(server)` giving the €. Only the k best are kept while
+        scanning (a bounded heap), so the fleet is never sorted.
+        """
+        now = now or time.time()
+        if by == "overage":
+            scored = ((overage(self.servers[i]), i) for i in self._over())
+            top = heapq.nlargest(k, scored)
+        else:
+            # ties (everything already past the limit) go to the furthest past
+            scored = ((self.hours_to_limit(i, now), -self._pct[i], i) for i in range(len(self.servers)))
+            top = [(h, i) for h, _pct, i in heapq.nsmallest(
+                k, ((h, p, i) for h, p, i in scored if h is not None))]
+        return [(self.servers[i], value) for value, i in top]
+
+    def over_limit(self):
+        """Servers already past their allowance, furthest past first."""
+        over = sorted(self._over(), key=lambda i: -self._pct[i])
+        return [self.servers[i] for i in over]
+
+    def page(self, page, per_page=10, **view):
+        """(servers on the page, page actually shown, page count, matches)."""
+        servers = self.view(**view)
+        pages = max(1, (len(servers) - 1) // per_page + 1)
+        page = max(0, min(page, pages - 1))
+        return servers[page * per_page:(page + 1) * per_page], page, pages, len(servers)
+
+
+class FleetIndex(ServerIndex):
+    """Every account's servers in one ServerIndex, each tagged with its account.
+
+    Hetzner server ids are global, so the account a server belongs to is
+    looked up by id.
+    """
+
+    def __init__(self, per_account):
+        self.account_of = {}
+        servers = []
+        for idx, account_servers in per_account:
+            for s in account_servers:
+                self.account_of[s.get("id")] = idx
+                servers.append(s)
+        super().__init__(servers)
+
+    @classmethod
+    async def fetch(cls, apis):
+        """Build from `all_apis()`, fetching every account at once."""
+        results = await asyncio.gather(
+            *(api.list_servers() for _idx, _name, api in apis), return_exceptions=True,
+        )
+        per_account = []
+        for (idx, name, _api), result in zip(apis, results):
+            if isinstance(result, Exception):
+                logger.error(f"Fleet: listing {name} failed: {result}")
+                result = []
+            per_account.append((idx, result))
+        return cls(per_account)
+
+
+class ServerIndexes:
+    """The latest ServerIndex of each account, and of all of them together."""
+
+    def __init__(self):
+        self._indexes = {}
+        self.fleet = None
+
+    def get(self, idx):
+        return self._indexes.get(idx)
+
+    async def rebuild(self, idx, api):
+        servers = await api.list_servers()
+        index = ServerIndex(servers)
+        self._indexes[idx] = index
+        return index
+
+    async def load(self, idx, api, rebuild=False):
+        """The account's index, fetched again only when asked or never built."""
+        index = None if rebuild else self._indexes.get(idx)
+        return index or await self.rebuild(idx, api)
+
+    async def load_fleet(self, apis, rebuild=False):
+        """The FleetIndex of `apis` (all_apis()), fetched again only when asked or never built."""
+        if rebuild or self.fleet is None:
+            self.fleet = await FleetIndex.fetch(apis)
+        return self.fleet
+
+
+server_indexes = ServerIndexes()
+
+
+def demo():
+    tb = 1024 ** 4
+    srv = lambda i, name, loc, used, status="running": {
+        'id': i, 'name': name, 'status': status, 'location': {'name': loc},
+        'outgoing_traffic': used * tb, 'included_traffic': 20 * tb,
+    }
+    servers = [
+        srv(1, 'web-2', 'fsn1', 4), srv(2, 'db-1', 'hel1', 18), srv(3, 'Web-1', 'fsn1', 11, 'off'),
+        srv(4, 'cache', 'nbg1', 0), srv(5, 'web-3', 'hel1', 19.5),
+    ]
+    ix = ServerIndex(servers)
+    ids = lambda ss: [s['id'] for s in ss]
+    assert ids(ix.view()) == [5, 2, 3, 1, 4]                       # hottest first
+    assert ids(ix.view(sort="name")) == [4, 2, 3, 1, 5]
+    assert ids(ix.view(sort="location")) == [3, 1, 2, 5, 4]
+    assert ids(ix.view(status="off")) == [3]
+    assert ids(ix.view(location="hel1", sort="name")) == [2, 5]
+    assert ids(ix.view(search="WEB", sort="name")) == [3, 1, 5]
+    assert ix.view(search="web") is ix.view(search=" Web ")        # same view, kept
+    assert ix.locations == ['fsn1', 'hel1', 'nbg1'] and ix.statuses == ['off', 'running']
+
+    page, shown, pages, total = ix.page(7, per_page=2)
+    assert (ids(page), shown, pages, total) == ([4], 2, 3, 5)     # clamped to the last page
+    assert ix.page(0, per_page=2, search="nothing")[1:] == (0, 1, 0)
+
+    class FakeAPI:
+        calls = 0
+
+        async def list_servers(self):
+            FakeAPI.calls += 1
+            return servers
+
+    async def run():
+        store, api = ServerIndexes(), FakeAPI()
+        a = await store.load(0, api)
+        assert await store.load(0, api) is a and FakeAPI.calls == 1   # page turns: no fetch
+        assert await store.load(0, api, rebuild=True) is not a and FakeAPI.calls == 2
+        f = await store.load_fleet([(0, 'A', api)])
+        assert await store.load_fleet([(0, 'A', api)]) is f and FakeAPI.calls == 3
+
+    asyncio.run(run())
+
+    # at-risk selection: pace since the start of the month
+    now = ix._since[0] + 10 * 86400                                   # ten days in
+    hot = ix.at_risk(k=3, now=now)
+    assert [s['id'] for s, _ in hot] == [5, 2, 3]
+    assert round(hot[0][1]) == round(240 * 0.5 / 19.5)                # 19.5 of 20 TB in 240 h
+    assert ix.hours_to_limit(3, now) is None                          # 'cache' sent nothing
+    over = ServerIndex([srv(7, 'a', 'fsn1', 25), srv(8, 'b', 'fsn1', 30), srv(9, 'c', 'fsn1', 5)])
+    euros = over.at_risk(k=5, by="overage", overage=lambda s: s['outgoing_traffic'] / tb - 20)
+    assert [(s['id'], v) for s, v in euros] == [(8, 10), (7, 5)]
+    assert [(s['id'], h) for s, h in over.at_risk(k=2, now=now)] == [(8, 0.0), (7, 0.0)]
+    assert [s['id'] for s in over.over_limit()] == [8, 7] and ix.over_limit() == []
+    at_limit = ServerIndex([srv(10, 'd', 'fsn1', 20)])              # exactly 100%: over in every view
+    assert [s['id'] for s in at_limit.over_limit()] == [10] and at_limit.hours_to_limit(0) == 0.0
+    assert [s['id'] for s, _ in at_limit.at_risk(by="overage", overage=lambda s: 0.0)] == [10]
+
+    with_ip = {**srv(6, 'mail', 'fsn1', 1), 'public_net': {'ipv4': {'ip': '203.0.113.7'}}}
+
+    class Account:
+        def __init__(self, servers, fail=False):
+            self.servers, self.fail = servers, fail
+
+        async def list_servers(self):
+            await asyncio.sleep(0.05)
+            if self.fail:
+                raise RuntimeError("boom")
+            return self.servers
+
+    apis = [(0, 'A', Account(servers[:3])), (1, 'B', Account(servers[3:] + [with_ip])),
+            (2, 'C', Account([], fail=True))]
+    start = time.perf_counter()
+    fleet = asyncio.run(FleetIndex.fetch(apis))
+    assert time.perf_counter() - start < 0.1                          # fetched side by side
+    assert ids(fleet.view()) == [5, 2, 3, 1, 6, 4]
+    assert [fleet.account_of[i] for i in ids(fleet.view())] == [1, 0, 0, 0, 1, 1]
+    assert ids(fleet.view(search="113.7")) == [6]                     # by IP
+
+    big = ServerIndex([srv(i, f's{i}', ('fsn1', 'hel1')[i % 2], i % 21) for i in range(5000)])
+    start = time.perf_counter()
+    for p in range(50):
+        big.page(p, sort="traffic", location="hel1")
+    per_turn = (time.perf_counter() - start) / 50 * 1e6
+    start = time.perf_counter()
+    big.at_risk(k=10)
+    top_ms = (time.perf_counter() - start) * 1000
+    print(f'server_index demo OK ({per_turn:.0f} µs per page turn, '
+          f'{top_ms:.1f} ms for the top 10 at risk, over 5000 servers)')
+
+
+if __name__ == '__main__':
+    demo()
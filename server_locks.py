@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import asynccontextmanager
+from hetzner_api import current_account
+
+logger = logging.getLogger(__name__)
+
+_held = contextvars.ContextVar('server_locks_held', default=frozenset())
+
+
+class ServerLocks:
+    """One lock per (account, server id), taken by everything that changes a server.
+
+    A traffic reset and an IP swap both power-cycle the server; run together,
+    each one's status waits see the other's power changes and give up or
+    undo them. Holding the server's lock for the whole flow makes the second
+    one wait for the first, while flows on other servers go on side by side.
+
+    The lock is re-entrant within a task (and the tasks it starts), so a flow
+    that holds it can call another flow that takes it too. Idle locks are
+    dropped. `stats` counts how often a flow had to wait and for how long.
+    """
+
+    def __init__(self):
+        self._locks = {}             # (account, server id) -> [asyncio.Lock, users, operation holding it]
+        self.stats = {"taken": 0, "waited": 0, "wait_seconds": 0.0, "longest_wait": 0.0}
+
+    def busy(self, server_id, acct=None):
+        """The operation holding the server's lock, or None."""
+        entry = self._locks.get((current_account() if acct is None else acct, server_id))
+        return entry[2] if entry and entry[0].locked() else None
+
+    @asynccontextmanager
+    async def hold(self, server_id, operation, acct=None, waiting=None):
+        """Hold the server's lock for the `async with` block.
+
+        `waiting(holder)` is called first if another operation holds it, with
+        that operation's name, so a caller can say why it is not moving.
+        """
+        key = (current_account() if acct is None else acct, server_id)
+        held = _held.get()
+        if key in held:
+            yield
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0, None])
+        entry[1] += 1
+        try:
+            holder = entry[2] if entry[0].locked() else None
+            if holder is not None:
+                logger.info(f"{operation} on server {server_id} waits for {holder}")
+                if waiting:
+                    waiting(holder)
+            start = time.monotonic()
+            await entry[0].acquire()
+            waited = time.monotonic() - start
+        except BaseException:
+            self._release_user(key, entry)
+            raise
+        self.stats["taken"] += 1
+        if holder is not None:
+            self.stats["waited"] += 1
+            self.stats["wait_seconds"] += waited
+            self.stats["longest_wait"] = max(self.stats["longest_wait"], waited)
+            logger.info(f"{operation} on server {server_id} waited {waited:.1f}s")
+        entry[2] = operation
+        token = _held.set(held | {key})
+        try:
+            yield
+        finally:
+            _held.reset(token)
+            entry[2] = None
+            entry[0].release()
+            self._release_user(key, entry)
+
+    def _release_user(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0 and self._locks.get(key) is entry:
+            del self._locks[key]
+
+    def summary(self):
+        """One line on how much waiting the locks caused, or "" before any was taken."""
+        s = self.stats
+        if not s["taken"]:
+            return ""
+        line = f"🔒 {s['taken']} server locks taken"
+        if s["waited"]:
+            line += (f", {s['waited']} had to wait (avg {s['wait_seconds'] / s['waited']:.0f}s, "
+                     f"longest {s['longest_wait']:.0f}s)")
+        return line
+
+
+server_locks = ServerLocks()
+
+
+def demo():
+    async def run():
+        locks = ServerLocks()
+        order = []
+
+        async def flow(name, server_id, seconds, acct=0, notes=None):
+            async with locks.hold(server_id, name, acct, waiting=notes.append if notes is not None else None):
+                order.append(f"{name}+")
+                await asyncio.sleep(seconds)
+                order.append(f"{name}-")
+
+        # the same server: one after the other; another server or account: side by side
+        notes = []
+        start = time.perf_counter()
+        await asyncio.gather(
+            flow("reset", 1, 0.05), flow("swap", 1, 0.01, notes=notes),
+            flow("resize", 2, 0.05), flow("power", 1, 0.05, acct=1),
+        )
+        took = time.perf_counter() - start
+        assert order.index("swap+") > order.index("reset-") and notes == ["reset"]
+        assert order.index("resize+") < order.index("reset-") and order.index("power+") < order.index("reset-")
+        assert 0.055 < took < 0.1, took
+        assert locks.stats["taken"] == 4 and locks.stats["waited"] == 1
+        assert 0.03 < locks.stats["longest_wait"] < 0.08
+        assert not locks._locks                                         # idle locks are dropped
+
+        # a flow holding the lock may call another that takes it
+        async with locks.hold(3, "rebuild", 0):
+            assert locks.busy(3, 0) == "rebuild"
+            async with locks.hold(3, "power", 0):
+                pass
+        assert locks.busy(3, 0) is None
+
+        # a waiter cancelled before it gets the lock leaves nothing behind
+        async def holder():
+            async with locks.hold(4, "reset", 0):
+                await asyncio.sleep(0.05)
+        first = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flow("swap", 4, 0))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        assert not locks._locks
+        print(locks.summary())
+
+    asyncio.run(run())
+    print('server_locks demo OK')
+
+
+if __name__ == '__main__':
+    demo()
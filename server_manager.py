@@ -1,8 +1,16 @@
 import asyncio
+import contextlib
 import logging
-from hetzner_api import hetzner_api
+from datetime import datetime
+from config import Config
+from hetzner_api import hetzner_api, APIS, current_account, last_failure_transient, RATE_LIMIT_SOFT_FLOOR
 from overage_tracker import overage_tracker
-from utils import overage_cost, location_name, type_family, type_price
+from utils import overage_cost, type_family, type_price, location_name
+from phase_timings import phase_timings, timed_wait, eta
+from bounce_plans import can_bounce_through
+from server_locks import server_locks
+from batch import run_bounded, budget_limit
+from progress import ProgressBus
 
 logger = logging.getLogger(__name__)
 
@@ -10,29 +18,12 @@ logger = logging.getLogger(__name__)
 def pick_upgrade_type(types, current, location):
     """Cheapest plan to pass through on the way to resetting the counter.
 
-    The target has to be at least as big as the current plan in every
-    dimension, disk included: the change runs with upgrade_disk=False so the
-    disk is never grown, and a type whose disk is smaller than the server
-    already has is not a valid target. Same family is preferred, so the plan
-    the server sits on for those two minutes stays close to what it was.
+    Any plan can_bounce_through allows; same family is preferred, so the
+    plan the server sits on for those two minutes stays close to what it
+    was. Resets pick from a BounceTable, which also weighs how long each
+    change has taken; this is the plain version of that choice.
     """
-    cores, memory, disk = (current.get(k, 0) or 0 for k in ('cores', 'memory', 'disk'))
-
-    def bigger(t):
-        return (
-            (t.get('cores', 0) or 0) >= cores
-            and (t.get('memory', 0) or 0) >= memory
-            and (t.get('disk', 0) or 0) >= disk
-            and ((t.get('cores', 0) or 0, t.get('memory', 0) or 0) != (cores, memory))
-        )
-
-    candidates = [
-        t for t in types
-        if t.get('name') != current.get('name')
-        and t.get('architecture') == current.get('architecture')
-        and not t.get('deprecation')
-        and bigger(t)
-    ]
+    candidates = [t for t in types if can_bounce_through(current, t)]
     if not candidates:
         return None
     family = type_family(current.get('name', ''))
@@ -40,143 +31,63 @@ def pick_upgrade_type(types, current, location):
     return min(same_family or candidates, key=lambda t: type_price(t, location))
 
 
-async def _upgrade_target(server):
-    types = await hetzner_api.get_server_types()
-    return pick_upgrade_type(types, server.get('server_type', {}), location_name(server))
+def settle_overage(server, tracker=overage_tracker):
+    """File the server's overage as avoided ahead of a reset; returns the €.
+
+    Resetting the counter is what stops Hetzner billing the overage, so it
+    leaves this month's bill and is recorded as saved.
+    """
+    overage = overage_cost(server)
+    if overage > 0:
+        tracker.update_live_overage(server['id'], overage)
+    owed = tracker.get_server_month_overage(server['id'])
+    tracker.commit_overage(server['id'])
+    return owed
+
+
+async def reset_server_traffic(server_id, progress=None):
+    """Reset one server's traffic counter on the current account.
+
+    Runs the same phases as a fleet reset (see reset_orchestrator.py), so
+    every step is written down and a restart part way through is picked up
+    at the next start. Each step is published on `progress` (a ProgressBus)
+    as an (emoji, message) line; the reset never waits for its subscribers.
+    Returns (ok, logs).
+    """
+    from reset_orchestrator import ResetOrchestrator    # it builds on this module
+    progress = progress or ProgressBus()
+    add_log = progress.publish
+
+    def changed(_sid, state, detail):
+        if state in ("running", "queued") and detail:
+            emoji, _, message = detail.partition(" ")
+            add_log(emoji, message)
 
-async def reset_server_traffic(server_id, progress_callback=None):
-    logs = []
-    
-    async def add_log(emoji, message):
-        logs.append((emoji, message))
-        if progress_callback:
-            await progress_callback(logs)
-    
+    add_log("📥", "Fetching server information...")
+    acct = current_account()
     try:
-        await add_log("📥", "Fetching server information...")
-        server = await hetzner_api.get_server(server_id)
-        
-        if not server:
-            await add_log("❌", "Failed to fetch server information")
-            return False, logs
-        
-        current_status = server.get('status')
-        current_type = server.get('server_type', {}).get('name')
-        
-        if not current_type:
-            await add_log("❌", "Could not determine current server type")
-            return False, logs
-        
-        await add_log("💾", f"Current plan: {current_type}")
-        
-        target = await _upgrade_target(server)
-
-        if not target:
-            await add_log("❌", f"No larger plan to bounce through for {current_type}")
-            return False, logs
-
-        upgrade_type = target["name"]
-        await add_log("🔼", f"Upgrade plan selected: {upgrade_type}")
-
-        # resetting the counter is what stops Hetzner billing the overage, so
-        # settle it now: it leaves this month's bill and is recorded as saved
-        overage = overage_cost(server)
-        if overage > 0:
-            overage_tracker.update_live_overage(server_id, overage)
-        owed = overage_tracker.get_server_month_overage(server_id)
-        overage_tracker.commit_overage(server_id)
-        if owed:
-            await add_log("💰", f"€{owed:.2f} overage cleared from this month's bill")
-
-        if current_status == "running":
-            await add_log("🔴", "Shutting down server...")
-            await hetzner_api.power_off(server_id)
-            
-            if not await hetzner_api.wait_for_status(server_id, "off", max_attempts=40):
-                await add_log("❌", "Server failed to shutdown")
-                return False, logs
-            
-            await add_log("✅", "Server is now OFF")
-            await asyncio.sleep(2)
-        
-        await add_log("🔼", f"Upgrading to {upgrade_type}...")
-        result = await hetzner_api.change_server_type(server_id, upgrade_type, upgrade_disk=False)
-        
-        if not result or (result.get('error')):
-            await add_log("❌", f"Upgrade request failed: {result.get('error', {}).get('message', 'Unknown error')}")
-            return False, logs
-        
-        await asyncio.sleep(5)
-        
-        await add_log("⏳", "Waiting for upgrade to complete...")
-        for i in range(30):
-            server = await hetzner_api.get_server(server_id, fresh=True)
-            if server and server.get('server_type', {}).get('name') == upgrade_type:
-                await add_log("✅", "Upgrade completed successfully")
-                break
-            await asyncio.sleep(5)
-            if (i + 1) % 6 == 0:
-                await add_log("⏳", f"Still upgrading... ({(i+1)*5}s elapsed)")
-        
-        await asyncio.sleep(3)
-        
-        await add_log("🟢", "Starting server...")
-        await hetzner_api.power_on(server_id)
-        
-        if not await hetzner_api.wait_for_status(server_id, "running", max_attempts=40):
-            await add_log("⚠️", "Server started but status check timed out")
-        else:
-            await add_log("✅", "Server is now RUNNING")
-        
-        await asyncio.sleep(5)
-        
-        await add_log("🔽", f"Downgrading back to {current_type}...")
-        await hetzner_api.power_off(server_id)
-        
-        if not await hetzner_api.wait_for_status(server_id, "off", max_attempts=40):
-            await add_log("❌", "Failed to shutdown for downgrade")
-            return False, logs
-        
-        await asyncio.sleep(2)
-        
-        result = await hetzner_api.change_server_type(server_id, current_type, upgrade_disk=False)
-        
-        if not result or (result.get('error')):
-            await add_log("❌", f"Downgrade request failed: {result.get('error', {}).get('message', 'Unknown error')}")
-            return False, logs
-        
-        await asyncio.sleep(5)
-        
-        await add_log("⏳", "Waiting for downgrade to complete...")
-        for i in range(30):
-            server = await hetzner_api.get_server(server_id, fresh=True)
-            if server and server.get('server_type', {}).get('name') == current_type:
-                await add_log("✅", "Downgrade completed successfully")
-                break
-            await asyncio.sleep(5)
-            if (i + 1) % 6 == 0:
-                await add_log("⏳", f"Still downgrading... ({(i+1)*5}s elapsed)")
-        
-        await asyncio.sleep(3)
-        
-        await add_log("🟢", "Starting server with original plan...")
-        await hetzner_api.power_on(server_id)
-        
-        if not await hetzner_api.wait_for_status(server_id, "running", max_attempts=40):
-            await add_log("⚠️", "Server started but status check timed out")
-        else:
-            await add_log("✅", "Server is now RUNNING")
-        
-        await add_log("🎉", "Traffic reset process completed!")
-        return True, logs
-        
+        (result,), _took = await ResetOrchestrator({acct: APIS[acct]}).run([(acct, server_id)], changed)
     except Exception as e:
         logger.error(f"Error during traffic reset: {e}")
-        await add_log("❌", f"Unexpected error: {str(e)}")
-        return False, logs
+        add_log("❌", f"Unexpected error: {str(e)}")
+        return False, list(progress.lines)
+    if result["ok"]:
+        add_log("🎉", "Traffic reset process completed!")
+    else:
+        add_log("❌", result["detail"])
+    return result["ok"], list(progress.lines)
+
 
+POWER_TIMEOUT = 200                 # seconds a power change may take during an IP swap
+CALLS_PER_SWAP = 8                  # requests one IP swap sends, status checks aside
 
-async def swap_primary_ip(server_id, new_ip_id, api=None, progress_callback=None):
+
+def _eta(server, kind):
+    stype = (server.get('server_type') or {}).get('name')
+    return eta(phase_timings.estimate(kind, stype, location_name(server)))
+
+
+async def swap_primary_ip(server_id, new_ip_id, api=None, progress=None):
     """Put a different primary IP on a server.
 
     Hetzner refuses both halves of this while the server runs, so it is powered
@@ -184,120 +95,183 @@ async def swap_primary_ip(server_id, new_ip_id, api=None, progress_callback=None
     The IP that comes off is left unassigned rather than deleted.
 
     If attaching the new IP fails, the old one goes back on and the server is
-    started again, so it never ends up running without the IP it had.
+    started again, so it never ends up running without the IP it had. Steps
+    are published on `progress` as in reset_server_traffic.
     """
     api = api or hetzner_api
-    logs = []
+    progress = progress or ProgressBus()
+    add_log = progress.publish
+    waiting = lambda holder: add_log("⏳", f"Waiting for {holder} to finish...")
 
-    async def add_log(emoji, message):
-        logs.append((emoji, message))
-        if progress_callback:
-            await progress_callback(logs)
+    async with server_locks.hold(server_id, "IP swap", waiting=waiting):
+        try:
+            server = await api.get_server(server_id, fresh=True)
+            if not server:
+                add_log("❌", "Failed to fetch server information")
+                return False, list(progress.lines)
+            return await _swap(api, server, new_ip_id, add_log), list(progress.lines)
 
-    try:
-        server = await api.get_server(server_id, fresh=True)
-        if not server:
-            await add_log("❌", "Failed to fetch server information")
-            return False, logs
+        except Exception as e:
+            logger.error(f"Error during IP swap: {e}")
+            add_log("❌", f"Unexpected error: {str(e)}")
+            return False, list(progress.lines)
 
-        name = server.get('name', 'Server')
-        was_running = server.get('status') == 'running'
-        old = (server.get('public_net') or {}).get('ipv4') or {}
-        old_id, old_ip = old.get('id'), old.get('ip')
 
-        if was_running:
-            await add_log("🔴", f"Shutting down {name}...")
-            await api.power_off(server_id)
-            if not await api.wait_for_status(server_id, "off", max_attempts=40):
-                await add_log("❌", "Server failed to shut down — nothing was changed")
-                return False, logs
-            await add_log("✅", "Server is now OFF")
-        else:
-            await add_log("💤", "Server is already off")
+async def _swap(api, server, new_ip_id, add_log, gate=None):
+    """The steps of swap_primary_ip on a fetched server. True once the new IP is on.
 
+    `add_log(emoji, message)` is told each step and must not block.
+
+    `gate` (a semaphore) bounds the unassign / assign in the middle; the
+    power changes around it are not held back by it.
+    """
+    server_id = server['id']
+    name = server.get('name', 'Server')
+    was_running = server.get('status') == 'running'
+    old = (server.get('public_net') or {}).get('ipv4') or {}
+    old_id, old_ip = old.get('id'), old.get('ip')
+
+    if was_running:
+        add_log("🔴", f"Shutting down {name}... {_eta(server, 'power_off')}")
+        if not await timed_wait(api, await api.power_off(server_id), "power_off", server, timeout=POWER_TIMEOUT):
+            add_log("❌", "Server failed to shut down — nothing was changed")
+            return False
+        add_log("✅", "Server is now OFF")
+    else:
+        add_log("💤", "Server is already off")
+
+    async with gate or contextlib.nullcontext():
         if old_id:
-            await add_log("✂️", f"Removing {old_ip}...")
+            add_log("✂️", f"Removing {old_ip}...")
             if await api.unassign_primary_ip(old_id) is None:
-                await add_log("❌", f"Could not remove {old_ip}")
+                add_log("❌", f"Could not remove {old_ip}")
                 if was_running:
                     await api.power_on(server_id)
-                return False, logs
-            await add_log("✅", f"{old_ip} is now free")
+                return False
+            add_log("✅", f"{old_ip} is now free")
 
-        await add_log("📎", "Attaching the new IP...")
-        if await api.assign_primary_ip(new_ip_id, server_id) is None:
-            await add_log("❌", "Could not attach the new IP — putting the old one back")
+        add_log("📎", "Attaching the new IP...")
+        attached = await api.assign_primary_ip(new_ip_id, server_id) is not None
+        if not attached:
+            add_log("❌", "Could not attach the new IP — putting the old one back")
             if old_id:
                 # the new IP never went on, so only the old one needs restoring
                 if await api.assign_primary_ip(old_id, server_id) is not None:
-                    await add_log("↩️", f"{old_ip} is back on the server")
+                    add_log("↩️", f"{old_ip} is back on the server")
                 else:
-                    await add_log("⚠️", f"{old_ip} could NOT be put back — the server has no IPv4")
-            if was_running:
-                await api.power_on(server_id)
-                await add_log("🟢", "Server started again")
-            return False, logs
-
+                    add_log("⚠️", f"{old_ip} could NOT be put back — the server has no IPv4")
+    if not attached:
         if was_running:
-            await add_log("🟢", "Starting server...")
             await api.power_on(server_id)
-            if not await api.wait_for_status(server_id, "running", max_attempts=40):
-                await add_log("⚠️", "Server started but the status check timed out")
-            else:
-                await add_log("✅", "Server is now RUNNING")
+            add_log("🟢", "Server started again")
+        return False
 
-        await add_log("🎉", "IP swap completed!")
-        return True, logs
+    if was_running:
+        add_log("🟢", f"Starting server... {_eta(server, 'power_on')}")
+        if not await timed_wait(api, await api.power_on(server_id), "power_on", server, timeout=POWER_TIMEOUT):
+            add_log("⚠️", "Server started but the status check timed out")
+        else:
+            add_log("✅", "Server is now RUNNING")
 
-    except Exception as e:
-        logger.error(f"Error during IP swap: {e}")
-        await add_log("❌", f"Unexpected error: {str(e)}")
-        return False, logs
+    add_log("🎉", "IP swap completed!")
+    return True
 
 
-async def detach_primary_ip(server_id, pip_id, api=None, progress_callback=None):
-    """Take a primary IP off a server, leaving it without a public IPv4."""
-    api = api or hetzner_api
-    logs = []
+async def swap_primary_ips(swaps, api=None, on_change=None, limit=None):
+    """Put new primary IPs on many servers of the current account at once.
 
-    async def add_log(emoji, message):
-        logs.append((emoji, message))
-        if progress_callback:
-            await progress_callback(logs)
+    `swaps` maps server id to the primary IP id to put on it, or to None for
+    a fresh IPv4 created in the server's location. Every server goes through
+    the steps of swap_primary_ip, with the same rollback, on its own: all of
+    them power off and on again at the same time, and at most `limit` are
+    between unassigning and assigning (BATCH_CONCURRENCY, fewer when the API
+    budget runs low). A fresh IP that did not end up on its server is
+    deleted again.
 
-    try:
-        server = await api.get_server(server_id, fresh=True)
-        if not server:
-            await add_log("❌", "Failed to fetch server information")
-            return False, logs
-        was_running = server.get('status') == 'running'
+    `on_change(server_id, state, detail)` as in batch.run_bounded. Returns
+    [(server_id, ok, detail)] in the order of `swaps`; on success the detail
+    is "old IP → new IP".
+    """
+    api = api or hetzner_api
+    limit = limit or budget_limit(Config.BATCH_CONCURRENCY, api.rate_remaining, CALLS_PER_SWAP,
+                                  RATE_LIMIT_SOFT_FLOOR)
+    gate = asyncio.Semaphore(max(1, limit))
+    stamp = datetime.now().strftime('%y%m%d%H%M')
+
+    async def one(server_id, note):
+        why = []                     # the first thing that went wrong
+
+        def add_log(emoji, message):
+            if emoji == "❌" and not why:
+                why.append(message)
+            note(f"{emoji} {message}")
+
+        async with server_locks.hold(server_id, "IP swap", waiting=lambda h: note(f"⏳ waiting for {h} to finish")):
+            server = await api.get_server(server_id, fresh=True)
+            if not server:
+                return False, "could not fetch the server"
+            new_ip_id, new_ip, created = swaps[server_id], "new IP", None
+            if new_ip_id is None:
+                note("🆕 creating a new IPv4")
+                ip_name = f"{server.get('name', server_id)}-{stamp}"
+                result = await api.create_primary_ip('ipv4', location_name(server), ip_name)
+                created = (result or {}).get('primary_ip')
+                if not created and last_failure_transient():
+                    created = await api.find_primary_ip(ip_name)    # made, but the answer was lost
+                if not created:
+                    return False, "could not create a new IPv4"
+                new_ip_id, new_ip = created['id'], created.get('ip') or new_ip
+            old_ip = ((server.get('public_net') or {}).get('ipv4') or {}).get('ip') or "no IPv4"
+            ok = False
+            try:
+                ok = await _swap(api, server, new_ip_id, add_log, gate)
+            finally:
+                if created and not ok and await api.delete_primary_ip(new_ip_id) is None:
+                    logger.warning(f"IP swap of {server_id}: could not delete unused IP {new_ip}")
+            return ok, f"{old_ip} → {new_ip}" if ok else (why[0] if why else "failed")
+
+    return await run_bounded(list(swaps), one, len(swaps) or 1, on_change)
+
+
+async def detach_primary_ip(server_id, pip_id, api=None, progress=None):
+    """Take a primary IP off a server, leaving it without a public IPv4."""
+    api = api or hetzner_api
+    progress = progress or ProgressBus()
+    add_log = progress.publish
+    waiting = lambda holder: add_log("⏳", f"Waiting for {holder} to finish...")
+
+    async with server_locks.hold(server_id, "IP detach", waiting=waiting):
+        try:
+            server = await api.get_server(server_id, fresh=True)
+            if not server:
+                add_log("❌", "Failed to fetch server information")
+                return False, list(progress.lines)
+            was_running = server.get('status') == 'running'
 
-        if was_running:
-            await add_log("🔴", f"Shutting down {server.get('name', 'Server')}...")
-            await api.power_off(server_id)
-            if not await api.wait_for_status(server_id, "off", max_attempts=40):
-                await add_log("❌", "Server failed to shut down — nothing was changed")
-                return False, logs
-            await add_log("✅", "Server is now OFF")
-
-        await add_log("✂️", "Removing the IP...")
-        if await api.unassign_primary_ip(pip_id) is None:
-            await add_log("❌", "Could not remove the IP")
             if was_running:
-                await api.power_on(server_id)
-            return False, logs
+                add_log("🔴", f"Shutting down {server.get('name', 'Server')}... {_eta(server, 'power_off')}")
+                if not await timed_wait(api, await api.power_off(server_id), "power_off", server, timeout=POWER_TIMEOUT):
+                    add_log("❌", "Server failed to shut down — nothing was changed")
+                    return False, list(progress.lines)
+                add_log("✅", "Server is now OFF")
+
+            add_log("✂️", "Removing the IP...")
+            if await api.unassign_primary_ip(pip_id) is None:
+                add_log("❌", "Could not remove the IP")
+                if was_running:
+                    await api.power_on(server_id)
+                return False, list(progress.lines)
 
-        if was_running:
-            await add_log("🟢", "Starting server...")
-            await api.power_on(server_id)
-            await api.wait_for_status(server_id, "running", max_attempts=40)
-        await add_log("🎉", "The IP is now free. The server has no public IPv4.")
-        return True, logs
+            if was_running:
+                add_log("🟢", f"Starting server... {_eta(server, 'power_on')}")
+                await timed_wait(api, await api.power_on(server_id), "power_on", server, timeout=POWER_TIMEOUT)
+            add_log("🎉", "The IP is now free. The server has no public IPv4.")
+            return True, list(progress.lines)
 
-    except Exception as e:
-        logger.error(f"Error during IP detach: {e}")
-        await add_log("❌", f"Unexpected error: {str(e)}")
-        return False, logs
+        except Exception as e:
+            logger.error(f"Error during IP detach: {e}")
+            add_log("❌", f"Unexpected error: {str(e)}")
+            return False, list(progress.lines)
 
 
 def demo():
@@ -362,9 +336,12 @@ class _StubAPI:
     async def power_on(self, sid):
         self.calls.append('power_on'); self.status = 'running'; return {}
 
-    async def wait_for_status(self, sid, status, max_attempts=40):
+    async def wait_for_status(self, sid, status, max_attempts=40, expected=None):
         return 'wait_fail' not in self.fail
 
+    async def wait_for_action(self, result, timeout=300, server_id=None, status=None, expected=None):
+        return await self.wait_for_status(server_id, status)
+
     async def unassign_primary_ip(self, pid):
         self.calls.append(f'unassign:{pid}')
         if 'unassign' in self.fail:
@@ -382,6 +359,9 @@ class _StubAPI:
 
 def _swap_demo():
     import asyncio
+    import tempfile
+    from pathlib import Path
+    phase_timings.data_file = Path(tempfile.mkdtemp()) / 't.json'   # keep the real history clean
 
     # happy path: off, old IP removed, new one attached, started again
     api = _StubAPI()
@@ -418,6 +398,112 @@ def _swap_demo():
     assert ok and api.calls == ['power_off', 'unassign:55', 'power_on'], api.calls
     assert api.assigned is None
 
+    _batch_swap_demo()
+
+
+class _FleetStubAPI:
+    """Several servers, each power change and IP change taking a little while."""
+
+    rate_remaining = None
+
+    def __init__(self, count, fail_assign=()):
+        self.servers = {sid: {'status': 'running', 'ip': 100 + sid} for sid in range(1, count + 1)}
+        self.fail_assign = set(fail_assign)
+        self.created, self.deleted = [], []
+        self.made, self.lose_answer = {}, set()
+        self.changing = self.most_changing = self.off = self.most_off = 0
+
+    async def get_server(self, sid, fresh=False):
+        s = self.servers[sid]
+        return {'id': sid, 'name': f's{sid}', 'status': s['status'], 'location': {'name': 'fsn1'},
+                'public_net': {'ipv4': {'id': s['ip'], 'ip': f'10.0.0.{s["ip"]}'} if s['ip'] else None}}
+
+    async def _power(self, sid, status):
+        await asyncio.sleep(0.02)
+        self.servers[sid]['status'] = status
+        self.off += -1 if status == 'running' else 1
+        self.most_off = max(self.most_off, self.off)
+        return {}
+
+    async def power_off(self, sid):
+        return await self._power(sid, 'off')
+
+    async def power_on(self, sid):
+        return await self._power(sid, 'running')
+
+    async def wait_for_action(self, result, timeout=300, server_id=None, status=None, expected=None):
+        return True
+
+    async def _change(self):
+        self.changing += 1
+        self.most_changing = max(self.most_changing, self.changing)
+        await asyncio.sleep(0.01)
+        self.changing -= 1
+
+    async def unassign_primary_ip(self, pid):
+        await self._change()
+        for s in self.servers.values():
+            if s['ip'] == pid:
+                s['ip'] = None
+        return {}
+
+    async def assign_primary_ip(self, pid, sid):
+        await self._change()
+        if pid in self.fail_assign:
+            return None
+        self.servers[sid]['ip'] = pid
+        return {}
+
+    async def create_primary_ip(self, ip_type, location, name):
+        pid = 500 + len(self.created)
+        self.created.append(pid)
+        self.made[name] = {'id': pid, 'ip': f'10.9.9.{pid - 500}', 'name': name}
+        if pid in self.lose_answer:
+            from hetzner_api import _last_error
+            _last_error.set((None, 'network'))
+            return None
+        return {'primary_ip': self.made[name]}
+
+    async def find_primary_ip(self, name):
+        return self.made.get(name)
+
+    async def delete_primary_ip(self, pid):
+        self.deleted.append(pid)
+        return {}
+
+
+def _batch_swap_demo():
+    import time
+
+    # eight servers, fresh IPs for all, two IP changes at a time; the new IP 502
+    # (third server) will not attach
+    api = _FleetStubAPI(8, fail_assign={502})
+    api.lose_answer = {504}                         # made, but its answer never arrives
+    seen = []
+    start = time.perf_counter()
+    results = asyncio.run(swap_primary_ips(
+        dict.fromkeys(api.servers), api=api, limit=2, on_change=lambda *c: seen.append(c),
+    ))
+    took = time.perf_counter() - start
+    assert [sid for sid, _ok, _d in results] == list(range(1, 9))
+    failed = [sid for sid, ok, _d in results if not ok]
+    assert failed == [3], results
+    assert results[0][2] == '10.0.0.101 → 10.9.9.0'
+    # rolled back: the old IP is back, the server runs, the unused new IP is gone
+    assert api.servers[3] == {'status': 'running', 'ip': 103} and api.deleted == [502]
+    assert 504 in [s['ip'] for s in api.servers.values()] and len(api.created) == 8   # found, not made twice
+    assert all(s['status'] == 'running' for s in api.servers.values())
+    assert api.most_changing <= 2 and api.most_off == 8            # all off at once
+    assert any(detail.startswith('📎') for _sid, _state, detail in seen)      # progress per server
+    # one at a time this is 8 × (2 power changes + 2 IP changes); side by side much less
+    assert took < 8 * 0.06 / 2, took
+
+    # a mapping of servers to given IPs
+    api = _FleetStubAPI(2)
+    results = asyncio.run(swap_primary_ips({1: 201, 2: 202}, api=api))
+    assert all(ok for _sid, ok, _d in results) and not api.created
+    assert [s['ip'] for s in api.servers.values()] == [201, 202]
+
 
 if __name__ == '__main__':
     demo()
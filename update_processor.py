@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from inflight import inflight
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_UPDATES = 32
+
+# Callback data that belongs to a text conversation (the SSH console, the
+# price editor, the server search): these are ordered together with the
+# chat's text messages.
+CONVERSATION_PREFIXES = (
+    "console_", "auth_", "priceset_", "priceclear_", "pricecancel_", "lsearch", "fsearch",
+)
+
+
+def serial_key(update):
+    """What an update has to wait its turn behind.
+
+    A button press on a panel waits only for earlier presses on the same
+    message, so a reset running in one panel does not hold up another.
+    Text messages, and the buttons of the conversations that read them,
+    share one key per chat so a conversation sees its steps in order.
+    """
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat.id if update.effective_chat else None
+    query = update.callback_query
+    if query and query.message and not (query.data or "").startswith(CONVERSATION_PREFIXES):
+        return (chat, query.message.message_id)
+    return (chat,)
+
+
+class SerialPerConversation(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time per `serial_key`."""
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}           # key -> [lock, updates holding or waiting]
+
+    async def do_process_update(self, update, coroutine):
+        key = serial_key(update)
+        if key is None:
+            await coroutine
+            return
+        if len(key) == 2:
+            # a newer press on a panel stops the screen still loading there,
+            # instead of queueing behind it
+            inflight.arrived(key, update.update_id)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+                inflight.forget(key)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def demo():
+    import itertools
+    from types import SimpleNamespace as NS
+    ids = itertools.count(1)
+
+    class FakeUpdate(Update):
+        def __init__(self, chat, msg=None, data=None):
+            self._chat, self._msg, self._data = chat, msg, data
+            self._uid = next(ids)
+
+        @property
+        def update_id(self):
+            return self._uid
+
+        @property
+        def effective_chat(self):
+            return NS(id=self._chat)
+
+        @property
+        def callback_query(self):
+            if self._data is None:
+                return None
+            return NS(data=self._data, message=NS(message_id=self._msg))
+
+    order = []
+
+    async def work(name, delay):
+        order.append(f"{name}+")
+        await asyncio.sleep(delay)
+        order.append(f"{name}-")
+
+    async def run():
+        p = SerialPerConversation()
+        await asyncio.gather(
+            p.process_update(FakeUpdate(1, 10, "reset_5"), work("reset", 0.05)),
+            p.process_update(FakeUpdate(1, 11, "server_6"), work("other", 0.01)),
+            p.process_update(FakeUpdate(1, 10, "refresh_5"), work("again", 0.01)),
+            p.process_update(FakeUpdate(1, 12, "auth_password"), work("auth", 0.02)),
+            p.process_update(FakeUpdate(1), work("text", 0.01)),
+        )
+        assert not p._locks, "locks leak"
+
+    asyncio.run(run())
+    # another panel ran while the reset was still going ...
+    assert order.index("other-") < order.index("reset-"), order
+    # ... but a second press on the same panel waited for it
+    assert order.index("again+") > order.index("reset-"), order
+    # a conversation's button and the chat's text stay in order
+    assert order.index("text+") > order.index("auth-"), order
+    print('update_processor demo OK')
+
+
+if __name__ == '__main__':
+    demo()
@@ -71,8 +71,16 @@ def type_family(name):
     return ''.join(c for c in (name or '') if c.isalpha()).lower()
 
 
-def type_price(stype, location):
-    """Net monthly price of a server type at a location."""
+def type_price(stype, location, index=None):
+    """Net monthly price of a server type at a location.
+
+    With a PricingIndex it is a lookup; the type's own price list is only
+    read when the index does not know the type.
+    """
+    if index is not None:
+        hit = index.server_price((stype or {}).get('name'), location)
+        if hit is not None:
+            return hit
     prices = (stype or {}).get('prices', [])
     entry = next((p for p in prices if p.get('location') == location), None)
     entry = entry or (prices[0] if prices else {})
@@ -82,13 +90,17 @@ def type_price(stype, location):
         return 0.0
 
 
-def traffic_price_per_tb(server):
+def traffic_price_per_tb(server, index=None):
     """Net price of one TB over the included traffic, for this server.
 
     Hetzner quotes it per location on the server type, so it is read from
     there rather than assumed.
     """
     loc = location_name(server)
+    if index is not None:
+        hit = index.traffic_per_tb((server or {}).get('server_type', {}).get('name'), loc)
+        if hit is not None:
+            return hit
     prices = (server or {}).get('server_type', {}).get('prices', [])
     entry = next((p for p in prices if p.get('location') == loc), None) or (prices[0] if prices else {})
     try:
@@ -97,10 +109,10 @@ def traffic_price_per_tb(server):
         return 1.0
 
 
-def overage_cost(server):
+def overage_cost(server, index=None):
     """Net EUR currently owed for traffic beyond this server's allowance."""
     tb = (server or {}).get('outgoing_traffic', 0) / (1024 ** 4)
-    return max(0.0, tb - traffic_limit_tb(server)) * traffic_price_per_tb(server)
+    return max(0.0, tb - traffic_limit_tb(server)) * traffic_price_per_tb(server, index)
 
 
 def format_traffic(bytes_value, limit_tb=None):
@@ -168,6 +180,15 @@ def demo():
     srv['outgoing_traffic'] = 5 * 1024 ** 4
     assert overage_cost(srv) == 0                        # under the allowance
     assert traffic_price_per_tb({}) == 1.0               # no price data -> default
+    # an index answers first, the embedded list is the fallback
+    from pricing_index import PricingIndex
+    idx = PricingIndex({}, [{'name': 'cx23', 'prices': [
+        {'location': 'hel1', 'price_monthly': {'net': '3.99'}, 'price_per_tb_traffic': {'net': '2.00'}}]}])
+    srv['server_type']['name'] = 'cx23'
+    srv['outgoing_traffic'] = 23 * 1024 ** 4
+    assert overage_cost(srv, idx) == 6.0
+    assert type_price({'name': 'cx23'}, 'hel1', idx) == 3.99
+    assert type_price({'name': 'other', 'prices': []}, 'hel1', idx) == 0.0
     print('utils demo OK')
 
 